@@ -0,0 +1,285 @@
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import time
+import typing
+
+import core
+from core.user import verification_cache
+
+
+Result = typing.Dict[str, typing.Any]
+
+
+def measure(function: typing.Callable[..., typing.Any],
+            min_time: float = 1.0,
+            min_count: int = 3,
+            setup: typing.Callable[[], typing.Any] = None) -> Result:
+
+    """ Call function repeatedly, at least min_time seconds and min_count
+    times, and summarize the elapsed times.
+
+    If setup is given, function is called with the result of setup, that is
+    called before each call and not measured.
+    """
+
+    times = []
+    started = time.perf_counter()
+
+    while (len(times) < min_count
+           or time.perf_counter() - started < min_time):
+
+        if setup is None:
+            begin = time.perf_counter()
+            function()
+        else:
+            argument = setup()
+            begin = time.perf_counter()
+            function(argument)
+        times.append(time.perf_counter() - begin)
+
+    times.sort()
+    total = sum(times)
+
+    return {
+        'count': len(times),
+        'total_s': total,
+        'mean_ms': total / len(times) * 1000,
+        'median_ms': times[len(times) // 2] * 1000,
+        'min_ms': times[0] * 1000,
+        'per_second': len(times) / total if total > 0 else None,
+    }
+
+
+def make_chain(user: core.User,
+               size: int,
+               messages: int = 0,
+               magicnumber: str = '0') -> core.Chain:
+
+    """ Make chain that has size blocks, with easy magic number. """
+
+    chain = core.Chain.generate(user, magicnumber=magicnumber)
+
+    while len(chain) < size:
+        leaf = chain[-1]
+        for i in range(messages):
+            leaf.pool(core.Message(user, 'benchmark', i))
+        chain.join(leaf.close(user, core.mining(leaf)))
+
+    return chain
+
+
+def bench_user(args: argparse.Namespace) -> Result:
+    user = core.User.generate()
+    data = b'benchmark' * 16
+    signature = user.sign_raw(data)
+
+    return {
+        'sign': measure(lambda: user.sign_raw(data), args.min_time),
+        'verify': measure(lambda: user.verify_raw(data, signature, False),
+                          args.min_time),
+        'verify_cached': measure(lambda: user.verify_raw(data, signature),
+                                 args.min_time),
+    }
+
+
+def bench_serialize(args: argparse.Namespace) -> Result:
+    user = core.User.generate()
+    message = core.Message(user, 'benchmark', {'hello': 'world'})
+
+    chain = make_chain(user, 2, messages=10)
+    chain.join(chain[-1].close(user, core.mining(chain[-1])))
+    block = chain[-2]
+
+    message_json = message.as_json()
+    block_json = block.as_json()
+
+    def decode_block() -> None:
+        core.Block.from_json(block_json, '0')
+
+    return {
+        'message_encode': measure(message.as_json, args.min_time),
+        'message_decode': measure(lambda: core.Message.from_json(message_json),
+                                  args.min_time),
+        'block_10_messages_encode': measure(block.as_json, args.min_time),
+        'block_10_messages_decode': measure(decode_block, args.min_time),
+    }
+
+
+def bench_chain(args: argparse.Namespace) -> Result:
+    user = core.User.generate()
+    result = {}
+
+    for size in args.sizes:
+        # Blocks after size are made in advance, so only joining is measured.
+        blocks = list(make_chain(user, size + args.joins + 1))[:-1]
+        chain = core.Chain(blocks[:size], trusted=size)
+
+        def fresh_chain() -> core.Chain:
+            # Blocks from other peers are not verified yet.
+            verification_cache.clear()
+
+            return core.Chain(blocks[:size], trusted=size)
+
+        def join(joined: core.Chain) -> None:
+            for block in blocks[size:]:
+                joined.join(block)
+
+        def verify_cold() -> None:
+            verification_cache.clear()
+            chain.verify()
+
+        result[str(size)] = {
+            'join': measure(join, args.min_time, setup=fresh_chain),
+            'joins': args.joins,
+            'verify_cold': measure(verify_cold, args.min_time, 1),
+            'verify_warm': measure(chain.verify, args.min_time, 1),
+        }
+
+    return result
+
+
+def bench_mining(args: argparse.Namespace) -> Result:
+    result = {}
+
+    for name in core.miner.ENGINES:
+        result['hashrate_' + name] = core.miner.hashrate(name)
+
+    user = core.User.generate()
+
+    for length in range(1, args.magic_length + 1):
+        magicnumber = '0' * length
+
+        # New root for each round, because mining the same block always
+        # finds the same key.
+        def new_block() -> core.Block:
+            return core.Block(core.Block.make_root(user, magicnumber))
+
+        result['magic_{}'.format(length)] = measure(core.mining,
+                                                    args.min_time,
+                                                    setup=new_block)
+
+    return result
+
+
+def bench_endpoint(args: argparse.Namespace) -> Result:
+    import falcon.testing
+
+    import peer
+    from peer.chainmanager import ChainManager
+
+    user = core.User.generate()
+    manager = ChainManager(None, make_chain(user, 100, messages=5))
+    client = falcon.testing.TestClient(peer.Peer(manager))
+
+    signature = manager.chain[1].messages[0].signature.hex()
+    message = core.Message(user, 'benchmark', 'hello').as_json()
+
+    def post_message() -> None:
+        client.simulate_post('/message',
+                             body=message,
+                             headers={'Content-Type': 'application/json'})
+
+    return {
+        'get_leaf': measure(lambda: client.simulate_get('/block/-1'),
+                            args.min_time),
+        'get_range_json': measure(
+            lambda: client.simulate_get('/block', params={'from': 0}),
+            args.min_time,
+        ),
+        'get_range_binary': measure(
+            lambda: client.simulate_get(
+                '/block',
+                params={'from': 0},
+                headers={'Accept': core.codec.CONTENT_TYPE},
+            ),
+            args.min_time,
+        ),
+        'get_message': measure(
+            lambda: client.simulate_get('/message/' + signature),
+            args.min_time,
+        ),
+        # Same message is answered without pooling again after the first.
+        'post_duplicated_message': measure(post_message, args.min_time),
+    }
+
+
+BENCHMARKS: typing.Dict[str, typing.Callable[[argparse.Namespace], Result]] = {
+    'user': bench_user,
+    'serialize': bench_serialize,
+    'chain': bench_chain,
+    'mining': bench_mining,
+    'endpoint': bench_endpoint,
+}
+
+
+def environment() -> Result:
+    """ Describe where the benchmark ran. """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                check=True).stdout.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': int(time.time()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='measure hot paths and print results as JSON',
+    )
+    parser.add_argument('names',
+                        nargs='*',
+                        help='benchmarks to run from {}, or all if not given'
+                             .format(', '.join(BENCHMARKS)))
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=[10, 1000, 10000],
+                        help='chain lengths for chain benchmark')
+    parser.add_argument('--joins',
+                        type=int,
+                        default=10,
+                        help='blocks to join in chain benchmark')
+    parser.add_argument('--magic-length',
+                        type=int,
+                        default=4,
+                        help='longest magic number for mining benchmark')
+    parser.add_argument('--min-time',
+                        type=float,
+                        default=1.0,
+                        help='seconds to repeat each measurement at least')
+    parser.add_argument('--output', help='file to write results')
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: {}'.format(name))
+
+    results = {'environment': environment(), 'results': {}}
+
+    for name in args.names or BENCHMARKS:
+        print('running {}...'.format(name), file=sys.stderr)
+
+        # Keep stdout for the results, apart from logs of the peer.
+        with contextlib.redirect_stdout(sys.stderr):
+            results['results'][name] = BENCHMARKS[name](args)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
@@ -1,6 +1,61 @@
-from core.block import Block, mining
-from core.chain import Chain
-from core.message import Message
-from core.user import User
+""" The core of macracoin.
+
+Submodules and their classes are imported when they are used first, so
+importing this package does not load pycrypto or multiprocessing until they
+are needed.
+"""
+
+import importlib
+import typing
 
 from core.errors import *
+
+
+_SUBMODULES = (
+    'batch',
+    'block',
+    'blocktree',
+    'chain',
+    'codec',
+    'headers',
+    'keystore',
+    'mempool',
+    'merkle',
+    'message',
+    'metrics',
+    'miner',
+    'store',
+    'user',
+)
+
+_ATTRIBUTES = {
+    'Block': 'block',
+    'mining': 'block',
+    'BlockTree': 'blocktree',
+    'Chain': 'chain',
+    'KeyStore': 'keystore',
+    'Mempool': 'mempool',
+    'Message': 'message',
+    'BlockStore': 'store',
+    'User': 'user',
+}
+
+
+def __getattr__(name: str) -> typing.Any:
+    if name in _ATTRIBUTES:
+        module = importlib.import_module('core.' + _ATTRIBUTES[name])
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module('core.' + name)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__,
+            name,
+        ))
+
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> typing.List[str]:
+    return sorted(set(globals()) | set(_SUBMODULES) | set(_ATTRIBUTES))
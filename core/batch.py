@@ -0,0 +1,192 @@
+import concurrent.futures
+import hashlib
+import threading
+import typing
+
+from core.block import Block
+from core.message import verify_messages
+from core.user import User, verification_cache, verifications
+
+
+THRESHOLD = 512
+CHUNK_SIZE = 128
+
+Entry = typing.Tuple[User, bytes, bytes]
+
+_pool: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def start_pool(workers: int = None) -> concurrent.futures.ProcessPoolExecutor:
+    """ Start the process pool for verifying, or get the running one.
+
+    The pool lives until `shutdown_pool`, and is shared by all threads. Its
+    processes are started by forkserver, or spawn if not available, because
+    a forked process inherits locks that other threads held, like locks of
+    the key registry, metrics and logging. Servers should start it at
+    startup; otherwise it is started on the first use with `workers`.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            # Imported here because it is slow, and most clients do not need
+            # the pool.
+            import multiprocessing
+
+            method = 'spawn'
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                method = 'forkserver'
+
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context(method),
+            )
+
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """ Stop the process pool if running. """
+
+    global _pool
+
+    with _pool_lock:
+        pool, _pool = _pool, None
+
+    if pool is not None:
+        pool.shutdown()
+
+
+def collect(blocks: typing.Iterable[Block],
+            closers: bool = True,
+            messages: bool = True) -> typing.List[Entry]:
+
+    """ Collect (user, signed data, signature) of blocks.
+
+
+    >>> from core.chain import Chain
+    >>> from core.message import Message
+
+    >>> user = User.generate()
+    >>> chain = Chain.generate(user)
+    >>> chain[-1].pool(Message(user, 'namespace', 'hello'))
+
+    >>> len(collect(chain))
+    2
+    >>> len(collect(chain, messages=False))
+    1
+    """
+
+    result: typing.List[Entry] = []
+
+    for block in blocks:
+        if closers and block.is_closed():
+            result.append((block.closer, block.signed_data(), block.signature))
+
+        if messages:
+            for m in block.messages:
+                result.append((m.user, m.signed_data(), m.signature))
+
+    return result
+
+
+def _verify_chunk(chunk: typing.List[typing.Tuple[bytes, bytes, bytes]]) \
+        -> typing.List[bool]:
+
+    return [User.from_der(der).verify_raw(data, signature, cache=False)
+            for der, data, signature in chunk]
+
+
+def verify(entries: typing.Sequence[Entry],
+           workers: int = None,
+           threshold: int = THRESHOLD) -> bool:
+
+    """ Verify many signatures at once.
+
+    Signatures that already verified are skipped. If there are more than
+    threshold signatures to verify, they are verified in chunks with the
+    process pool of `start_pool`. Succeeded verifications are remembered in
+    the verification cache, so verifying them again is cheap.
+
+
+    >>> user = User.generate()
+    >>> entries = [(user, data, user.sign_raw(data))
+    ...            for data in (b'hello', b'world')]
+
+    >>> verify(entries, threshold=1)
+    True
+    >>> verify(entries + [(user, b'foobar', entries[0][2])], threshold=1)
+    False
+
+    >>> shutdown_pool()
+    """
+
+    return all(verify_each(entries, workers, threshold))
+
+
+def verify_each(entries: typing.Sequence[Entry],
+                workers: int = None,
+                threshold: int = THRESHOLD,
+                digests: typing.Sequence[bytes] = None) -> typing.List[bool]:
+
+    """ Verify many signatures at once same as `verify`, and get result of
+    each signature. Digests of signed data can be given if already known.
+    """
+
+    if digests is None:
+        digests = [hashlib.sha256(data).digest() for _, data, _ in entries]
+
+    keys = [(user.fingerprint, digest, signature)
+            for (user, _, signature), digest in zip(entries, digests)]
+
+    result = [True] * len(entries)
+    pending = [i for i, key in enumerate(keys)
+               if not verification_cache.lookup(*key)]
+
+    if len(pending) < len(keys):
+        verifications.inc(len(keys) - len(pending), result='cached')
+
+    if len(pending) < threshold:
+        results = [entries[i][0].verify_raw(entries[i][1],
+                                            entries[i][2],
+                                            cache=False)
+                   for i in pending]
+    else:
+        arguments = [(entries[i][0].public_der, entries[i][1], entries[i][2])
+                     for i in pending]
+        chunks = [arguments[i:i + CHUNK_SIZE]
+                  for i in range(0, len(arguments), CHUNK_SIZE)]
+
+        results = [ok
+                   for chunk in start_pool(workers).map(_verify_chunk, chunks)
+                   for ok in chunk]
+
+        # Workers count into the registry of their own process.
+        verifications.inc(results.count(True), result='valid')
+        verifications.inc(results.count(False), result='invalid')
+
+    for i, ok in zip(pending, results):
+        result[i] = ok
+        if ok:
+            verification_cache.add(*keys[i])
+
+    return result
+
+
+def verify_blocks(blocks: typing.Iterable[Block],
+                  workers: int = None,
+                  threshold: int = THRESHOLD) -> bool:
+
+    """ Verify signatures of closers and messages in blocks at once.
+
+    Results of messages are remembered in each message, as
+    `core.message.verify_messages`.
+    """
+
+    blocks = list(blocks)
+    messages = [m for block in blocks for m in block.messages]
+
+    return (verify(collect(blocks, messages=False), workers, threshold)
+            and verify_messages(messages, workers, threshold))
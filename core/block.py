@@ -1,29 +1,39 @@
 import base64
 import hashlib
 import json
+import threading
 import time
 import typing
 
-from Crypto.Util import randpool
-
-from core import errors
-from core.message import Message
+from core import errors, merkle, miner
+from core.message import Message, verify_messages
 from core.user import User
 
 
 DEFAULT_MAGIC_NUMBER = 'c105ed'
 
+# Version 1 block commits to signatures of all messages, and version 2 block
+# commits to the Merkle root of them.
+VERSIONS = (1, 2)
+DEFAULT_VERSION = 2
+
 
 class DummyBlock:
     """ The dummy block for emulate chain. """
 
-    def __init__(self, index: int, magicnumber: str, signature: bytes) -> None:
+    def __init__(self,
+                 index: int,
+                 magicnumber: str,
+                 signature: bytes,
+                 version: int = DEFAULT_VERSION) -> None:
+
         self.index = index
         if magicnumber is None:
             self.magicnumber = DEFAULT_MAGIC_NUMBER
         else:
             self.magicnumber = magicnumber
         self.signature = signature
+        self.version = version
 
 
 class Block():
@@ -31,7 +41,13 @@ class Block():
 
     def __init__(self,
                  parent: typing.Union['Block', DummyBlock, None],
-                 magicnumber: str = None) -> None:
+                 magicnumber: str = None,
+                 version: int = None) -> None:
+
+        """ Make block.
+
+        Version is the same as parent if not given.
+        """
 
         self.parent = parent
         self.messages: typing.List[Message] = []
@@ -40,6 +56,11 @@ class Block():
         self.timestamp: int = None
         self.signature: bytes = None
 
+        # Whether this is a header that has no messages, and the Merkle root
+        # of it.
+        self._is_header = False
+        self._header_root: typing.Optional[bytes] = None
+
         if parent is not None:
             self.index: int = parent.index + 1
             self.magicnumber: str = parent.magicnumber
@@ -51,11 +72,34 @@ class Block():
             else:
                 self.magicnumber: str = magicnumber
 
+        if version is not None:
+            self.version = version
+        elif parent is not None:
+            self.version = parent.version
+        else:
+            self.version = DEFAULT_VERSION
+
         if not isinstance(self.magicnumber, str) or len(self.magicnumber) == 0:
             raise TypeError('magic number must be non empty string')
 
+        if self.version not in VERSIONS:
+            raise TypeError('unsupported block version')
+
+    @property
+    def messages(self) -> typing.List[Message]:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: typing.List[Message]) -> None:
+        self._messages = messages
+        self._merkle: typing.Optional[merkle.MerkleTree] = None
+
     @classmethod
-    def make_root(cls, user: User, magicnumber: str = None) -> 'Block':
+    def make_root(cls,
+                  user: User,
+                  magicnumber: str = None,
+                  version: int = None) -> 'Block':
+
         """ Make root block
 
         The root block has no any messages and closed from the creating.
@@ -84,14 +128,14 @@ class Block():
         1
         """
 
-        result = cls(None, magicnumber)
+        from Crypto.Util import randpool
+
+        result = cls(None, magicnumber, version)
 
         result.timestamp = int(time.time() * 1000)
         result.key = randpool.RandomPool().get_bytes(32)
         result.closer = user
-        result.signature = user.sign_raw(
-            result.timestamp.to_bytes(8, 'big') + result.key
-        )
+        result.signature = user.sign_raw(result.signed_data())
 
         return result
 
@@ -110,6 +154,11 @@ class Block():
 
         return self.index == 0 and self.parent is None
 
+    def is_header(self) -> bool:
+        """ Check this is a header that has no messages, not a block. """
+
+        return self._is_header
+
     def is_closed(self) -> bool:
         """ Check this block is already closed.
 
@@ -137,9 +186,12 @@ class Block():
                 and self.timestamp is not None
                 and self.signature is not None)
 
-    def pool(self, message: Message) -> None:
+    def pool(self, message: Message, verify: bool = True) -> None:
         """ Pooling new message into this block.
 
+        The signature of message is not verified if verify is False, like a
+        message that already verified by the mempool.
+
 
         >>> user = User.generate()
         >>> root = Block.make_root(user)
@@ -172,10 +224,15 @@ class Block():
         if self.is_closed():
             raise errors.BlockAlreadyClosedError()
 
-        if not message.verify():
+        if verify and not message.verify():
             raise errors.InvalidSignatureError()
 
-        self.messages.append(message)
+        self._messages.append(message)
+
+        if self._merkle is not None and len(self._merkle) + 1 == len(
+                self._messages):
+
+            self._merkle.append(message.signature)
 
     def verify(self) -> bool:
         """ Verify a closed block.
@@ -201,10 +258,8 @@ class Block():
         if not self.is_closed():
             raise errors.BlockNotClosedError()
 
-        sign_correct = self.closer.verify_raw(
-            self.timestamp.to_bytes(8, 'big') + self.key,
-            self.signature,
-        )
+        sign_correct = self.closer.verify_raw(self.signed_data(),
+                                              self.signature)
         if not sign_correct:
             return False
 
@@ -215,21 +270,87 @@ class Block():
         else:
             return self.verify_key(self.key)
 
+    def signed_data(self) -> bytes:
+        """ Get bytes that signed by the closer. """
+
+        return self.timestamp.to_bytes(8, 'big') + self.key
+
+    def hash_prefix(self) -> bytes:
+        """ Get bytes that hashed before the key for closing this block.
+
+
+        Version 2 block has fixed length prefix, and pooling message updates
+        only a path of the Merkle tree.
+
+        >>> user = User.generate()
+        >>> child = Block(Block.make_root(user))
+        >>> len(child.hash_prefix())
+        160
+        >>> child.pool(Message(user, 'namespace', 'hello'))
+        >>> len(child.hash_prefix())
+        160
+
+        Version 1 block has signatures of all messages.
+
+        >>> child = Block(Block.make_root(user, version=1))
+        >>> child.pool(Message(user, 'namespace', 'hello'))
+        >>> len(child.hash_prefix())
+        256
+        """
+
+        if self.version == 1:
+            return self.parent.signature + b''.join(m.signature
+                                                    for m in self.messages)
+
+        return self.parent.signature + self.merkle_root()
+
+    def merkle_root(self) -> bytes:
+        """ Get the Merkle root of message signatures. """
+
+        if self._header_root is not None:
+            return self._header_root
+
+        if self._merkle is None or len(self._merkle) != len(self._messages):
+            self._merkle = merkle.MerkleTree(m.signature
+                                             for m in self._messages)
+
+        return self._merkle.root()
+
+    def merkle_proof(self, position: int) -> merkle.Proof:
+        """ Get proof that the message at the position is in this block.
+
+
+        >>> user = User.generate()
+        >>> child = Block(Block.make_root(user))
+        >>> for payload in ('hello', 'world', 'foobar'):
+        ...     child.pool(Message(user, 'namespace', payload))
+
+        >>> proof = child.merkle_proof(1)
+        >>> merkle.verify_proof(child.messages[1].signature,
+        ...                     proof,
+        ...                     child.merkle_root())
+        True
+        """
+
+        if self.version == 1:
+            raise TypeError('version 1 block has no Merkle tree')
+
+        self.merkle_root()
+
+        return self._merkle.proof(position)
+
     def verify_key(self, key: bytes) -> bool:
         """ Verify key for closing this block. """
 
         if len(key) != 32:
             return False
 
-        if self.magicnumber != self.parent.magicnumber:
-            return False
-
-        h = hashlib.sha256()
+        if (self.magicnumber != self.parent.magicnumber
+                or self.version != self.parent.version):
 
-        h.update(self.parent.signature)
+            return False
 
-        for m in self.messages:
-            h.update(m.signature)
+        h = hashlib.sha256(self.hash_prefix())
 
         h.update(key)
 
@@ -285,6 +406,45 @@ class Block():
     def as_dict(self) -> dict:
         """ Convert as dictionary for serialize. """
 
+        result = self._as_dict()
+        result['messages'] = [m.as_dict() for m in self.messages]
+        return result
+
+    def as_header(self) -> dict:
+        """ Convert header, that is block without messages, as dictionary.
+
+        Version 2 header has the Merkle root instead of messages, so the key
+        can be verified without messages.
+
+
+        >>> user = User.generate()
+        >>> child = Block(Block.make_root(user, magicnumber='0'))
+        >>> child.pool(Message(user, 'namespace', 'hello'))
+        >>> _ = child.close(user, mining(child))
+
+        >>> header = Block.header_from_dict(child.as_header(),
+        ...                                 magicnumber='0')
+        >>> header.messages
+        []
+        >>> header.verify()
+        True
+
+        Header is not a block, so it can not be decoded as a block.
+
+        >>> Block.from_dict(child.as_header(), magicnumber='0')
+        Traceback (most recent call last):
+            ...
+        core.errors.InvalidEncodingError: block has no messages
+        """
+
+        result = self._as_dict()
+        if self.version != 1:
+            result['merkle_root'] = base64.b64encode(
+                self.merkle_root(),
+            ).decode('ascii')
+        return result
+
+    def _as_dict(self) -> dict:
         parent = None
         if self.parent is not None:
             parent = base64.b64encode(self.parent.signature).decode('ascii')
@@ -301,16 +461,21 @@ class Block():
         if self.signature is not None:
             signature = base64.b64encode(self.signature).decode('ascii')
 
-        return {
+        result = {
             'index': self.index,
             'parent': parent,
             'key': key,
             'closer': closer,
             'timestamp': self.timestamp,
             'signature': signature,
-            'messages': [m.as_dict() for m in self.messages],
         }
 
+        # Version 1 block is serialized same as before versioning.
+        if self.version != 1:
+            result['version'] = self.version
+
+        return result
+
     def as_json(self) -> str:
         """ Serialize as json.
 
@@ -339,8 +504,55 @@ class Block():
         return json.dumps(self.as_dict())
 
     @classmethod
-    def from_dict(cls, data: dict, magicnumber: str = None) -> 'Block':
-        """ Convert from dictionary for deserialize. """
+    def from_dict(cls,
+                  data: dict,
+                  magicnumber: str = None,
+                  verify: bool = True) -> 'Block':
+
+        """ Convert from dictionary for deserialize.
+
+        Signatures of messages are verified at once unless verify is False.
+        Raises `InvalidEncodingError` if data has no messages, such as a
+        header. Use `header_from_dict` for headers.
+        """
+
+        if 'messages' not in data:
+            raise errors.InvalidEncodingError('block has no messages')
+
+        result = cls._from_dict(data, magicnumber)
+
+        result.messages = [Message.from_dict(m, False)
+                           for m in data['messages']]
+
+        if verify and not verify_messages(result.messages):
+            raise errors.InvalidSignatureError()
+
+        return result
+
+    @classmethod
+    def header_from_dict(cls,
+                         data: dict,
+                         magicnumber: str = None) -> 'Block':
+
+        """ Convert header from dictionary, that made by `as_header`.
+
+        The header has no messages, and version 2 header has the Merkle root
+        instead. Headers are only for verifying, and can not be joined into
+        chain.
+        """
+
+        result = cls._from_dict(data, magicnumber)
+
+        if result.version != 1:
+            result._header_root = base64.b64decode(data['merkle_root'])
+
+        result._is_header = True
+
+        return result
+
+    @classmethod
+    def _from_dict(cls, data: dict, magicnumber: str = None) -> 'Block':
+        version = data.get('version', 1)
 
         parent = None
         if data['parent'] is not None:
@@ -348,9 +560,10 @@ class Block():
                 data['index'] - 1,
                 magicnumber,
                 base64.b64decode(data['parent']),
+                version,
             )
 
-        result = cls(parent)
+        result = cls(parent, magicnumber, version)
 
         if data['key'] is not None:
             result.key = base64.b64decode(data['key'])
@@ -363,8 +576,6 @@ class Block():
         if data['signature'] is not None:
             result.signature = base64.b64decode(data['signature'])
 
-        result.messages = [Message.from_dict(m) for m in data['messages']]
-
         return result
 
     @classmethod
@@ -374,32 +585,62 @@ class Block():
         return cls.from_dict(json.loads(data), magicnumber=magicnumber)
 
 
-def mining(block: Block) -> bytes:
-    """ Find key for closing block. """
+def mining(block: Block,
+           workers: typing.Optional[int] = 1,
+           engine: str = miner.DEFAULT_ENGINE,
+           abort: threading.Event = None) -> typing.Optional[bytes]:
 
-    hash_ = hashlib.sha256()
+    """ Find key for closing block.
 
-    hash_.update(block.parent.signature)
+    If workers is more than 1, search key with multiple processes. If workers
+    is None, use all CPU cores. The engine is a name in `core.miner.ENGINES`.
+    Returns None if abort is set before found key.
 
-    for m in block.messages:
-        hash_.update(m.signature)
 
-    for i in range(2<<32):
-        key = i.to_bytes(32, 'big')
+    >>> root = Block.make_root(User.generate(), magicnumber='000')
+    >>> child = Block(root)
 
-        h = hash_.copy()
-        h.update(key)
+    >>> child.verify_key(mining(child))
+    True
+    >>> child.verify_key(mining(child, workers=2))
+    True
 
-        if h.hexdigest().endswith(block.magicnumber):
-            return key
+    >>> aborted = threading.Event()
+    >>> aborted.set()
+    >>> mining(child, abort=aborted) is None
+    True
+    """
 
-    raise ValueError('not found key')
+    prefix = block.hash_prefix()
+
+    if workers == 1:
+        key = miner.search(prefix,
+                           block.magicnumber,
+                           engine=engine,
+                           abort=abort)
+    else:
+        key = miner.parallel_search(prefix,
+                                    block.magicnumber,
+                                    workers,
+                                    engine=engine,
+                                    abort=abort)
+
+    if key is None:
+        if abort is not None and abort.is_set():
+            return None
+
+        raise ValueError('not found key')
+
+    return key
 
 
 if __name__ == '__main__':
     import datetime
     import functools
+    import sys
+
 
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
 
     user = User.generate()
     root = Block.make_root(user)
@@ -409,7 +650,7 @@ if __name__ == '__main__':
     timediffs = []
     print('{:5d}: {}({}) [{}]'.format(0, datetime.datetime.now(), datetime.timedelta(0), root.key.hex()))
     while True:
-        key = mining(child)
+        key = mining(child, workers)
         child = child.close(user, key)
 
         now = datetime.datetime.now()
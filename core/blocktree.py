@@ -0,0 +1,260 @@
+import collections
+import typing
+
+from core import errors
+from core.block import Block
+from core.chain import Chain
+
+
+# Status of added block, and blocks removed from and added to the chain.
+Update = typing.Tuple[str, typing.List[Block], typing.List[Block]]
+
+
+class BlockTree:
+    """ The tree of closed blocks that has the chain as the main branch.
+
+    Blocks of other branches are kept by signature, and blocks that arrived
+    before their parent are kept in the bounded orphan pool until the parent
+    arrives. The longest branch is chosen as the main branch; the first seen
+    branch wins a tie. Switching branch walks back only to the fork point, so
+    it takes time proportional to the depth of the fork.
+
+    `add` returns the status of the block, that is "known", "orphan", "side"
+    or "main", and the blocks removed from and added to the chain.
+
+
+    >>> from core.block import mining
+    >>> from core.user import User
+    >>> user = User.generate()
+    >>> chain = Chain.generate(user, magicnumber='0')
+    >>> tree = BlockTree(chain)
+
+    >>> def child(parent):
+    ...     block = Block(parent)
+    ...     block.close(user, mining(block))
+    ...     return block
+
+    >>> a1 = child(chain[0])
+    >>> a2 = child(a1)
+    >>> b1 = child(chain[0])
+    >>> b2 = child(b1)
+    >>> b3 = child(b2)
+
+    >>> tree.add(a1)[0], tree.add(a2)[0]
+    ('main', 'main')
+    >>> tree.add(b1)[0]
+    'side'
+
+    The block that arrived before its parent waits for the parent.
+
+    >>> tree.add(b3)[0]
+    'orphan'
+    >>> status, removed, added = tree.add(b2)
+    >>> status, [b.index for b in removed], [b.index for b in added]
+    ('main', [1, 2], [1, 2, 3])
+    >>> chain[-2] is b3
+    True
+
+    >>> tree.add(a2)[0]
+    'known'
+
+    Blocks deeper than `max_depth` from the tip are forgotten with their
+    descendants, so the branch can not be switched to anymore.
+
+    >>> tree = BlockTree(Chain.generate(user, magicnumber='0'), max_depth=2)
+    >>> c1 = child(tree.chain[0])
+    >>> c2 = child(c1)
+    >>> tree.add(c1)[0], tree.add(c2)[0]
+    ('main', 'main')
+
+    >>> d1 = child(tree.chain[0])
+    >>> d2 = child(d1)
+    >>> d3 = child(d2)
+    >>> d4 = child(d3)
+    >>> [tree.add(d)[0] for d in (d1, d2, d3, d4)]
+    ['side', 'side', 'main', 'main']
+
+    >>> c3 = child(c2)
+    >>> c4 = child(c3)
+    >>> c5 = child(c4)
+    >>> [tree.add(c)[0] for c in (c3, c4, c5)]
+    ['orphan', 'orphan', 'orphan']
+    """
+
+    def __init__(self,
+                 chain: Chain,
+                 max_orphans: int = 100,
+                 max_depth: int = 100) -> None:
+
+        self.chain = chain
+        self.max_orphans = max_orphans
+        self.max_depth = max_depth
+
+        # Closed blocks not in the chain, by signature.
+        self._side: typing.Dict[bytes, Block] = {}
+
+        # Blocks that the parent is unknown, from the oldest, and signatures
+        # of them by signature of the parent.
+        self._orphans: typing.MutableMapping[bytes, Block] = \
+            collections.OrderedDict()
+        self._waiting: typing.Dict[bytes, typing.List[bytes]] = {}
+
+    def __contains__(self, block: Block) -> bool:
+        return (block in self.chain
+                or block.signature in self._side
+                or block.signature in self._orphans)
+
+    def orphans(self) -> int:
+        """ Get number of blocks in the orphan pool. """
+
+        return len(self._orphans)
+
+    def tip(self) -> Block:
+        """ Get the newest closed block of the main branch. """
+
+        if self.chain[-1].is_closed():
+            return self.chain[-1]
+
+        return self.chain[-2]
+
+    def _find(self, signature: bytes) -> typing.Optional[Block]:
+        found = self.chain.find_block(signature)
+        if found is None:
+            found = self._side.get(signature)
+
+        return found
+
+    def _add_orphan(self, block: Block) -> None:
+        while len(self._orphans) >= self.max_orphans:
+            signature, oldest = self._orphans.popitem(last=False)
+
+            waiting = self._waiting[oldest.parent.signature]
+            waiting.remove(signature)
+            if len(waiting) == 0:
+                del self._waiting[oldest.parent.signature]
+
+        self._orphans[block.signature] = block
+        self._waiting.setdefault(block.parent.signature, []).append(
+            block.signature,
+        )
+
+    def _attach(self, block: Block) -> typing.List[Block]:
+        """ Attach block and orphans that waiting for it.
+
+        Returns attached blocks, from parents to children.
+        """
+
+        attached = [block]
+        self._side[block.signature] = block
+
+        for parent in attached:
+            for signature in self._waiting.pop(parent.signature, []):
+                orphan = self._orphans.pop(signature)
+
+                if (orphan.index == parent.index + 1
+                        and orphan.version == parent.version):
+
+                    self._side[signature] = orphan
+                    attached.append(orphan)
+
+        return attached
+
+    def _prune(self) -> None:
+        """ Forget blocks that too deep for switching to. """
+
+        limit = self.tip().index - self.max_depth
+
+        for pool in (self._side, self._orphans):
+            for signature in [s for s, b in pool.items() if b.index < limit]:
+                block = pool.pop(signature)
+
+                waiting = self._waiting.get(block.parent.signature)
+                if pool is self._orphans and waiting is not None:
+                    waiting.remove(signature)
+                    if len(waiting) == 0:
+                        del self._waiting[block.parent.signature]
+
+        # Descendants of pruned blocks can not be linked to the chain anymore.
+        # Parents come first in order of index.
+        for block in sorted(self._side.values(), key=lambda b: b.index):
+            if self._find(block.parent.signature) is None:
+                del self._side[block.signature]
+
+    def add(self, block: Block) -> Update:
+        """ Add closed block, and switch the main branch if it got longer.
+
+        Raises `InvalidChainError` if the block is invalid.
+        """
+
+        if (not block.is_closed()
+                or block.is_root()
+                or block.is_header()):
+
+            raise errors.InvalidChainError()
+
+        if block in self:
+            return 'known', [], []
+
+        if not block.verify():
+            raise errors.InvalidChainError()
+
+        parent = self._find(block.parent.signature)
+        if parent is None:
+            self._add_orphan(block)
+            return 'orphan', [], []
+
+        if (block.index != parent.index + 1
+                or block.version != parent.version):
+
+            raise errors.InvalidChainError()
+
+        # The first deepest block wins a tie.
+        best = max(self._attach(block), key=lambda b: b.index)
+
+        tip = self.tip()
+        if best.index <= tip.index:
+            return 'side', [], []
+
+        branch = [best]
+        while self.chain.find_block(branch[-1].parent.signature) is None:
+            parent = self._side.get(branch[-1].parent.signature)
+            if parent is None:
+                # An ancestor was pruned, so the branch can not be joined.
+                for side in branch:
+                    self._side.pop(side.signature, None)
+                return 'side', [], []
+
+            branch.append(parent)
+
+        fork = self.chain.find_block(branch[-1].parent.signature)
+        if tip.index - fork.index > self.max_depth:
+            return 'side', [], []
+
+        try:
+            removed = self.chain.rollback(fork.index)
+        except errors.InvalidChainError:
+            # Can not switch over a checkpoint.
+            return 'side', [], []
+
+        branch.reverse()
+
+        try:
+            for side in branch:
+                self.chain.join(side)
+        except errors.InvalidChainError:
+            self.chain.rollback(fork.index)
+            for old in removed:
+                self.chain.join(old)
+
+            for side in branch:
+                self._side.pop(side.signature, None)
+            raise
+
+        for side in branch:
+            del self._side[side.signature]
+        for old in removed:
+            self._side[old.signature] = old
+
+        self._prune()
+
+        return 'main', removed, branch
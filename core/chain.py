@@ -1,11 +1,25 @@
+import bisect
+import codecs
 import json
 import typing
 
-from core import errors
+from core import batch, errors, metrics
 from core.block import Block
+from core.message import Message
 from core.user import User
 
 
+Position = typing.Tuple[int, int]
+
+# Index and signature of a block that trusted without verifying.
+Checkpoint = typing.Tuple[int, bytes]
+
+join_seconds = metrics.histogram('chain_join_seconds',
+                                 'Duration of joining a block.')
+verify_seconds = metrics.histogram('chain_verify_seconds',
+                                   'Duration of verifying whole chain.')
+
+
 class Chain(typing.Iterable[Block], typing.Sized):
     """ The block chain.
 
@@ -22,10 +36,61 @@ class Chain(typing.Iterable[Block], typing.Sized):
     3
     """
 
-    def __init__(self, chain: typing.List[Block]) -> None:
+    def __init__(self,
+                 chain: typing.List[Block],
+                 trusted: int = 0,
+                 checkpoints: typing.Iterable[Checkpoint] = ()) -> None:
+
+        """ Make chain from blocks.
+
+        The first `trusted` blocks are not verified, like blocks that loaded
+        from local storage. They must be closed and linked each other.
+
+        Blocks at indexes of `checkpoints` must have the signatures. Only
+        linkage of blocks is checked up to the newest checkpoint that the
+        chain has, and signatures are verified only above it.
+
+
+        >>> from core.block import mining
+        >>> user = User.generate()
+        >>> blocks = list(Chain.generate(user, magicnumber='0'))
+        >>> blocks.append(blocks[-1].close(user, mining(blocks[-1])))
+
+        >>> len(Chain(blocks, trusted=2))
+        3
+        >>> Chain([blocks[1], blocks[0], blocks[2]], trusted=2)
+        Traceback (most recent call last):
+            ...
+        core.errors.InvalidChainError
+        """
+
+        if not 0 <= trusted <= len(chain):
+            raise ValueError('trusted is out of range')
+
         self._chain = chain
+        self.checkpoints: typing.Dict[int, bytes] = dict(checkpoints)
+
+        for i in range(trusted):
+            parent = chain[i - 1] if i > 0 else None
 
-        if not self.verify():
+            if (not chain[i].is_closed()
+                    or not self._is_linked(parent, chain[i])):
+
+                raise errors.InvalidChainError()
+
+        # Number of blocks from the root that already verified and closed.
+        self._verified = 0
+
+        # Indexes of verified blocks, from signature to position.
+        self._blocks: typing.Dict[bytes, int] = {}
+        self._messages: typing.Dict[bytes, Position] = {}
+
+        # Inverted indexes of messages in verified blocks, from namespace and
+        # fingerprint of sender to sorted positions.
+        self._namespaces: typing.Dict[str, typing.List[Position]] = {}
+        self._senders: typing.Dict[bytes, typing.List[Position]] = {}
+
+        if not self._verify_from(trusted, self._checkpointed()):
             raise errors.InvalidChainError()
 
     @classmethod
@@ -72,75 +137,479 @@ class Chain(typing.Iterable[Block], typing.Sized):
     def __iter__(self) -> typing.Iterator[Block]:
         return iter(self._chain)
 
-    def __in__(self, block: Block) -> bool:
-        return any(x.signature == block.signature for x in self)
+    def __contains__(self, block: Block) -> bool:
+        """ Check the closed block is in this chain.
+
+
+        >>> chain = Chain.generate(User.generate())
+        >>> chain[0] in chain
+        True
+        >>> Block.from_json(chain[0].as_json()) in chain
+        True
+        >>> chain[1] in chain
+        False
+        """
+
+        return block.signature is not None and block.signature in self._blocks
+
+    def find_block(self, signature: bytes) -> typing.Optional[Block]:
+        """ Find closed block by signature.
+
+
+        >>> chain = Chain.generate(User.generate())
+        >>> chain.find_block(chain[0].signature) is chain[0]
+        True
+        >>> chain.find_block(b'not found') is None
+        True
+        """
+
+        position = self._blocks.get(signature)
+        if position is None:
+            return None
+
+        return self._chain[position]
+
+    def find_message(self, signature: bytes) \
+            -> typing.Optional[typing.Tuple[Block, Message]]:
+
+        """ Find message in closed block by signature.
+
+
+        >>> from core.block import mining
+        >>> user = User.generate()
+        >>> chain = Chain.generate(user, magicnumber='0')
+
+        >>> message = Message(user, 'namespace', 'hello')
+        >>> chain[-1].pool(message)
+        >>> chain.find_message(message.signature) is None
+        True
+
+        >>> chain.join(chain[-1].close(user, mining(chain[-1])))
+        >>> block, found = chain.find_message(message.signature)
+        >>> block.index, found is message
+        (1, True)
+        """
+
+        position = self._messages.get(signature)
+        if position is None:
+            return None
+
+        block = self._chain[position[0]]
+        return block, block.messages[position[1]]
+
+    def locate_message(self, signature: bytes) -> typing.Optional[Position]:
+        """ Get index of block and position in the block of message. """
+
+        return self._messages.get(signature)
+
+    def query(self,
+              namespace: str = None,
+              sender: bytes = None,
+              start: Position = (0, 0),
+              limit: int = None) -> typing.List[typing.Tuple[Position,
+                                                             Message]]:
+
+        """ Find messages in closed blocks by namespace and sender.
+
+        Sender is the fingerprint of public key. Returns pairs of position,
+        that is index of block and position of message in the block, and
+        message, from the start position in order. At least one of namespace
+        and sender must be given.
+
+
+        >>> from core.block import mining
+        >>> alice = User.generate()
+        >>> bob = User.generate()
+        >>> chain = Chain.generate(alice, magicnumber='0')
+
+        >>> chain[-1].pool(Message(alice, 'messaging', 'hello'))
+        >>> chain[-1].pool(Message(bob, 'messaging', 'world'))
+        >>> chain[-1].pool(Message(bob, 'other', 'foobar'))
+        >>> chain.join(chain[-1].close(alice, mining(chain[-1])))
+
+        >>> [m.payload for _, m in chain.query('messaging')]
+        ['hello', 'world']
+        >>> [m.payload for _, m in chain.query(sender=bob.fingerprint)]
+        ['world', 'foobar']
+        >>> chain.query('messaging', bob.fingerprint)[0][0]
+        (1, 1)
+        >>> [m.payload for _, m in chain.query('messaging', start=(1, 1))]
+        ['world']
+        >>> chain.query('not found')
+        []
+        """
+
+        if namespace is None and sender is None:
+            raise ValueError('namespace or sender is required')
+
+        candidates = []
+        if namespace is not None:
+            candidates.append(self._namespaces.get(namespace, []))
+        if sender is not None:
+            candidates.append(self._senders.get(sender, []))
+
+        # Scan the shorter index and filter by the other condition.
+        positions = min(candidates, key=len)
+
+        result: typing.List[typing.Tuple[Position, Message]] = []
+
+        for i in range(bisect.bisect_left(positions, start), len(positions)):
+            if limit is not None and len(result) >= limit:
+                break
+
+            position = positions[i]
+            message = self._chain[position[0]].messages[position[1]]
+
+            if ((namespace is None or message.namespace == namespace)
+                    and (sender is None
+                         or message.user.fingerprint == sender)):
+
+                result.append((position, message))
+
+        return result
+
+    def _index(self, start: int, stop: int) -> None:
+        for position in range(start, stop):
+            block = self._chain[position]
+
+            self._blocks[block.signature] = position
+
+            for i, message in enumerate(block.messages):
+                self._messages[message.signature] = (position, i)
+
+                self._namespaces.setdefault(message.namespace, []).append(
+                    (position, i),
+                )
+                self._senders.setdefault(message.user.fingerprint, []).append(
+                    (position, i),
+                )
+
+    def _unindex(self, blocks: typing.Sequence[Block]) -> None:
+        """ Remove indexes of the last closed blocks. """
+
+        for block in reversed(blocks):
+            del self._blocks[block.signature]
+
+            for message in reversed(block.messages):
+                del self._messages[message.signature]
+
+                # Positions of the last blocks are at the end of the lists.
+                for inverted, key in ((self._namespaces, message.namespace),
+                                      (self._senders,
+                                       message.user.fingerprint)):
+                    positions = inverted[key]
+                    positions.pop()
+                    if len(positions) == 0:
+                        del inverted[key]
 
     def verify(self) -> bool:
-        """ Verify chain and all elements. """
+        """ Verify chain and all elements from the root.
+
+        Signatures of closers are verified at once by `core.batch.verify`
+        before checking blocks one by one. Blocks up to the newest checkpoint
+        are checked only linkage.
+
+
+        >>> from core.block import mining
+        >>> user = User.generate()
+        >>> chain = Chain.generate(user, magicnumber='0')
+        >>> chain.join(chain[-1].close(user, mining(chain[-1])))
+        >>> chain.join(chain[-1].close(user, mining(chain[-1])))
+
+        >>> chain.checkpoints = {1: chain[1].signature}
+        >>> chain[1].timestamp += 1
+        >>> chain.verify()
+        True
+
+        >>> chain.checkpoints = {}
+        >>> chain.verify()
+        False
+
+        >>> chain.checkpoints = {1: b'other block'}
+        >>> chain[1].timestamp -= 1
+        >>> chain.verify()
+        False
+
+        The chain is not changed if failed.
+
+        >>> chain[1] in chain, chain.find_block(chain[2].signature) is chain[2]
+        (True, True)
+        """
+
+        saved = (self._verified,
+                 self._blocks,
+                 self._messages,
+                 self._namespaces,
+                 self._senders)
+
+        self._verified = 0
+        self._blocks = {}
+        self._messages = {}
+        self._namespaces = {}
+        self._senders = {}
+
+        ok = False
+        try:
+            with verify_seconds.time():
+                linked = self._checkpointed()
+
+                batch.verify(batch.collect(self._chain[linked:],
+                                           messages=False))
 
-        if (len(self._chain) == 0
-            or not self[0].is_root()
-            or not self[0].verify()):
+                ok = self._verify_from(0, linked)
+        finally:
+            # Indexes are swapped in only if succeeded.
+            if not ok:
+                (self._verified,
+                 self._blocks,
+                 self._messages,
+                 self._namespaces,
+                 self._senders) = saved
+
+        return ok
+
+    def _checkpointed(self) -> int:
+        """ Get number of blocks up to the newest checkpoint in the chain. """
+
+        for index in sorted(self.checkpoints, reverse=True):
+            signature = self.checkpoints[index]
+
+            if (index < len(self._chain)
+                    and self._chain[index].signature == signature):
+
+                return index + 1
+
+        return 0
+
+    def _is_linked(self, parent: typing.Optional[Block], block: Block) -> bool:
+        """ Check the block is a child of parent, without verifying
+        signatures. Parent is None if the block should be the root.
+        """
+
+        if parent is None:
+            if not block.is_root():
+                return False
+        elif (block.is_root()
+              or block.parent.signature != parent.signature
+              or block.index != parent.index + 1
+              or block.version != parent.version):
 
             return False
 
-        if len(self._chain) == 1:
-            return True
+        expected = self.checkpoints.get(block.index)
+        return (expected is None
+                or block.signature is None
+                or expected == block.signature)
 
-        parent = self[0]
+    def _verify_from(self, start: int, linked: int = 0) -> bool:
+        """ Verify blocks after start, assuming blocks before it are valid.
 
-        for block in self[1:-1]:
-            if (block.is_root()
-                or block.parent.signature != parent.signature
-                or block.index != parent.index + 1):
+        Blocks before `linked` are checked only linkage, and that they are
+        closed with valid key.
+        """
+
+        if len(self._chain) == 0:
+            return False
+
+        for i in range(start, len(self._chain)):
+            block = self._chain[i]
+            parent = self._chain[i - 1] if i > 0 else None
 
+            if not self._is_linked(parent, block):
                 return False
 
+            if i < linked:
+                if not block.is_closed():
+                    return False
+                if parent is not None and not block.verify_key(block.key):
+                    return False
+
+                continue
+
             try:
                 if not block.verify():
                     return False
             except errors.BlockNotClosedError:
-                return False
+                if i != len(self._chain) - 1 or i == 0:
+                    return False
 
-            parent = block
+        verified = self._verified
 
-        if (self[-1].is_root()
-            or self[-1].parent.signature != self[-2].signature
-            or self[-1].index != self[-2].index + 1):
+        if self._chain[-1].is_closed():
+            self._verified = len(self._chain)
+        else:
+            self._verified = len(self._chain) - 1
 
-            return False
+        self._index(verified, self._verified)
 
-        try:
-            return self[-1].verify()
-        except errors.BlockNotClosedError:
-            return True
+        return True
 
     def join(self, block: Block) -> None:
-        """ Join new block. """
+        """ Join new block.
+
+        Only the new block and the leaf are verified, because blocks before
+        them are already verified. Use `verify` to verify whole chain again.
 
-        if (block.is_root() or (block.is_closed() and not block.verify())):
-            raise errors.InvalidChainError()
 
-        leaf = self[-1]
+        >>> from core.block import mining
+        >>> user = User.generate()
+        >>> chain = Chain.generate(user, magicnumber='0')
 
-        if (leaf.is_closed()
-            and leaf.signature == block.parent.signature
-            and leaf.index + 1 == block.index):
+        >>> leaf = chain[-1]
+        >>> chain.join(leaf.close(user, mining(leaf)))
+        >>> len(chain)
+        3
 
-            self._chain.append(block)
-        elif (block.is_closed()
-              and not leaf.is_closed()
-              and block.index == leaf.index):
+        Invalid block is not joined.
 
-            self._chain.insert(-1, block)
-            self[-1].parent = block
-            self[-1].index += 1
-        else:
+        >>> invalid = Block(chain[0])
+        >>> chain.join(invalid)
+        Traceback (most recent call last):
+            ...
+        core.errors.InvalidChainError
+        >>> len(chain)
+        3
+        >>> chain.verify()
+        True
+        """
+
+        with join_seconds.time():
+            if (block.is_root()
+                    or block.is_header()
+                    or (block.is_closed() and not block.verify())):
+
+                raise errors.InvalidChainError()
+
+            leaf = self[-1]
+
+            if (leaf.is_closed()
+                and leaf.signature == block.parent.signature
+                and leaf.index + 1 == block.index):
+
+                self._chain.append(block)
+
+                if not self._verify_from(self._verified):
+                    self._chain.pop()
+                    raise errors.InvalidChainError()
+            elif (block.is_closed()
+                  and not leaf.is_closed()
+                  and block.index == leaf.index):
+
+                parent = leaf.parent
+
+                self._chain.insert(-1, block)
+                leaf.parent = block
+                leaf.index += 1
+
+                if not self._verify_from(self._verified):
+                    self._chain.remove(block)
+                    leaf.parent = parent
+                    leaf.index -= 1
+                    raise errors.InvalidChainError()
+            else:
+                raise errors.InvalidChainError()
+
+    def extend(self, blocks: typing.Sequence[Block]) -> None:
+        """ Join closed blocks up to a checkpoint at once.
+
+        The last block must match a checkpoint. Only linkage of the blocks is
+        checked, because the checkpoint vouches for blocks below it.
+
+
+        >>> from core.block import mining
+        >>> user = User.generate()
+        >>> remote = Chain.generate(user, magicnumber='0')
+        >>> for _ in range(3):
+        ...     remote.join(remote[-1].close(user, mining(remote[-1])))
+
+        >>> chain = Chain([remote[0], Block(remote[0])])
+        >>> chain.extend(remote[1:3])
+        Traceback (most recent call last):
+            ...
+        core.errors.InvalidChainError
+
+        >>> chain.checkpoints = {2: remote[2].signature}
+        >>> chain.extend(remote[1:3])
+        >>> len(chain), chain[-1].index
+        (4, 3)
+        >>> chain.join(remote[3])
+        >>> chain.find_block(remote[3].signature) is remote[3]
+        True
+        """
+
+        if len(blocks) == 0:
+            return
+
+        last = blocks[-1]
+        if self.checkpoints.get(last.index) != last.signature:
             raise errors.InvalidChainError()
 
-        if not self.verify():
+        with join_seconds.time():
+            parent = self._chain[self._verified - 1]
+
+            for block in blocks:
+                if (not block.is_closed()
+                        or block.is_header()
+                        or not self._is_linked(parent, block)
+                        or not block.verify_key(block.key)):
+
+                    raise errors.InvalidChainError()
+
+                parent = block
+
+            verified = self._verified
+            self._chain[verified:verified] = blocks
+            self._verified += len(blocks)
+
+            if len(self._chain) > self._verified:
+                leaf = self._chain[-1]
+                leaf.parent = last
+                leaf.index = last.index + 1
+
+            self._index(verified, self._verified)
+
+    def rollback(self, index: int) -> typing.List[Block]:
+        """ Remove closed blocks after the index for switching branch.
+
+        The leaf is moved onto the block at the index. Returns removed blocks
+        from the oldest. Takes time proportional to the removed blocks and
+        their messages. Blocks at checkpoints can not be removed.
+
+
+        >>> from core.block import mining
+        >>> user = User.generate()
+        >>> chain = Chain.generate(user, magicnumber='0')
+        >>> chain[-1].pool(Message(user, 'namespace', 'hello'))
+        >>> chain.join(chain[-1].close(user, mining(chain[-1])))
+        >>> chain.join(chain[-1].close(user, mining(chain[-1])))
+
+        >>> [block.index for block in chain.rollback(0)]
+        [1, 2]
+        >>> len(chain), chain[-1].index
+        (2, 1)
+        >>> chain.query('namespace')
+        []
+        """
+
+        if not 0 <= index < self._verified:
+            raise IndexError('block index out of range')
+
+        if any(index < i < self._verified for i in self.checkpoints):
             raise errors.InvalidChainError()
 
+        removed = self._chain[index + 1:self._verified]
+
+        self._unindex(removed)
+        del self._chain[index + 1:self._verified]
+        self._verified = index + 1
+
+        if len(self._chain) > self._verified:
+            leaf = self._chain[-1]
+            leaf.parent = self._chain[index]
+            leaf.index = index + 1
+
+        return removed
+
     def as_dict(self) -> typing.Tuple[dict, ...]:
         """ Convert to dictoinary for serialize. """
 
@@ -151,14 +620,184 @@ class Chain(typing.Iterable[Block], typing.Sized):
 
         return json.dumps(self.as_dict())
 
+    def iter_json(self) -> typing.Iterator[str]:
+        """ Serialize to json chunk by chunk.
+
+        Blocks are serialized when the chunk is taken, so whole chain is not
+        kept in memory as a string.
+
+
+        >>> chain = Chain.generate(User.generate())
+        >>> ''.join(chain.iter_json()) == chain.as_json()
+        True
+        """
+
+        return self._iter_json(list(self._chain))
+
+    @staticmethod
+    def _iter_json(blocks: typing.List[Block]) -> typing.Iterator[str]:
+        yield '['
+
+        for i, block in enumerate(blocks):
+            if i > 0:
+                yield ', '
+            yield block.as_json()
+
+        yield ']'
+
     @classmethod
-    def from_dict(cls, data: typing.Tuple[dict]) -> 'Chain':
-        """ Convert from dictoinary for deserialize. """
+    def from_blocks(cls, blocks: typing.Iterable[Block]) -> 'Chain':
+        """ Make chain by joining blocks one by one.
+
+        Each block is verified when it is joined.
+
+
+        >>> chain = Chain.generate(User.generate())
+        >>> len(Chain.from_blocks(iter(chain)))
+        2
+        >>> Chain.from_blocks([])
+        Traceback (most recent call last):
+            ...
+        core.errors.InvalidChainError
+        """
 
-        return cls([Block.from_dict(b) for b in data])
+        iterator = iter(blocks)
+
+        root = next(iterator, None)
+        if root is None:
+            raise errors.InvalidChainError()
+
+        result = cls([root])
+        for block in iterator:
+            result.join(block)
+
+        return result
 
     @classmethod
-    def from_json(cls, data: str) -> 'Chain':
+    def from_json_stream(cls,
+                         chunks: typing.Iterable[typing.Union[str, bytes]],
+                         magicnumber: str = None) -> 'Chain':
+
+        """ Deserialize from chunks of json.
+
+        Blocks are decoded and verified one by one, as chunks arrive.
+
+
+        >>> chain = Chain.generate(User.generate())
+        >>> data = chain.as_json().encode('ascii')
+        >>> chunks = (data[i:i + 100] for i in range(0, len(data), 100))
+
+        >>> decoded = Chain.from_json_stream(chunks)
+        >>> [block.signature for block in decoded] \\
+        ...     == [block.signature for block in chain]
+        True
+
+        >>> Chain.from_json_stream(['[{"index": 0'])
+        Traceback (most recent call last):
+            ...
+        core.errors.InvalidEncodingError: unexpected end of json
+        """
+
+        return cls.from_blocks(Block.from_dict(b, magicnumber)
+                               for b in _iter_json_array(chunks))
+
+    @classmethod
+    def from_dict(cls,
+                  data: typing.Tuple[dict],
+                  magicnumber: str = None) -> 'Chain':
+
+        """ Convert from dictoinary for deserialize.
+
+        Signatures of all blocks and messages are verified at once by
+        `core.batch.verify_blocks`.
+        """
+
+        blocks = [Block.from_dict(b, magicnumber, verify=False) for b in data]
+
+        if not batch.verify_blocks(blocks):
+            raise errors.InvalidChainError()
+
+        return cls(blocks)
+
+    @classmethod
+    def from_json(cls, data: str, magicnumber: str = None) -> 'Chain':
         """ Deserialize from json. """
 
-        return cls.from_dict(json.loads(data))
+        return cls.from_dict(json.loads(data), magicnumber)
+
+
+def _iter_json_array(chunks: typing.Iterable[typing.Union[str, bytes]]) \
+        -> typing.Iterator[typing.Any]:
+
+    """ Decode elements of json array of objects from chunks. """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    buffer = ''
+    started = False
+
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk)
+        buffer += chunk
+
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+
+            if position >= len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != '[':
+                    raise errors.InvalidEncodingError('not json array')
+                started = True
+                position += 1
+            elif buffer[position] == ']':
+                return
+            elif buffer[position] == ',':
+                position += 1
+            else:
+                try:
+                    element, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break
+                yield element
+
+        buffer = buffer[position:]
+
+    raise errors.InvalidEncodingError('unexpected end of json')
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from core.block import mining
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    step = max(size // 10, 1)
+
+    user = User.generate()
+    chain = Chain.generate(user, magicnumber='0')
+
+    elapsed = 0.0
+    while len(chain) < size:
+        leaf = chain[-1]
+        next_ = leaf.close(user, mining(leaf))
+
+        started = time.perf_counter()
+        chain.join(next_)
+        elapsed += time.perf_counter() - started
+
+        if len(chain) % step == 0:
+            started = time.perf_counter()
+            chain.verify()
+            verify = time.perf_counter() - started
+
+            print('{:7d} blocks: join {:.3f} ms/block, full verify {:.3f} s'
+                  .format(len(chain), elapsed / step * 1000, verify))
+
+            elapsed = 0.0
@@ -0,0 +1,552 @@
+import json
+import typing
+
+from core import batch, errors
+from core.block import Block, DummyBlock
+from core.chain import Chain
+from core.message import Message, verify_messages
+from core.user import User
+
+
+CONTENT_TYPE = 'application/x-macracoin'
+VERSION = 1
+
+_MAGIC = b'MC'
+_KIND_BLOCK = b'B'
+_KIND_MESSAGE = b'M'
+_KIND_CHAIN = b'C'
+_KIND_BLOCKS = b'L'
+_KIND_HEADERS = b'H'
+
+_HAS_PARENT = 0x01
+_HAS_KEY = 0x02
+_HAS_CLOSER = 0x04
+_HAS_TIMESTAMP = 0x08
+_HAS_SIGNATURE = 0x10
+_HAS_VERSION = 0x20
+_IS_HEADER = 0x40
+
+
+class _Writer:
+    """ Writer of binary encoding.
+
+    Public keys are written as DER at the first time, and referenced by
+    number in the key table after that.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self._keys: typing.Dict[bytes, int] = {}
+
+    def varint(self, value: int) -> None:
+        if value < 0:
+            raise ValueError('varint must be not negative')
+
+        while value >= 0x80:
+            self.buffer.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self.buffer.append(value)
+
+    def bytes(self, value: bytes) -> None:
+        self.varint(len(value))
+        self.buffer += value
+
+    def user(self, user: User) -> None:
+        ref = self._keys.get(user.fingerprint)
+
+        if ref is not None:
+            self.varint(ref + 1)
+        else:
+            self._keys[user.fingerprint] = len(self._keys)
+            self.varint(0)
+            self.bytes(user.public_der)
+
+    def header(self, kind: bytes) -> None:
+        self.buffer += _MAGIC + bytes((VERSION,)) + kind
+
+    def message(self, message: Message) -> None:
+        self.user(message.user)
+        self.bytes(message.namespace.encode('utf-8'))
+        self.bytes(json.dumps(message.payload,
+                              separators=(',', ':')).encode('utf-8'))
+        self.bytes(message.signature)
+
+    def block(self, block: Block, header: bool = False) -> None:
+        """ Write block, or header of block that has the Merkle root of
+        version 2 block instead of messages.
+        """
+
+        flags = 0
+        if block.parent is not None:
+            flags |= _HAS_PARENT
+        if block.key is not None:
+            flags |= _HAS_KEY
+        if block.closer is not None:
+            flags |= _HAS_CLOSER
+        if block.timestamp is not None:
+            flags |= _HAS_TIMESTAMP
+        if block.signature is not None:
+            flags |= _HAS_SIGNATURE
+        if block.version != 1:
+            flags |= _HAS_VERSION
+        if header:
+            flags |= _IS_HEADER
+
+        self.buffer.append(flags)
+        self.varint(block.index)
+
+        if block.version != 1:
+            self.varint(block.version)
+
+        if block.parent is not None:
+            self.bytes(block.parent.signature)
+        if block.key is not None:
+            self.bytes(block.key)
+        if block.closer is not None:
+            self.user(block.closer)
+        if block.timestamp is not None:
+            self.varint(block.timestamp)
+        if block.signature is not None:
+            self.bytes(block.signature)
+
+        if header:
+            if block.version != 1:
+                self.bytes(block.merkle_root())
+            return
+
+        self.varint(len(block.messages))
+        for message in block.messages:
+            self.message(message)
+
+    def take(self) -> bytes:
+        result = bytes(self.buffer)
+        self.buffer = bytearray()
+        return result
+
+
+class _Reader:
+    """ Reader of binary encoding from chunks of bytes. """
+
+    def __init__(self,
+                 chunks: typing.Iterable[bytes],
+                 verify: bool = True) -> None:
+
+        self._chunks = iter(chunks)
+        self._verify = verify
+        self._buffer = b''
+        self._position = 0
+        self._keys: typing.List[bytes] = []
+
+    def _fill(self, size: int) -> bool:
+        rest = len(self._buffer) - self._position
+        if rest >= size:
+            return True
+
+        chunks = [self._buffer[self._position:]]
+        while rest < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            rest += len(chunk)
+
+        self._buffer = b''.join(chunks)
+        self._position = 0
+
+        return rest >= size
+
+    def at_end(self) -> bool:
+        return not self._fill(1)
+
+    def read(self, size: int) -> bytes:
+        if not self._fill(size):
+            raise errors.InvalidEncodingError('unexpected end of data')
+
+        result = self._buffer[self._position:self._position + size]
+        self._position += size
+        return result
+
+    def varint(self) -> int:
+        result = 0
+        shift = 0
+
+        while True:
+            byte = self.read(1)[0]
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def bytes(self) -> bytes:
+        return self.read(self.varint())
+
+    def key(self) -> bytes:
+        """ Read DER of public key, without loading it. """
+
+        ref = self.varint()
+
+        if ref == 0:
+            key = self.bytes()
+            self._keys.append(key)
+            return key
+
+        try:
+            return self._keys[ref - 1]
+        except IndexError:
+            raise errors.InvalidEncodingError('unknown key reference')
+
+    def user(self) -> User:
+        return User.from_der(self.key())
+
+    def header(self, kind: bytes) -> None:
+        header = self.read(len(_MAGIC) + 2)
+
+        if header[:len(_MAGIC)] != _MAGIC:
+            raise errors.InvalidEncodingError('not macracoin encoding')
+        if header[len(_MAGIC)] != VERSION:
+            raise errors.InvalidEncodingError('unsupported version')
+        if header[len(_MAGIC) + 1:] != kind:
+            raise errors.InvalidEncodingError('unexpected kind')
+
+    def message(self, verify: bool = None) -> Message:
+        if verify is None:
+            verify = self._verify
+
+        key = self.key()
+        namespace = self.bytes().decode('utf-8')
+        payload = json.loads(self.bytes().decode('utf-8'))
+
+        return Message(key, namespace, payload, self.bytes(), verify)
+
+    def block(self, magicnumber: str = None, header: bool = False) -> Block:
+        """ Read block, or header if header is True. """
+
+        flags = self.read(1)[0]
+        if bool(flags & _IS_HEADER) != header:
+            raise errors.InvalidEncodingError(
+                'expected {}'.format('header' if header else 'block'),
+            )
+
+        index = self.varint()
+
+        version = 1
+        if flags & _HAS_VERSION:
+            version = self.varint()
+
+        parent = None
+        if flags & _HAS_PARENT:
+            parent = DummyBlock(index - 1, magicnumber, self.bytes(), version)
+
+        try:
+            result = Block(parent, magicnumber, version)
+        except TypeError as e:
+            raise errors.InvalidEncodingError(str(e))
+
+        if flags & _HAS_KEY:
+            result.key = self.bytes()
+        if flags & _HAS_CLOSER:
+            result.closer = self.user()
+        if flags & _HAS_TIMESTAMP:
+            result.timestamp = self.varint()
+        if flags & _HAS_SIGNATURE:
+            result.signature = self.bytes()
+
+        if header:
+            if version != 1:
+                result._header_root = self.bytes()
+            result._is_header = True
+            return result
+
+        result.messages = [self.message(False)
+                           for _ in range(self.varint())]
+
+        if self._verify and not verify_messages(result.messages):
+            raise errors.InvalidSignatureError()
+
+        return result
+
+
+def encode_message(message: Message) -> bytes:
+    """ Encode message into binary.
+
+
+    >>> user = User.generate()
+    >>> message = Message(user, 'namespace', {'hello': 'world'})
+
+    >>> decoded = decode_message(encode_message(message))
+    >>> decoded.payload
+    {'hello': 'world'}
+    >>> decoded.signature == message.signature
+    True
+    """
+
+    writer = _Writer()
+    writer.header(_KIND_MESSAGE)
+    writer.message(message)
+    return writer.take()
+
+
+def decode_message(data: bytes, verify: bool = True) -> Message:
+    """ Decode message from binary.
+
+    The signature is verified unless verify is False.
+    """
+
+    reader = _Reader([data], verify)
+    reader.header(_KIND_MESSAGE)
+    return reader.message()
+
+
+def encode_block(block: Block) -> bytes:
+    """ Encode block into binary.
+
+
+    >>> user = User.generate()
+    >>> root = Block.make_root(user)
+    >>> child = Block(root)
+    >>> child.pool(Message(user, 'namespace', 'hello'))
+    >>> child.pool(Message(user, 'namespace', 'world'))
+
+    >>> decode_block(encode_block(root)).verify()
+    True
+
+    >>> decoded = decode_block(encode_block(child))
+    >>> decoded.parent.signature == root.signature
+    True
+    >>> [m.payload for m in decoded.messages]
+    ['hello', 'world']
+
+    Public key is written only once in an encoding.
+
+    >>> len(encode_block(child)) < len(child.as_json()) // 2
+    True
+    """
+
+    writer = _Writer()
+    writer.header(_KIND_BLOCK)
+    writer.block(block)
+    return writer.take()
+
+
+def decode_block(data: bytes, magicnumber: str = None) -> Block:
+    """ Decode block from binary.
+
+    >>> decode_block(b'hello world')
+    Traceback (most recent call last):
+        ...
+    core.errors.InvalidEncodingError: not macracoin encoding
+    """
+
+    reader = _Reader([data])
+    reader.header(_KIND_BLOCK)
+    return reader.block(magicnumber)
+
+
+def encode_blocks(blocks: typing.Iterable[Block]) -> bytes:
+    """ Encode part of chain into binary.
+
+
+    >>> chain = Chain.generate(User.generate())
+
+    >>> decoded = decode_blocks(encode_blocks(chain[1:]))
+    >>> [block.index for block in decoded]
+    [1]
+    >>> decode_blocks(encode_blocks([]))
+    []
+    """
+
+    writer = _Writer()
+    writer.header(_KIND_BLOCKS)
+    for block in blocks:
+        writer.block(block)
+    return writer.take()
+
+
+def decode_blocks(data: bytes,
+                  magicnumber: str = None,
+                  verify: bool = True) -> typing.List[Block]:
+
+    """ Decode part of chain from binary.
+
+    Blocks are not verified. Signatures of messages are verified unless verify
+    is False.
+    """
+
+    reader = _Reader([data], verify)
+    reader.header(_KIND_BLOCKS)
+
+    blocks = []
+    while not reader.at_end():
+        blocks.append(reader.block(magicnumber))
+
+    return blocks
+
+
+def encode_headers(blocks: typing.Iterable[Block]) -> bytes:
+    """ Encode headers of blocks into binary.
+
+
+    >>> user = User.generate()
+    >>> chain = Chain.generate(user)
+    >>> chain[1].pool(Message(user, 'namespace', 'hello'))
+
+    >>> decoded = decode_headers(encode_headers(chain))
+    >>> [len(header.messages) for header in decoded]
+    [0, 0]
+    >>> decoded[1].merkle_root() == chain[1].merkle_root()
+    True
+    >>> decoded[0].verify()
+    True
+
+    Header can not be decoded as a block.
+
+    >>> data = encode_headers(chain)
+    >>> decode_blocks(data.replace(_KIND_HEADERS, _KIND_BLOCKS, 1))
+    Traceback (most recent call last):
+        ...
+    core.errors.InvalidEncodingError: expected block
+    """
+
+    writer = _Writer()
+    writer.header(_KIND_HEADERS)
+    for block in blocks:
+        writer.block(block, header=True)
+    return writer.take()
+
+
+def decode_headers(data: bytes,
+                   magicnumber: str = None) -> typing.List[Block]:
+
+    """ Decode headers of blocks from binary.
+
+    Headers are not verified. Use `core.headers.verify_headers` to verify
+    them.
+    """
+
+    reader = _Reader([data])
+    reader.header(_KIND_HEADERS)
+
+    headers = []
+    while not reader.at_end():
+        headers.append(reader.block(magicnumber, header=True))
+
+    return headers
+
+
+def encode_chain(chain: Chain) -> bytes:
+    """ Encode chain into binary.
+
+
+    >>> chain = Chain.generate(User.generate())
+
+    >>> decoded = decode_chain(encode_chain(chain))
+    >>> len(decoded)
+    2
+    >>> decoded[0].signature == chain[0].signature
+    True
+    """
+
+    return b''.join(iter_encode_chain(chain))
+
+
+def iter_encode_chain(chain: Chain) -> typing.Iterator[bytes]:
+    """ Encode chain into binary chunk by chunk.
+
+    Each block is encoded when the chunk is taken.
+    """
+
+    return _iter_encode_chain(list(chain))
+
+
+def _iter_encode_chain(blocks: typing.List[Block]) -> typing.Iterator[bytes]:
+    writer = _Writer()
+    writer.header(_KIND_CHAIN)
+
+    for block in blocks:
+        writer.block(block)
+        yield writer.take()
+
+    if len(blocks) == 0:
+        yield writer.take()
+
+
+def iter_decode_chain(chunks: typing.Iterable[bytes],
+                      magicnumber: str = None) -> typing.Iterator[Block]:
+
+    """ Decode blocks of chain from chunks of binary one by one.
+
+    Blocks are not verified. Use `Chain.from_blocks` to verify and join them.
+
+
+    >>> chain = Chain.generate(User.generate())
+    >>> chunks = iter_encode_chain(chain)
+
+    >>> decoded = Chain.from_blocks(iter_decode_chain(chunks))
+    >>> [block.signature for block in decoded] \\
+    ...     == [block.signature for block in chain]
+    True
+    """
+
+    reader = _Reader(chunks)
+    reader.header(_KIND_CHAIN)
+
+    while not reader.at_end():
+        yield reader.block(magicnumber)
+
+
+def decode_chain(data: bytes, magicnumber: str = None) -> Chain:
+    """ Decode chain from binary. """
+
+    reader = _Reader([data], verify=False)
+    reader.header(_KIND_CHAIN)
+
+    blocks = []
+    while not reader.at_end():
+        blocks.append(reader.block(magicnumber))
+
+    if not batch.verify_blocks(blocks):
+        raise errors.InvalidChainError()
+
+    return Chain(blocks)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from core.block import mining
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    users = [User.generate() for _ in range(10)]
+    chain = Chain.generate(users[0], magicnumber='0')
+
+    while len(chain) < size:
+        leaf = chain[-1]
+        for i in range(messages):
+            leaf.pool(Message(users[i % len(users)], 'benchmark', i))
+        chain.join(leaf.close(users[0], mining(leaf)))
+
+    def measure(encode: typing.Callable[[Chain], typing.Any],
+                decode: typing.Callable[[typing.Any, str], Chain]) \
+            -> typing.Tuple[int, float, float]:
+
+        started = time.perf_counter()
+        data = encode(chain)
+        encoded = time.perf_counter()
+        decode(data, '0')
+        decoded = time.perf_counter()
+
+        return len(data), encoded - started, decoded - encoded
+
+    print('{} blocks, {} messages per block'.format(size, messages))
+    for name, encode, decode in (('json', Chain.as_json, Chain.from_json),
+                                 ('binary', encode_chain, decode_chain)):
+        length, encoding, decoding = measure(encode, decode)
+        print('{:>6s}: {:10d} bytes, encode {:.3f} s, decode {:.3f} s'.format(
+            name,
+            length,
+            encoding,
+            decoding,
+        ))
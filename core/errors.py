@@ -10,6 +10,10 @@ class InvalidChainError(ValueError):
     pass
 
 
+class InvalidEncodingError(ValueError):
+    pass
+
+
 class InvalidKeyError(ValueError):
     pass
 
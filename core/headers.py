@@ -0,0 +1,118 @@
+import typing
+
+from core import batch
+from core.block import Block
+
+
+def verify_headers(parent: Block,
+                   headers: typing.Sequence[Block],
+                   checkpoints: typing.Mapping[int, bytes] = None,
+                   workers: int = None,
+                   threshold: int = batch.THRESHOLD) -> bool:
+
+    """ Verify headers that follow the parent, without messages.
+
+    Headers must be closed version 2 blocks, that linked from the parent one
+    by one and matched with checkpoints. Keys are verified with the Merkle
+    root in the header, and then signatures of closers are verified at once
+    by `core.batch.verify`. Signatures of headers up to the newest matched
+    checkpoint are not verified, same as `core.Chain.verify`.
+
+
+    >>> from core.block import mining
+    >>> from core.message import Message
+    >>> from core.user import User
+    >>> user = User.generate()
+    >>> root = Block.make_root(user, magicnumber='0000')
+
+    >>> blocks = []
+    >>> parent = root
+    >>> for payload in ('hello', 'world'):
+    ...     block = Block(parent)
+    ...     block.pool(Message(user, 'namespace', payload))
+    ...     _ = block.close(user, mining(block))
+    ...     blocks.append(block)
+    ...     parent = block
+
+    >>> headers = [Block.header_from_dict(b.as_header(), magicnumber='0000')
+    ...            for b in blocks]
+    >>> verify_headers(root, headers)
+    True
+    >>> verify_headers(root, headers[1:])
+    False
+    >>> verify_headers(root, headers, {2: root.signature})
+    False
+
+    The key does not match if messages are changed. The magic number is
+    long, so that a changed Merkle root does not match by chance.
+
+    >>> headers[0]._header_root = headers[1].merkle_root()
+    >>> verify_headers(root, headers)
+    False
+    """
+
+    if checkpoints is None:
+        checkpoints = {}
+
+    linked = 0
+
+    previous = parent
+    for i, header in enumerate(headers):
+        if (not header.is_closed()
+                or header.is_root()
+                or header.version == 1
+                or header.parent.signature != previous.signature
+                or header.index != previous.index + 1
+                or header.version != previous.version
+                or header.magicnumber != previous.magicnumber):
+
+            return False
+
+        expected = checkpoints.get(header.index)
+        if expected is not None:
+            if expected != header.signature:
+                return False
+            linked = i + 1
+
+        if not header.verify_key(header.key):
+            return False
+
+        previous = header
+
+    return batch.verify([(h.closer, h.signed_data(), h.signature)
+                         for h in headers[linked:]],
+                        workers,
+                        threshold)
+
+
+def matches(header: Block, block: Block) -> bool:
+    """ Check the block has the same header, and messages of the block are
+    the same as the header has.
+
+
+    >>> from core.message import Message
+    >>> from core.user import User
+    >>> user = User.generate()
+    >>> root = Block.make_root(user, magicnumber='0')
+    >>> block = Block(root)
+    >>> block.pool(Message(user, 'namespace', 'hello'))
+    >>> header = Block.header_from_dict(block.as_header(),
+    ...                                 magicnumber='0')
+
+    >>> matches(header, block)
+    True
+    >>> block.pool(Message(user, 'namespace', 'world'))
+    >>> matches(header, block)
+    False
+    """
+
+    return (header.index == block.index
+            and header.version == block.version
+            and header.signature == block.signature
+            and header.parent.signature == block.parent.signature
+            and header.key == block.key
+            and header.timestamp == block.timestamp
+            and (header.closer is None) == (block.closer is None)
+            and (header.closer is None
+                 or header.closer.fingerprint == block.closer.fingerprint)
+            and header.merkle_root() == block.merkle_root())
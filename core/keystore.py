@@ -0,0 +1,113 @@
+import os
+import typing
+
+from core.user import User
+
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.macracoin', 'keys')
+
+
+class KeyStore:
+    """ The local storage of private keys by name.
+
+    Keys are saved as PEM files that only the owner can read, so scripts can
+    reuse the same user instead of generating new key every time. The
+    directory is `MACRACOIN_KEYS` environment variable, or `DEFAULT_DIRECTORY`
+    if not set.
+
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> store = KeyStore(directory.name)
+
+    >>> store.load('alice') is None
+    True
+    >>> user, generated = store.load_or_generate('alice')
+    >>> generated
+    True
+
+    >>> loaded, generated = store.load_or_generate('alice')
+    >>> generated, loaded.public_pem == user.public_pem
+    (False, True)
+    >>> store.names()
+    ['alice']
+
+    >>> store.load('../alice')
+    Traceback (most recent call last):
+        ...
+    ValueError: invalid key name: '../alice'
+
+    >>> directory.cleanup()
+    """
+
+    SUFFIX = '.pem'
+
+    def __init__(self, directory: str = None) -> None:
+        if directory is None:
+            directory = os.environ.get('MACRACOIN_KEYS', DEFAULT_DIRECTORY)
+
+        self.directory = directory
+
+    def path(self, name: str) -> str:
+        """ Get path of the key file. """
+
+        if (name == ''
+                or name.startswith('.')
+                or os.sep in name
+                or (os.altsep is not None and os.altsep in name)):
+
+            raise ValueError('invalid key name: {!r}'.format(name))
+
+        return os.path.join(self.directory, name + self.SUFFIX)
+
+    def names(self) -> typing.List[str]:
+        """ Get names of saved keys. """
+
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return sorted(f[:-len(self.SUFFIX)] for f in files
+                      if f.endswith(self.SUFFIX) and not f.startswith('.'))
+
+    def load(self, name: str) -> typing.Optional[User]:
+        """ Load user, or returns None if not saved. """
+
+        try:
+            with open(self.path(name)) as f:
+                return User.from_pem(f.read())
+        except FileNotFoundError:
+            return None
+
+    def save(self, name: str, user: User) -> None:
+        """ Save user, replacing the saved key if exists. """
+
+        path = self.path(name)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+        # Write into temporary file and rename, so the key is never broken.
+        temporary = os.path.join(self.directory,
+                                 '.{}.{}.tmp'.format(name, os.getpid()))
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(user.private_pem)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temporary, path)
+
+    def load_or_generate(self, name: str) -> typing.Tuple[User, bool]:
+        """ Load user, or generate and save new user if not saved.
+
+        Returns the user and whether it was generated or not.
+        """
+
+        user = self.load(name)
+        if user is not None:
+            return user, False
+
+        user = User.generate()
+        self.save(name, user)
+
+        return user, True
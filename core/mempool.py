@@ -0,0 +1,181 @@
+import collections
+import itertools
+import time
+import typing
+
+from core import errors
+from core.message import Message
+
+
+class Mempool:
+    """ The pool of messages that waiting to be included in a block.
+
+    Messages are kept in order of admission, so the oldest message is
+    evicted first when the pool is full, and block templates are built from
+    the oldest messages. Signatures are verified only once on admission.
+
+
+    >>> from core.user import User
+    >>> user = User.generate()
+    >>> hello = Message(user, 'namespace', 'hello')
+    >>> world = Message(user, 'namespace', 'world')
+
+    >>> pool = Mempool(capacity=2)
+    >>> pool.add(hello)
+    True
+    >>> pool.add(world)
+    True
+    >>> [m.payload for m in pool.template()]
+    ['hello', 'world']
+
+    Same message is pooled only once.
+
+    >>> pool.add(hello)
+    False
+    >>> len(pool)
+    2
+
+    The oldest message is evicted if the pool is full.
+
+    >>> pool.add(Message(user, 'namespace', 'foobar'))
+    True
+    >>> hello.signature in pool
+    False
+    >>> [m.payload for m in pool.template(limit=1)]
+    ['world']
+
+    Messages that included in a block are removed.
+
+    >>> pool.remove([world])
+    >>> [m.payload for m in pool.template()]
+    ['foobar']
+
+    Invalid message is not pooled.
+
+    >>> pool.add(Message(user, 'namespace', 'hello', world.signature, False))
+    Traceback (most recent call last):
+        ...
+    core.errors.InvalidSignatureError
+    """
+
+    def __init__(self,
+                 capacity: int = 10000,
+                 max_bytes: int = 16 << 20,
+                 max_age: float = 60 * 60) -> None:
+
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        # Messages and their size and admitted time, from the oldest.
+        self._messages: typing.MutableMapping[
+            bytes,
+            typing.Tuple[Message, int, float],
+        ] = collections.OrderedDict()
+
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __contains__(self, signature: bytes) -> bool:
+        return signature in self._messages
+
+    @staticmethod
+    def _size(message: Message) -> int:
+        return len(message.signed_data()) + len(message.signature)
+
+    def _pop_oldest(self) -> None:
+        _, (_, size, _) = self._messages.popitem(last=False)
+        self.bytes -= size
+
+    def expire(self, now: float = None) -> int:
+        """ Evict messages that older than max_age. Returns evicted count. """
+
+        if now is None:
+            now = time.monotonic()
+
+        count = 0
+        for _, _, added in self._messages.values():
+            if now - added <= self.max_age:
+                break
+            count += 1
+
+        for _ in range(count):
+            self._pop_oldest()
+
+        return count
+
+    def _insert(self, message: Message) -> bool:
+        size = self._size(message)
+        if size > self.max_bytes:
+            return False
+
+        self.expire()
+
+        while len(self._messages) > 0 and (
+                len(self._messages) >= self.capacity
+                or self.bytes + size > self.max_bytes):
+
+            self._pop_oldest()
+
+        self._messages[message.signature] = (message, size, time.monotonic())
+        self.bytes += size
+
+        return True
+
+    def add(self, message: Message) -> bool:
+        """ Verify and add message.
+
+        Returns False if the message is already pooled or too large.
+        """
+
+        if message.signature in self._messages:
+            return False
+
+        if not message.verify():
+            raise errors.InvalidSignatureError()
+
+        return self._insert(message)
+
+    def reinsert(self, messages: typing.Iterable[Message]) -> int:
+        """ Add messages that already admitted once, like messages of a
+        block that replaced by another block. Returns added count.
+        """
+
+        count = 0
+        for message in messages:
+            if message.signature not in self._messages:
+                count += self._insert(message)
+
+        return count
+
+    def remove(self, messages: typing.Iterable[Message]) -> None:
+        """ Remove messages, like messages that included in a block. """
+
+        for message in messages:
+            entry = self._messages.pop(message.signature, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def template(self,
+                 limit: int = None,
+                 max_bytes: int = None) -> typing.List[Message]:
+
+        """ Get the oldest messages for making a block.
+
+        Takes time proportional to the number of messages returned.
+        """
+
+        result = []
+        total = 0
+
+        for message, size, _ in itertools.islice(self._messages.values(),
+                                                 limit):
+            if max_bytes is not None and total + size > max_bytes:
+                break
+
+            result.append(message)
+            total += size
+
+        return result
@@ -0,0 +1,141 @@
+import hashlib
+import typing
+
+
+EMPTY_ROOT = hashlib.sha256(b'').digest()
+
+# Pair of whether the sibling is on the left side, and hash of the sibling.
+Proof = typing.List[typing.Tuple[bool, bytes]]
+
+
+def _leaf(signature: bytes) -> bytes:
+    return hashlib.sha256(b'\x00' + signature).digest()
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+class MerkleTree:
+    """ The Merkle tree of message signatures.
+
+    Leaves and nodes are hashed with different prefixes. A node that has no
+    pair is promoted to the upper level as is. The tree keeps all levels, so
+    appending a leaf rehashes only the path to the root.
+
+
+    >>> tree = MerkleTree([b'hello', b'world'])
+    >>> tree.root() == _node(_leaf(b'hello'), _leaf(b'world'))
+    True
+
+    >>> tree.append(b'foobar')
+    >>> len(tree)
+    3
+    >>> tree.root() == MerkleTree([b'hello', b'world', b'foobar']).root()
+    True
+
+    >>> verify_proof(b'foobar', tree.proof(2), tree.root())
+    True
+    >>> verify_proof(b'hello', tree.proof(2), tree.root())
+    False
+
+    >>> MerkleTree().root() == EMPTY_ROOT
+    True
+    """
+
+    def __init__(self, signatures: typing.Iterable[bytes] = ()) -> None:
+        self._levels: typing.List[typing.List[bytes]] = [[]]
+
+        for signature in signatures:
+            self.append(signature)
+
+    def __len__(self) -> int:
+        return len(self._levels[0])
+
+    def append(self, signature: bytes) -> None:
+        """ Append leaf and update nodes on the path to the root. """
+
+        self._levels[0].append(_leaf(signature))
+
+        position = len(self._levels[0]) - 1
+        level = 0
+
+        while len(self._levels[level]) > 1:
+            nodes = self._levels[level]
+            position //= 2
+
+            if position * 2 + 1 < len(nodes):
+                value = _node(nodes[position * 2], nodes[position * 2 + 1])
+            else:
+                value = nodes[position * 2]
+
+            if level + 1 == len(self._levels):
+                self._levels.append([])
+
+            upper = self._levels[level + 1]
+            if position < len(upper):
+                upper[position] = value
+            else:
+                upper.append(value)
+
+            level += 1
+
+    def root(self) -> bytes:
+        """ Get the root hash. """
+
+        if len(self) == 0:
+            return EMPTY_ROOT
+
+        return self._levels[-1][0]
+
+    def proof(self, position: int) -> Proof:
+        """ Get hashes of siblings on the path from the leaf to the root. """
+
+        if not 0 <= position < len(self):
+            raise IndexError('leaf position out of range')
+
+        result: Proof = []
+
+        for nodes in self._levels[:-1]:
+            sibling = position ^ 1
+            if sibling < len(nodes):
+                result.append((sibling < position, nodes[sibling]))
+            position //= 2
+
+        return result
+
+
+def verify_proof(signature: bytes, proof: Proof, root: bytes) -> bool:
+    """ Check the signature is a leaf of the tree that has the root. """
+
+    node = _leaf(signature)
+
+    for left, sibling in proof:
+        if left:
+            node = _node(sibling, node)
+        else:
+            node = _node(node, sibling)
+
+    return node == root
+
+
+def proof_as_list(proof: Proof) -> typing.List[typing.List[str]]:
+    """ Convert proof for serialize.
+
+
+    >>> proof = MerkleTree([b'hello', b'world']).proof(0)
+    >>> proof_from_list(proof_as_list(proof)) == proof
+    True
+    """
+
+    return [['left' if left else 'right', sibling.hex()]
+            for left, sibling in proof]
+
+
+def proof_from_list(data: typing.List[typing.List[str]]) -> Proof:
+    """ Convert proof from list for deserialize. """
+
+    if any(side not in ('left', 'right') for side, _ in data):
+        raise ValueError('invalid side of proof')
+
+    return [(side == 'left', bytes.fromhex(sibling)) for side, sibling in data]
@@ -1,9 +1,10 @@
 import base64
+import hashlib
 import json
 import typing
 
 from core import errors
-from core.user import User
+from core.user import User, serialize
 
 
 class Message:
@@ -35,42 +36,135 @@ class Message:
     Traceback (most recent call last):
         ...
     core.errors.InvalidSignatureError
+
+    The result of verification is forgotten when the message is changed.
+
+    >>> m2.verify()
+    True
+    >>> m2.signature = Message(u, 'my.space', 'foobar').signature
+    >>> m2.verify()
+    False
     """
 
     def __init__(self,
-                 user: User,
+                 user: typing.Union[User, str, bytes],
                  namespace: str,
                  payload: typing.Any,
-                 signature: bytes = None) -> None:
+                 signature: bytes = None,
+                 verify: bool = True) -> None:
+
+        """ Make message.
 
-        self.user = user
-        self.namespace = namespace
-        self.payload = payload
+        If signature is not given, sign with the user. Given signature is
+        verified unless verify is False.
+
+        User can be PEM text or DER bytes of the public key instead. It is
+        loaded when the user is used first.
+        """
+
+        self._user: typing.Optional[User] = None
+        self._key: typing.Union[str, bytes, None] = None
+        if isinstance(user, User):
+            self._user = user
+        else:
+            self._key = user
+
+        self._namespace = namespace
+        self._payload = payload
+
+        # Caches that depend on the fields above.
+        self._signed_data: typing.Optional[bytes] = None
+        self._digest: typing.Optional[bytes] = None
+        self._verified: typing.Optional[bool] = None
 
         if signature is None:
-            self.signature = user.sign({
-                'namespace': namespace,
-                'payload': self.payload,
-            })
+            self.signature = self.user.sign_raw(self.signed_data())
+            self._verified = True
         else:
             self.signature = signature
 
-            if not self.verify():
+            if verify and not self.verify():
                 raise errors.InvalidSignatureError()
 
+    @property
+    def user(self) -> User:
+        if self._user is None:
+            self._user = User.from_pem(self._key)
+
+        return self._user
+
+    @property
+    def signature(self) -> bytes:
+        return self._signature
+
+    @signature.setter
+    def signature(self, value: bytes) -> None:
+        self._signature = value
+        self._reset()
+
+    @property
+    def namespace(self) -> str:
+        return self._namespace
+
+    @namespace.setter
+    def namespace(self, value: str) -> None:
+        self._namespace = value
+        self._reset()
+
+    @property
+    def payload(self) -> typing.Any:
+        return self._payload
+
+    @payload.setter
+    def payload(self, value: typing.Any) -> None:
+        self._payload = value
+        self._reset()
+
+    def _reset(self) -> None:
+        self._signed_data = self._digest = self._verified = None
+
+    def signed_data(self) -> bytes:
+        """ Get bytes that signed by the user. """
+
+        if self._signed_data is None:
+            self._signed_data = serialize({
+                'namespace': self.namespace,
+                'payload': self.payload,
+            })
+
+        return self._signed_data
+
+    def digest(self) -> bytes:
+        """ Get SHA-256 digest of the signed bytes. """
+
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.signed_data()).digest()
+
+        return self._digest
+
+    def is_verified(self) -> typing.Optional[bool]:
+        """ Get result of verification, or None if not verified yet. """
+
+        return self._verified
+
     def verify(self) -> bool:
-        """ Verify signature. """
+        """ Verify signature. The result is remembered. """
 
-        return self.user.verify({
-            'namespace': self.namespace,
-            'payload': self.payload,
-        }, self.signature)
+        if self._verified is None:
+            self._verified = self.user.verify_raw(self.signed_data(),
+                                                  self.signature)
+
+        return self._verified
 
     def as_dict(self) -> dict:
         """ Convert to dictoinary for serialize. """
 
+        user = self._key
+        if not isinstance(user, str):
+            user = self.user.public_pem
+
         return {
-            'user': self.user.public_pem,
+            'user': user,
             'namespace': self.namespace,
             'payload': self.payload,
             'signature': base64.b64encode(self.signature).decode('ascii'),
@@ -82,14 +176,18 @@ class Message:
         return json.dumps(self.as_dict())
 
     @classmethod
-    def from_dict(cls, data: dict) -> 'Message':
-        """ Convert from dictionary for deserialize. """
+    def from_dict(cls, data: dict, verify: bool = True) -> 'Message':
+        """ Convert from dictionary for deserialize.
+
+        The key of user is loaded when it is used first.
+        """
 
         return cls(
-            User.from_pem(data['user']),
+            data['user'],
             data['namespace'],
             data['payload'],
             base64.b64decode(data['signature']),
+            verify,
         )
 
     @classmethod
@@ -97,3 +195,45 @@ class Message:
         """ Deserialize from json. """
 
         return cls.from_dict(json.loads(data))
+
+
+def verify_messages(messages: typing.Iterable[Message],
+                    workers: int = None,
+                    threshold: int = None) -> bool:
+
+    """ Verify messages at once by `core.batch.verify_each`, and remember
+    results in each message. Messages that already verified are skipped.
+
+
+    >>> u = User.generate()
+    >>> good = Message(u, 'namespace', 'hello')
+    >>> bad = Message(u.public_pem, 'namespace', 'world', good.signature,
+    ...               verify=False)
+    >>> bad.is_verified() is None
+    True
+
+    >>> verify_messages([good, bad], threshold=1)
+    False
+    >>> good.is_verified(), bad.is_verified()
+    (True, False)
+    """
+
+    # Imported here because core.batch depends on this module.
+    from core import batch
+
+    if threshold is None:
+        threshold = batch.THRESHOLD
+
+    messages = list(messages)
+    pending = [m for m in messages if m.is_verified() is None]
+
+    results = batch.verify_each([(m.user, m.signed_data(), m.signature)
+                                 for m in pending],
+                                workers,
+                                threshold,
+                                [m.digest() for m in pending])
+
+    for message, ok in zip(pending, results):
+        message._verified = ok
+
+    return all(m.is_verified() for m in messages)
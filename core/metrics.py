@@ -0,0 +1,321 @@
+import abc
+import bisect
+import contextlib
+import threading
+import time
+import typing
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PREFIX = 'macracoin_'
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+                   1.0, 5.0, 10.0)
+
+Labels = typing.Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return (value.replace('\\', '\\\\')
+                 .replace('"', '\\"')
+                 .replace('\n', '\\n'))
+
+
+def _format_labels(names: typing.Sequence[str],
+                   values: typing.Sequence[str]) -> str:
+
+    if len(names) == 0:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    """ The base of metrics that have values for each set of labels. """
+
+    kind = 'untyped'
+
+    def __init__(self,
+                 name: str,
+                 help_: str,
+                 labels: typing.Sequence[str] = ()) -> None:
+
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+
+        self._lock = threading.Lock()
+
+    def _key(self, labels: typing.Dict[str, str]) -> Labels:
+        if set(labels) != set(self.labels):
+            raise ValueError('labels of {} must be {}'.format(self.name,
+                                                              self.labels))
+
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> typing.Iterator[typing.Tuple[str, str, float]]:
+        """ Get (suffix, labels, value) of all samples. """
+
+    def render(self) -> str:
+        """ Format in the Prometheus text format. """
+
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+
+        for suffix, labels, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name,
+                                            suffix,
+                                            labels,
+                                            _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """ The metric that only increases.
+
+
+    >>> counter = Counter('requests_total', 'Handled requests.', ['code'])
+    >>> counter.inc(code=200)
+    >>> counter.inc(2, code=404)
+    >>> counter.get(code=404)
+    2
+    >>> print(counter.render(), end='')
+    # HELP requests_total Handled requests.
+    # TYPE requests_total counter
+    requests_total{code="200"} 1
+    requests_total{code="404"} 2
+    """
+
+    kind = 'counter'
+
+    def __init__(self,
+                 name: str,
+                 help_: str,
+                 labels: typing.Sequence[str] = ()) -> None:
+
+        super().__init__(name, help_, labels)
+
+        self._values: typing.Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        key = self._key(labels)
+
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for key, value in values:
+            yield '', _format_labels(self.labels, key), value
+
+
+class Gauge(Counter):
+    """ The metric that can go up and down.
+
+
+    >>> gauge = Gauge('height', 'Height of chain.')
+    >>> gauge.set(10)
+    >>> gauge.inc(-1)
+    >>> gauge.get()
+    9
+    """
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """ The metric that counts observed values into buckets.
+
+
+    >>> histogram = Histogram('duration_seconds', 'Duration.', buckets=[1, 2])
+    >>> histogram.observe(0.5)
+    >>> histogram.observe(1.5)
+    >>> histogram.observe(3)
+    >>> print(histogram.render(), end='')
+    # HELP duration_seconds Duration.
+    # TYPE duration_seconds histogram
+    duration_seconds_bucket{le="1"} 1
+    duration_seconds_bucket{le="2"} 2
+    duration_seconds_bucket{le="+Inf"} 3
+    duration_seconds_sum 5.0
+    duration_seconds_count 3
+
+    >>> with histogram.time():
+    ...     pass
+    >>> histogram.count()
+    4
+    """
+
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 help_: str,
+                 labels: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> None:
+
+        super().__init__(name, help_, labels)
+
+        self.buckets = tuple(sorted(buckets))
+
+        # Counts of each bucket (not cumulative), and sum of values.
+        self._values: typing.Dict[Labels, typing.Tuple[typing.List[int],
+                                                       float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+
+            counts[position] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> typing.Iterator[None]:
+        """ Observe elapsed seconds of the with block. """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        key = self._key(labels)
+
+        with self._lock:
+            counts, _ = self._values.get(key, ([], 0.0))
+            return sum(counts)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self._values.items())
+
+        names = self.labels + ('le',)
+
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = _format_value(bound) if bound == float('inf') else \
+                    '{:g}'.format(bound)
+                yield ('_bucket',
+                       _format_labels(names, key + (le,)),
+                       cumulative)
+
+            yield '_sum', _format_labels(self.labels, key), total
+            yield '_count', _format_labels(self.labels, key), cumulative
+
+
+class Registry:
+    """ The set of metrics to expose.
+
+
+    >>> registry = Registry()
+    >>> counter = registry.counter('hello_total', 'Hello.')
+    >>> counter.inc()
+    >>> registry.counter('hello_total', 'Hello.') is counter
+    True
+    >>> print(registry.render(), end='')
+    # HELP macracoin_hello_total Hello.
+    # TYPE macracoin_hello_total counter
+    macracoin_hello_total 1
+    """
+
+    def __init__(self, prefix: str = PREFIX) -> None:
+        self.prefix = prefix
+
+        self._lock = threading.Lock()
+        self._metrics: typing.Dict[str, Metric] = {}
+
+    def _register(self,
+                  factory: typing.Callable[..., Metric],
+                  name: str,
+                  *args: typing.Any,
+                  **kwargs: typing.Any) -> typing.Any:
+
+        name = self.prefix + name
+
+        with self._lock:
+            metric = self._metrics.get(name)
+
+            if metric is None:
+                metric = self._metrics[name] = factory(name, *args, **kwargs)
+            elif type(metric) is not factory:
+                raise ValueError('{} is already registered as {}'.format(
+                    name,
+                    metric.kind,
+                ))
+
+            return metric
+
+    def counter(self,
+                name: str,
+                help_: str,
+                labels: typing.Sequence[str] = ()) -> Counter:
+
+        return self._register(Counter, name, help_, labels)
+
+    def gauge(self,
+              name: str,
+              help_: str,
+              labels: typing.Sequence[str] = ()) -> Gauge:
+
+        return self._register(Gauge, name, help_, labels)
+
+    def histogram(self,
+                  name: str,
+                  help_: str,
+                  labels: typing.Sequence[str] = (),
+                  buckets: typing.Sequence[float] = DEFAULT_BUCKETS) \
+            -> Histogram:
+
+        return self._register(Histogram, name, help_, labels, buckets)
+
+    def render(self) -> str:
+        """ Format all metrics in the Prometheus text format. """
+
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+
+        return ''.join(metric.render() for _, metric in metrics)
+
+
+registry = Registry()
+
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+render = registry.render
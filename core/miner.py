@@ -0,0 +1,303 @@
+import hashlib
+import os
+import queue
+import struct
+import threading
+import time
+import typing
+
+
+NONCE_SPACE = 2 << 32
+CHUNK_SIZE = 1 << 14
+
+
+class Target:
+    """ The magic number compiled for comparing with raw digest bytes.
+
+    The magic number is a suffix of hex digest. Every two characters in the
+    tail of it are compared as a byte, and the first character is compared
+    with low nibble of a byte if length of magic number is odd.
+
+
+    >>> digest = bytes.fromhex('00' * 29 + '0c105e')
+    >>> Target('c105e').match(digest)
+    True
+    >>> Target('105e').match(digest)
+    True
+    >>> Target('d105e').match(digest)
+    False
+
+    Magic number that is not lower hex never match, same as hex digest.
+
+    >>> Target('C105E').match(digest)
+    False
+    """
+
+    def __init__(self, magicnumber: str) -> None:
+        self.magicnumber = magicnumber
+        self.valid = all(c in '0123456789abcdef' for c in magicnumber)
+        self.nibble: typing.Optional[int] = None
+        self.suffix = b''
+
+        if self.valid:
+            if len(magicnumber) % 2 == 1:
+                self.nibble = int(magicnumber[0], 16)
+                magicnumber = magicnumber[1:]
+            self.suffix = bytes.fromhex(magicnumber)
+
+    def match(self, digest: bytes) -> bool:
+        """ Check the digest ends with the magic number. """
+
+        if not self.valid or not digest.endswith(self.suffix):
+            return False
+
+        if self.nibble is None:
+            return True
+
+        return digest[-len(self.suffix) - 1] & 0x0f == self.nibble
+
+
+def _search_hex(prefix: bytes,
+                target: Target,
+                start: int,
+                stop: int) -> typing.Optional[bytes]:
+
+    hash_ = hashlib.sha256(prefix)
+
+    for i in range(start, stop):
+        key = i.to_bytes(32, 'big')
+
+        h = hash_.copy()
+        h.update(key)
+
+        if h.hexdigest().endswith(target.magicnumber):
+            return key
+
+    return None
+
+
+_NONCE = struct.Struct('>Q')
+_NONCE_PADDING = bytes(32 - _NONCE.size)
+
+
+def _search_bytes(prefix: bytes,
+                  target: Target,
+                  start: int,
+                  stop: int) -> typing.Optional[bytes]:
+
+    if not target.valid:
+        return None
+
+    # Keys are always less than 2**64, so leading bytes of key are zero and
+    # can be hashed into the midstate.
+    hash_ = hashlib.sha256(prefix)
+    hash_.update(_NONCE_PADDING)
+
+    copy = hash_.copy
+    pack = _NONCE.pack
+    suffix = target.suffix
+    nibble = target.nibble
+    position = -len(suffix) - 1
+
+    for i in range(start, stop):
+        h = copy()
+        h.update(pack(i))
+        digest = h.digest()
+
+        if (digest.endswith(suffix)
+                and (nibble is None or digest[position] & 0x0f == nibble)):
+
+            return _NONCE_PADDING + pack(i)
+
+    return None
+
+
+ENGINES: typing.Dict[str, typing.Callable[[bytes, Target, int, int],
+                                          typing.Optional[bytes]]] = {
+    'hex': _search_hex,
+    'bytes': _search_bytes,
+}
+
+DEFAULT_ENGINE = 'bytes'
+
+
+def search(prefix: bytes,
+           magicnumber: str,
+           start: int = 0,
+           stop: int = NONCE_SPACE,
+           engine: str = DEFAULT_ENGINE,
+           abort: threading.Event = None) -> typing.Optional[bytes]:
+
+    """ Find key in range of nonce from start to stop.
+
+    If abort is given, the range is searched chunk by chunk, and the search
+    stops within a chunk after abort is set.
+
+
+    >>> key = search(b'hello', '00')
+    >>> hashlib.sha256(b'hello' + key).hexdigest().endswith('00')
+    True
+
+    All engines find same key.
+
+    >>> search(b'hello', '00f', engine='hex') == search(b'hello', '00f')
+    True
+
+    Returns None if not found or aborted.
+
+    >>> search(b'hello', '00000000', 0, 10) is None
+    True
+    >>> aborted = threading.Event()
+    >>> aborted.set()
+    >>> search(b'hello', '00', abort=aborted) is None
+    True
+    """
+
+    if stop > NONCE_SPACE:
+        raise ValueError('nonce range is too large')
+
+    target = Target(magicnumber)
+
+    if abort is None:
+        return ENGINES[engine](prefix, target, start, stop)
+
+    for chunk in range(start, stop, CHUNK_SIZE):
+        if abort.is_set():
+            return None
+
+        key = ENGINES[engine](prefix,
+                              target,
+                              chunk,
+                              min(chunk + CHUNK_SIZE, stop))
+        if key is not None:
+            return key
+
+    return None
+
+
+def _search_worker(prefix: bytes,
+                   magicnumber: str,
+                   start: int,
+                   stop: int,
+                   step: int,
+                   chunk: int,
+                   engine: str,
+                   found: 'multiprocessing.synchronize.Event',
+                   result: 'multiprocessing.Queue[typing.Optional[bytes]]') \
+        -> None:
+
+    while start < stop and not found.is_set():
+        key = search(prefix,
+                     magicnumber,
+                     start,
+                     min(start + chunk, stop),
+                     engine)
+
+        if key is not None:
+            found.set()
+            result.put(key)
+            return
+
+        start += step * chunk
+
+    result.put(None)
+
+
+def parallel_search(prefix: bytes,
+                    magicnumber: str,
+                    workers: int = None,
+                    chunk: int = CHUNK_SIZE,
+                    engine: str = DEFAULT_ENGINE,
+                    abort: threading.Event = None,
+                    start: int = 0,
+                    stop: int = NONCE_SPACE) -> typing.Optional[bytes]:
+
+    """ Find key in range of nonce from start to stop with multiple processes.
+
+    The range is split into chunks, and each worker searches every
+    `workers`-th chunk. All workers stop as soon as one of them found key,
+    or abort is set. If workers is None, use all CPU cores.
+
+
+    >>> key = parallel_search(b'hello', '000', workers=2)
+    >>> hashlib.sha256(b'hello' + key).hexdigest().endswith('000')
+    True
+    >>> parallel_search(b'hello', '000', 2, start=0, stop=10) is None
+    True
+    """
+
+    if stop > NONCE_SPACE:
+        raise ValueError('nonce range is too large')
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Imported here because it is slow, and single process search does not
+    # need it.
+    import multiprocessing
+
+    found = multiprocessing.Event()
+    result = multiprocessing.Queue()
+
+    processes = [
+        multiprocessing.Process(
+            target=_search_worker,
+            args=(prefix, magicnumber, start + i * chunk, stop, workers,
+                  chunk, engine, found, result),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+
+    for p in processes:
+        p.start()
+
+    key = None
+    try:
+        finished = 0
+        while finished < workers:
+            if abort is not None and abort.is_set():
+                break
+
+            try:
+                key = result.get(timeout=0.01)
+            except queue.Empty:
+                continue
+
+            finished += 1
+            if key is not None:
+                break
+    finally:
+        found.set()
+
+        for p in processes:
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+
+    return key
+
+
+def hashrate(engine: str, count: int = 1 << 18) -> float:
+    """ Measure hashes per second of the engine. """
+
+    # This magic number is never found in the range of nonce.
+    magicnumber = 'ffffffffffffffffffff'
+
+    started = time.perf_counter()
+    search(b'\x00' * 128, magicnumber, 0, count, engine)
+
+    return count / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1 << 18
+
+    base = None
+    for name in ENGINES:
+        rate = hashrate(name, count)
+        if base is None:
+            base = rate
+        print('{:>6s}: {:12.0f} hash/s ({:.2f}x)'.format(name, rate, rate / base))
@@ -0,0 +1,246 @@
+import json
+import mmap
+import os
+import struct
+import typing
+
+from core import errors
+from core.block import Block
+from core.chain import Chain, Checkpoint
+
+
+class BlockStore:
+    """ The append-only storage of closed blocks.
+
+    Blocks are appended as JSON into segment files. The index file has a
+    fixed-width entry per block index, which is segment number, offset, and
+    length of the block in the segment. Both of segments and index are read
+    via memory map.
+
+
+    >>> import tempfile
+    >>> from core.user import User
+    >>> directory = tempfile.TemporaryDirectory()
+
+    >>> chain = Chain.generate(User.generate())
+    >>> store = BlockStore(directory.name)
+    >>> store.append(chain[0])
+    >>> len(store)
+    1
+    >>> store.read(0).signature == chain[0].signature
+    True
+    >>> bytes(store.read_raw(0)) == chain[0].as_json().encode('ascii')
+    True
+
+    Only closed blocks can be stored, in order of index.
+
+    >>> store.append(chain[1])
+    Traceback (most recent call last):
+        ...
+    core.errors.BlockNotClosedError
+    >>> store.append(chain[0])
+    Traceback (most recent call last):
+        ...
+    core.errors.InvalidChainError
+
+    Reopened store has same blocks.
+
+    >>> store.close()
+    >>> store = BlockStore(directory.name)
+    >>> loaded = store.load_chain()
+    >>> len(loaded)
+    2
+    >>> loaded[0].signature == chain[0].signature
+    True
+    >>> loaded[1].is_closed()
+    False
+
+    >>> store.load_chain(checkpoints=[(0, b'other block')])
+    Traceback (most recent call last):
+        ...
+    core.errors.InvalidChainError
+
+    >>> store.close()
+    >>> directory.cleanup()
+    """
+
+    _ENTRY = struct.Struct('>IQI')
+    _LENGTH = struct.Struct('>I')
+
+    def __init__(self, directory: str, segment_size: int = 64 << 20) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._index_file = open(os.path.join(directory, 'index'), 'a+b')
+
+        # Drop a partially written entry that left by crash.
+        size = os.fstat(self._index_file.fileno()).st_size
+        if size % self._ENTRY.size != 0:
+            self._index_file.truncate(size - size % self._ENTRY.size)
+
+        self._length = size // self._ENTRY.size
+        self._index_map: typing.Optional[mmap.mmap] = None
+        self._segment_maps: typing.Dict[int, mmap.mmap] = {}
+
+        self._segment = 0
+        self._segment_file: typing.Optional[typing.BinaryIO] = None
+        if self._length > 0:
+            self._segment = self._entry(self._length - 1)[0]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory,
+                            'segment-{:08d}.log'.format(segment))
+
+    def _entry(self, index: int) -> typing.Tuple[int, int, int]:
+        if not 0 <= index < self._length:
+            raise IndexError('block index out of range')
+
+        position = index * self._ENTRY.size
+        if self._index_map is None or len(self._index_map) <= position:
+            self._index_file.flush()
+            self._index_map = mmap.mmap(self._index_file.fileno(),
+                                        0,
+                                        access=mmap.ACCESS_READ)
+
+        return self._ENTRY.unpack_from(self._index_map, position)
+
+    def read_raw(self, index: int) -> memoryview:
+        """ Read serialized block without copy. """
+
+        segment, offset, length = self._entry(index)
+
+        mapped = self._segment_maps.get(segment)
+        if mapped is None or len(mapped) < offset + length:
+            if self._segment_file is not None:
+                self._segment_file.flush()
+
+            with open(self._segment_path(segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._segment_maps[segment] = mapped
+
+        return memoryview(mapped)[offset:offset + length]
+
+    def read(self,
+             index: int,
+             magicnumber: str = None,
+             verify: bool = True) -> Block:
+
+        """ Read block. Signatures of messages are verified unless verify is
+        False.
+        """
+
+        with self.read_raw(index) as data:
+            return Block.from_dict(json.loads(bytes(data)),
+                                   magicnumber,
+                                   verify)
+
+    def __iter__(self) -> typing.Iterator[Block]:
+        return (self.read(i) for i in range(self._length))
+
+    def append(self, block: Block) -> None:
+        """ Append closed block that is next of the last stored block. """
+
+        if not block.is_closed():
+            raise errors.BlockNotClosedError()
+
+        if block.index != self._length:
+            raise errors.InvalidChainError()
+
+        data = block.as_json().encode('ascii')
+
+        if self._segment_file is None:
+            self._segment_file = open(self._segment_path(self._segment), 'ab')
+
+        offset = self._segment_file.tell()
+        if offset > 0 and offset + self._LENGTH.size + len(data) \
+                > self.segment_size:
+
+            self._segment_file.close()
+            self._segment += 1
+            self._segment_file = open(self._segment_path(self._segment), 'ab')
+            offset = 0
+
+        self._segment_file.write(self._LENGTH.pack(len(data)) + data)
+        self._segment_file.flush()
+        os.fsync(self._segment_file.fileno())
+
+        self._index_file.write(self._ENTRY.pack(self._segment,
+                                                offset + self._LENGTH.size,
+                                                len(data)))
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+
+        self._length += 1
+
+    def truncate(self, length: int) -> None:
+        """ Remove blocks after the length, like blocks of replaced branch.
+
+        Removed blocks are left in segment files, but not referred anymore.
+
+
+        >>> import tempfile
+        >>> from core.user import User
+        >>> directory = tempfile.TemporaryDirectory()
+        >>> store = BlockStore(directory.name)
+        >>> store.append(Chain.generate(User.generate())[0])
+
+        >>> store.truncate(0)
+        >>> len(store)
+        0
+        >>> store.read(0)
+        Traceback (most recent call last):
+            ...
+        IndexError: block index out of range
+
+        >>> store.close()
+        >>> directory.cleanup()
+        """
+
+        if not 0 <= length <= self._length:
+            raise IndexError('block index out of range')
+
+        if length == self._length:
+            return
+
+        self._index_file.flush()
+        self._index_map = None
+        self._index_file.truncate(length * self._ENTRY.size)
+        os.fsync(self._index_file.fileno())
+
+        self._length = length
+
+    def load_chain(self,
+                   magicnumber: str = None,
+                   checkpoints: typing.Iterable[Checkpoint] = ()) -> Chain:
+
+        """ Load chain that has all stored blocks and a new leaf.
+
+        Stored blocks are verified when appended, so signatures are not
+        verified again on loading. Only linkage of them and checkpoints are
+        checked, as trusted blocks of `core.Chain`.
+        """
+
+        blocks = [self.read(i, magicnumber, verify=False)
+                  for i in range(self._length)]
+        if len(blocks) == 0:
+            raise errors.InvalidChainError()
+
+        blocks.append(Block(blocks[-1]))
+
+        return Chain(blocks, trusted=self._length, checkpoints=checkpoints)
+
+    def close(self) -> None:
+        """ Close files. """
+
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
+
+        self._index_file.close()
+        self._index_map = None
+        self._segment_maps = {}
@@ -1,15 +1,18 @@
+import collections
+import hashlib
 import json
+import threading
 import typing
+import weakref
 
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_PSS
-from Crypto.Util import randpool
 
-from core import errors
+from core import errors, metrics
 
 
-def _serialize(message: typing.Any) -> bytes:
+def serialize(message: typing.Any) -> bytes:
     return json.dumps(
         message,
         separators=(',', ':'),
@@ -17,6 +20,159 @@ def _serialize(message: typing.Any) -> bytes:
     ).encode('ascii')
 
 
+class VerificationCache:
+    """ The LRU cache of successful signature verifications.
+
+    Entries are keyed by public key fingerprint, digest of the payload, and
+    signature. Failed verifications are never cached.
+
+
+    >>> cache = VerificationCache(maxsize=2)
+    >>> cache.add(b'key', b'payload1', b'signature1')
+    >>> cache.add(b'key', b'payload2', b'signature2')
+
+    >>> cache.lookup(b'key', b'payload1', b'signature1')
+    True
+    >>> cache.lookup(b'key', b'payload3', b'signature3')
+    False
+
+    The least recently used entry is evicted when the cache is full.
+
+    >>> cache.add(b'key', b'payload3', b'signature3')
+    >>> cache.lookup(b'key', b'payload2', b'signature2')
+    False
+    >>> cache.stats()
+    {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 2, 'evictions': 1}
+    """
+
+    def __init__(self, maxsize: int = 65536) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: typing.Dict[typing.Tuple[bytes, bytes, bytes], None] \
+            = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, fingerprint: bytes, digest: bytes, signature: bytes) \
+            -> bool:
+
+        """ Check the verification is already succeeded. """
+
+        entry = (fingerprint, digest, signature)
+
+        with self._lock:
+            if entry in self._entries:
+                self._entries.move_to_end(entry)
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            return False
+
+    def add(self, fingerprint: bytes, digest: bytes, signature: bytes) \
+            -> None:
+
+        """ Remember succeeded verification. """
+
+        with self._lock:
+            self._entries[(fingerprint, digest, signature)] = None
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """ Forget all verifications and reset counters. """
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        """ Get counters for sizing the cache. """
+
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+verification_cache = VerificationCache()
+
+verifications = metrics.counter(
+    'signature_verifications_total',
+    'Signature verifications by result; valid, invalid or cached.',
+    ['result'],
+)
+
+
+class KeyRegistry:
+    """ The registry for sharing users of same public key.
+
+    Users are held weakly, so a user is dropped from the registry when
+    nothing refers it.
+
+
+    >>> registry = KeyRegistry()
+    >>> pem = User.generate().public_pem
+
+    >>> u = registry.intern(User.from_pem(pem))
+    >>> registry.intern(User(u.key)) is u
+    True
+    >>> registry.get(pem) is None
+    True
+    >>> registry.intern(User(u.key), pem) is u
+    True
+    >>> registry.get(pem) is u
+    True
+    >>> len(registry)
+    1
+    """
+
+    def __init__(self) -> None:
+        self._by_pem: typing.MutableMapping[typing.Union[str, bytes], 'User'] \
+            = weakref.WeakValueDictionary()
+        self._by_fingerprint: typing.MutableMapping[bytes, 'User'] \
+            = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_fingerprint)
+
+    def get(self, pem: typing.Union[str, bytes]) -> typing.Optional['User']:
+        """ Get registered user by PEM text or DER bytes. """
+
+        return self._by_pem.get(pem)
+
+    def intern(self,
+               user: 'User',
+               pem: typing.Union[str, bytes] = None) -> 'User':
+
+        """ Register public key user, or get already registered same user. """
+
+        if user.key.has_private():
+            raise TypeError('can not register user that has private key')
+
+        with self._lock:
+            result = self._by_fingerprint.setdefault(user.fingerprint, user)
+
+            if pem is not None:
+                self._by_pem[pem] = result
+
+        return result
+
+
+key_registry = KeyRegistry()
+
+
 class User:
     """
     >>> u = User.generate()
@@ -48,15 +204,59 @@ class User:
     """
 
     def __init__(self, key: RSA._RSAobj) -> None:
-        self.key = key
+        self._key = key
+        self._fingerprint: bytes = None
+        self._public_pem: str = None
+        self._public_der: bytes = None
 
     @classmethod
     def generate(cls) -> 'User':
+        # Imported here because it is slow, and loading keys do not need it.
+        from Crypto.Util import randpool
+
         return cls(RSA.generate(1024, randpool.RandomPool().get_bytes))
 
     @classmethod
-    def from_pem(cls, data: str) -> 'User':
-        return cls(RSA.importKey(data))
+    def from_pem(cls, data: typing.Union[str, bytes]) -> 'User':
+        """ Load user from PEM.
+
+        Users of public key are shared via `key_registry`.
+
+
+        >>> u = User.generate()
+        >>> User.from_pem(u.public_pem) is User.from_pem(u.public_pem)
+        True
+        >>> User.from_pem(u.private_pem) is User.from_pem(u.private_pem)
+        False
+        """
+
+        user = key_registry.get(data)
+        if user is not None:
+            return user
+
+        key = RSA.importKey(data)
+        if key.has_private():
+            return cls(key)
+
+        return key_registry.intern(cls(key), data)
+
+    @classmethod
+    def from_der(cls, data: bytes) -> 'User':
+        """ Load user from DER.
+
+        Users of public key are shared via `key_registry` same as `from_pem`.
+
+
+        >>> u = User.generate()
+        >>> User.from_der(u.public_der) is User.from_pem(u.public_pem)
+        True
+        """
+
+        return cls.from_pem(data)
+
+    @property
+    def key(self) -> RSA._RSAobj:
+        return self._key
 
     def sign_raw(self, data: bytes) -> bytes:
         if not self.key.has_private():
@@ -68,15 +268,43 @@ class User:
         return sign
 
     def sign(self, message: typing.Any) -> bytes:
-        return self.sign_raw(_serialize(message))
+        return self.sign_raw(serialize(message))
+
+    def verify_raw(self,
+                   data: bytes,
+                   signature: bytes,
+                   cache: bool = True) -> bool:
+
+        if cache:
+            digest = hashlib.sha256(data).digest()
+
+            if verification_cache.lookup(self.fingerprint, digest, signature):
+                verifications.inc(result='cached')
+                return True
 
-    def verify_raw(self, data: bytes, signature: bytes) -> bool:
         h = SHA256.new()
         h.update(data)
-        return PKCS1_PSS.new(self.key).verify(h, signature)
+        if not PKCS1_PSS.new(self.key).verify(h, signature):
+            verifications.inc(result='invalid')
+            return False
+
+        verifications.inc(result='valid')
+
+        if cache:
+            verification_cache.add(self.fingerprint, digest, signature)
+        return True
 
     def verify(self, message: typing.Any, signature: bytes) -> bool:
-        return self.verify_raw(_serialize(message), signature)
+        return self.verify_raw(serialize(message), signature)
+
+    @property
+    def fingerprint(self) -> bytes:
+        """ SHA-256 digest of the public key. """
+
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha256(self.public_der).digest()
+
+        return self._fingerprint
 
     @property
     def private_pem(self) -> str:
@@ -84,4 +312,14 @@ class User:
 
     @property
     def public_pem(self) -> str:
-        return self.key.publickey().exportKey().decode('ascii')
+        if self._public_pem is None:
+            self._public_pem = self.key.publickey().exportKey().decode('ascii')
+
+        return self._public_pem
+
+    @property
+    def public_der(self) -> bytes:
+        if self._public_der is None:
+            self._public_der = self.key.publickey().exportKey('DER')
+
+        return self._public_der
@@ -1,47 +1,219 @@
-import sys
+import argparse
+import threading
+import time
+
+import requests
 
 import core
 import peer
 
 
-if __name__ == '__main__':
-    if len(sys.argv) == 1:
-        print('$ mining.py [server address]', file=sys.stderr)
-        sys.exit(1)
+def describe(leaf: core.Block) -> dict:
+    """ Describe the leaf same as data of leaf event. """
 
-    user = core.User.generate()
-    print('user generated')
-    print(user.public_pem)
+    return {
+        'index': leaf.index,
+        'parent': leaf.parent.signature.hex(),
+        'messages': len(leaf.messages),
+    }
 
-    client = peer.Client()
 
-    while True:
-        leaf = client.get_block(sys.argv[1], -1)
+class Watcher:
+    """ The watcher of the leaf of peer that aborts stale mining.
+
+    Changes are received as events of the peer. While the event stream is
+    disconnected, the leaf is polled every `POLL_INTERVAL` seconds instead,
+    and the stream is reconnected with exponential backoff.
+
+    Call `reset` before getting new work, and `watch` after got it, so that
+    a change while getting the work is not lost.
+    """
+
+    POLL_INTERVAL = 5.0
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, client: peer.Client, addr: str) -> None:
+        self.client = client
+        self.addr = addr
+        self.stale = threading.Event()
+        self.current: dict = None
+
+    def start(self) -> None:
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def reset(self) -> None:
+        """ Forget changes before getting new work. """
+
+        self.stale.clear()
+
+    def watch(self, leaf: dict) -> None:
+        """ Start watching the leaf that described as data of leaf event. """
+
+        self.current = leaf
 
-        print('leaf got: index={} parent-signature={}'.format(
-            leaf.index,
-            leaf.parent.signature.hex(),
-        ))
+    def _changed(self, leaf: dict) -> None:
+        if self.current is not None and leaf != self.current:
+            self.stale.set()
+
+    def _watch(self) -> None:
+        backoff = self.MIN_BACKOFF
+
+        while True:
+            try:
+                for _, data in self.client.subscribe(self.addr):
+                    backoff = self.MIN_BACKOFF
+                    self._changed(data)
+            except Exception as e:
+                print('event stream disconnected: {}'.format(e))
+
+            self._poll(backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+    def _poll(self, duration: float) -> None:
+        """ Poll the leaf for duration seconds, at least once. """
+
+        deadline = time.monotonic() + duration
 
         while True:
-            key = core.mining(leaf)
-            print('found key: {}'.format(key.hex()))
+            try:
+                self._changed(describe(self.client.get_block(self.addr, -1)))
+            except Exception as e:
+                print('failed to poll leaf: {}'.format(e))
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+
+def mine_solo(client: peer.Client,
+              addr: str,
+              user: core.User,
+              workers: int,
+              watcher: Watcher) -> None:
+
+    """ Mine the leaf that got from the peer by itself. """
+
+    watcher.reset()
+    leaf = client.get_block(addr, -1)
+    watcher.watch(describe(leaf))
 
-            next_ = leaf.close(user, key)
+    print('leaf got: index={} parent-signature={}'.format(
+        leaf.index,
+        leaf.parent.signature.hex(),
+    ))
 
-            mining_message = core.Message(user, 'macracoin.mining', {
-                'from': leaf.signature.hex(),
-                'to': user.public_pem,
-            })
+    key = core.mining(leaf, workers, abort=watcher.stale)
+    if key is None:
+        print('leaf changed, restart mining')
+        return
 
-            client.post_close_block(sys.argv[1], leaf)
-            client.post_message(sys.argv[1], mining_message)
+    print('found key: {}'.format(key.hex()))
 
-            next_.pool(mining_message)
+    leaf.close(user, key)
 
-            print('yeah!  index={} signature={}'.format(
-                leaf.index,
-                leaf.signature.hex(),
-            ))
+    try:
+        client.post_close_block(addr, leaf)
+    except requests.HTTPError as e:
+        print('failed to close block: {}'.format(e))
+        return
 
-            leaf = next_
+    post_mining_message(client, addr, user, leaf.index, leaf.signature)
+
+
+def mine_work(client: peer.Client,
+              addr: str,
+              user: core.User,
+              workers: int,
+              watcher: Watcher) -> None:
+
+    """ Mine a range of nonce that allocated by the peer. """
+
+    watcher.reset()
+    work = client.get_work(addr)
+    watcher.watch(work['leaf'])
+
+    print('work got: index={} nonce={}-{}'.format(
+        work['leaf']['index'],
+        work['start'],
+        work['stop'],
+    ))
+
+    if workers == 1:
+        key = core.miner.search(work['prefix'],
+                                work['magicnumber'],
+                                work['start'],
+                                work['stop'],
+                                abort=watcher.stale)
+    else:
+        key = core.miner.parallel_search(work['prefix'],
+                                         work['magicnumber'],
+                                         workers,
+                                         abort=watcher.stale,
+                                         start=work['start'],
+                                         stop=work['stop'])
+
+    if key is None:
+        if watcher.stale.is_set():
+            print('leaf changed, restart mining')
+        return
+
+    print('found key: {}'.format(key.hex()))
+
+    try:
+        signature = client.submit_work(addr, work, user, key)
+    except requests.HTTPError as e:
+        print('failed to submit work: {}'.format(e))
+        return
+
+    post_mining_message(client, addr, user, work['leaf']['index'], signature)
+
+
+def post_mining_message(client: peer.Client,
+                        addr: str,
+                        user: core.User,
+                        index: int,
+                        signature: bytes) -> None:
+
+    client.post_message(addr, core.Message(user, 'macracoin.mining', {
+        'from': signature.hex(),
+        'to': user.public_pem,
+    }))
+
+    print('yeah!  index={} signature={}'.format(index, signature.hex()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('server', help='address of peer')
+    parser.add_argument('workers',
+                        type=int,
+                        nargs='?',
+                        default=1,
+                        help='number of processes for mining')
+    parser.add_argument('--solo',
+                        action='store_true',
+                        help='mine whole nonce space of the leaf by itself,'
+                             ' instead of ranges allocated by the peer')
+    parser.add_argument('--key',
+                        default='default',
+                        help='name of saved key to use, or generate if not'
+                             ' saved yet')
+    args = parser.parse_args()
+
+    user, generated = core.KeyStore().load_or_generate(args.key)
+    if generated:
+        print('user generated')
+        print(user.public_pem)
+
+    client = peer.Client()
+
+    watcher = Watcher(client, args.server)
+    watcher.start()
+
+    mine = mine_solo if args.solo else mine_work
+
+    while True:
+        mine(client, args.server, user, args.workers, watcher)
@@ -1,2 +1,47 @@
-from peer.peer import Peer
-from peer.client import Client
+""" The peer of macracoin network.
+
+Submodules and their classes are imported when they are used first, so a
+client does not load falcon, and importing this package loads nothing.
+"""
+
+import importlib
+import typing
+
+
+_SUBMODULES = (
+    'chainmanager',
+    'client',
+    'endpoint',
+    'events',
+    'gossip',
+    'peer',
+    'rwlock',
+    'work',
+    'wsgi',
+)
+
+_ATTRIBUTES = {
+    'Client': 'client',
+    'Gossip': 'gossip',
+    'Peer': 'peer',
+}
+
+
+def __getattr__(name: str) -> typing.Any:
+    if name in _ATTRIBUTES:
+        module = importlib.import_module('peer.' + _ATTRIBUTES[name])
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module('peer.' + name)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__,
+            name,
+        ))
+
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> typing.List[str]:
+    return sorted(set(globals()) | set(_SUBMODULES) | set(_ATTRIBUTES))
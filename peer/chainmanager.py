@@ -1,24 +1,359 @@
+import logging
+import typing
+
 import core
 from peer.client import Client
+from peer.events import EventBus
+from peer.rwlock import RWLock
+from peer.work import StaleTemplateError, WorkAllocator
+
+
+logger = logging.getLogger(__name__)
+
+messages_pooled = core.metrics.counter('messages_pooled_total',
+                                       'Messages added into the mempool.')
+blocks_received = core.metrics.counter(
+    'blocks_received_total',
+    'Blocks received from other peers by result;'
+    ' main, side, orphan, known or invalid.',
+    ['result'],
+)
 
 
 class ChainManager:
-    def __init__(self, addr: str, chain: core.Chain) -> None:
+    """ The manager of chain that shared by request handlers.
+
+    Handlers that read the chain must hold `lock` as a reader. Methods that
+    change the chain hold it as a writer by itself, and send blocks to other
+    peers after released it.
+
+    Pending messages are kept in the mempool, and the leaf has the oldest
+    pending messages at most `TEMPLATE_SIZE` as the template of next block.
+
+    Changes of the leaf are published to `events`; "leaf" event when the
+    leaf is replaced by new one, and "template" event when messages are
+    pooled into the leaf.
+
+    When catching up, headers are verified before getting messages, and
+    blocks up to the newest checkpoint in `checkpoints` are joined without
+    verifying signatures, as `core.Chain.extend`.
+
+    Received blocks are added into `tree`, so blocks that arrived early wait
+    for their parent, and the chain switches to a longer branch. Messages in
+    blocks of the replaced branch are returned into the mempool.
+
+
+    >>> import tempfile
+    >>> from core.block import mining
+    >>> user = core.User.generate()
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> store = core.BlockStore(directory.name)
+    >>> manager = ChainManager(None,
+    ...                        core.Chain.generate(user, magicnumber='0'),
+    ...                        store)
+    >>> len(store)
+    1
+
+    >>> def child(parent, *messages):
+    ...     block = core.Block(parent)
+    ...     for message in messages:
+    ...         block.pool(message)
+    ...     _ = block.close(user, mining(block))
+    ...     return block
+
+    >>> hello = core.Message(user, 'namespace', 'hello')
+    >>> a1 = child(manager.chain[0], hello)
+    >>> manager.add_block(a1)
+    True
+    >>> len(store), hello.signature in manager.mempool
+    (2, False)
+
+    The block that arrived before its parent waits in `tree`, and the chain
+    switches when the parent arrived. The store is truncated to the fork,
+    and the message in the removed block is pooled again.
+
+    >>> b1 = child(manager.chain[0])
+    >>> b2 = child(b1)
+    >>> manager.add_block(b2)
+    True
+    >>> manager.chain[1] is a1
+    True
+    >>> manager.add_block(b1)
+    True
+    >>> manager.chain[1] is b1, manager.chain[2] is b2
+    (True, True)
+    >>> len(store), store.read(1).signature == b1.signature
+    (3, True)
+    >>> hello.signature in manager.mempool
+    True
+    >>> [m.payload for m in manager.chain[-1].messages]
+    ['hello']
+
+    >>> manager.add_block(b2)
+    False
+
+    Blocks before an invalid one are kept when catching up, and the store
+    and the mempool follow them.
+
+    >>> a2 = child(a1)
+    >>> a3 = child(a2)
+    >>> invalid = core.Block(a3)
+    >>> invalid.index += 1
+    >>> _ = invalid.close(user, mining(invalid))
+    >>> manager._join_verified([a2, a3, invalid])
+    Traceback (most recent call last):
+        ...
+    core.errors.InvalidChainError
+    >>> manager.chain[1] is a1, manager.chain[3] is a3
+    (True, True)
+    >>> [b.signature for b in store.load_chain()][:4] == [
+    ...     manager.chain[i].signature for i in range(4)]
+    True
+    >>> hello.signature in manager.mempool
+    False
+
+    >>> store.close()
+    >>> directory.cleanup()
+    """
+
+    TEMPLATE_SIZE = 1000
+
+    def __init__(self,
+                 addr: str,
+                 chain: core.Chain,
+                 store: core.BlockStore = None,
+                 checkpoints: typing.Iterable[core.chain.Checkpoint] = ()) \
+            -> None:
+
         self.addr = addr
         self.chain = chain
+        self.chain.checkpoints.update(checkpoints)
+        self.tree = core.BlockTree(chain)
         self.client = Client(addr)
+        self.store = store
+        self.mempool = core.Mempool()
+        self.lock = RWLock()
+        self.events = EventBus()
+
+        self.persist()
 
     @classmethod
-    def clone(cls, local: str, remote: str) -> 'ChainManager':
-        result = cls(local, Client().get_chain(remote))
+    def clone(cls,
+              local: str,
+              remote: str,
+              checkpoints: typing.Iterable[core.chain.Checkpoint] = ()) \
+            -> 'ChainManager':
+
+        result = cls(local, cls._get_root(remote), checkpoints=checkpoints)
+        result.catch_up(remote)
         result.connect(remote)
 
         return result
 
+    @staticmethod
+    def _get_root(remote: str) -> core.Chain:
+        """ Get chain that has only the root block of remote. """
+
+        root = Client().get_blocks(remote, 0, 1)
+        if len(root) != 1:
+            raise core.InvalidChainError()
+
+        return core.Chain([root[0], core.Block(root[0])])
+
     @classmethod
     def generate(cls, addr: str, rootuser: core.User) -> 'ChainManager':
         return cls(addr, core.Chain.generate(rootuser))
 
+    @classmethod
+    def open(cls,
+             addr: str,
+             directory: str,
+             remote: str = None,
+             checkpoints: typing.Iterable[core.chain.Checkpoint] = (),
+             key: str = 'default') -> 'ChainManager':
+
+        """ Open chain in the directory.
+
+        If the directory has no blocks, clone chain from remote, or generate
+        new chain if remote is not given. The root user of new chain is the
+        key of the name in `core.KeyStore`, that is generated and saved if
+        not saved yet.
+
+        Stored blocks must match checkpoints.
+        """
+
+        checkpoints = list(checkpoints)
+        store = core.BlockStore(directory)
+
+        if len(store) > 0:
+            chain = store.load_chain(checkpoints=checkpoints)
+            result = cls(addr, chain, store, checkpoints)
+            if remote is not None:
+                result.catch_up(remote)
+        elif remote is not None:
+            result = cls(addr, cls._get_root(remote), store, checkpoints)
+            result.catch_up(remote)
+        else:
+            rootuser, generated = core.KeyStore().load_or_generate(key)
+            if generated:
+                logger.info('root user generated key=%s\n%s',
+                            key,
+                            rootuser.public_pem)
+
+            result = cls(addr,
+                         core.Chain.generate(rootuser),
+                         store,
+                         checkpoints)
+
+        if remote is not None:
+            result.connect(remote)
+
+        return result
+
+    def persist(self) -> None:
+        """ Write closed blocks that not stored yet into the store. """
+
+        with self.lock.write():
+            self._persist()
+
+    def _persist(self) -> None:
+        if self.store is None:
+            return
+
+        for block in self.chain[len(self.store):]:
+            if block.is_closed():
+                self.store.append(block)
+
+    def catch_up(self, remote: str) -> int:
+        """ Fetch closed blocks above local height from remote, and join them.
+
+        Headers are fetched and verified first, so an invalid chain is
+        rejected before getting messages. Then blocks of the verified headers
+        are fetched page by page. Signatures in a page are verified at once
+        by `core.batch.verify_blocks`, and then blocks are joined one by one.
+        Blocks up to the newest checkpoint are kept until the checkpoint
+        arrives, and then joined at once without verifying signatures.
+        Returns number of joined blocks.
+
+        Version 1 headers can not be verified without messages, so blocks of
+        version 1 chain are fetched without headers.
+        """
+
+        with self.lock.read():
+            leaf = self.chain[-1]
+            start = leaf.index + 1 if leaf.is_closed() else leaf.index
+            parent = self.chain[start - 1]
+            checkpoints = dict(self.chain.checkpoints)
+            horizon = max((i for i in checkpoints if i >= start),
+                          default=None)
+
+        headers: typing.List[core.Block] = []
+        stop = None
+        if parent.version != 1:
+            headers = self._fetch_headers(remote, parent, checkpoints)
+            stop = start + len(headers)
+
+        below: typing.List[core.Block] = []
+
+        joined = 0
+        for page in self.client.iter_pages(remote,
+                                           start,
+                                           verify=False,
+                                           stop=stop):
+
+            page = [block for block in page if block.is_closed()]
+
+            if stop is not None and not all(
+                    start <= block.index < stop
+                    and core.headers.matches(headers[block.index - start],
+                                             block)
+                    for block in page):
+
+                raise core.InvalidChainError()
+
+            if horizon is not None:
+                below.extend(block for block in page if block.index <= horizon)
+                page = [block for block in page if block.index > horizon]
+
+                if len(below) == 0 or below[-1].index < horizon:
+                    continue
+
+                joined += self._join_checkpointed(below)
+                below = []
+                horizon = None
+
+            joined += self._join_verified(page)
+
+        # The remote did not have the checkpoint.
+        joined += self._join_verified(below)
+
+        logger.info('caught up blocks=%d remote=%s', joined, remote)
+
+        return joined
+
+    def _fetch_headers(self,
+                       remote: str,
+                       parent: core.Block,
+                       checkpoints: typing.Mapping[int, bytes]) \
+            -> typing.List[core.Block]:
+
+        """ Fetch headers after the parent from remote, and verify them by
+        `core.headers.verify_headers`.
+        """
+
+        headers: typing.List[core.Block] = []
+        for page in self.client.iter_headers(remote,
+                                             parent.index + 1,
+                                             parent.magicnumber):
+            headers.extend(page)
+
+        if not core.headers.verify_headers(parent, headers, checkpoints):
+            logger.warning('invalid headers remote=%s', remote)
+            raise core.InvalidChainError()
+
+        logger.info('verified headers=%d remote=%s', len(headers), remote)
+
+        return headers
+
+    def _join_checkpointed(self, blocks: typing.List[core.Block]) -> int:
+        with self.lock.write():
+            blocks = [block for block in blocks if block not in self.chain]
+            if len(blocks) == 0:
+                return 0
+
+            pending = list(self.chain[-1].messages)
+
+            self.chain.extend(blocks)
+
+            self._update_pending(blocks, pending)
+            self._persist()
+
+        return len(blocks)
+
+    def _join_verified(self, blocks: typing.List[core.Block]) -> int:
+        if len(blocks) == 0:
+            return 0
+
+        if not core.batch.verify_blocks(blocks):
+            raise core.InvalidChainError()
+
+        removed: typing.List[core.Block] = []
+        added: typing.List[core.Block] = []
+
+        with self.lock.write():
+            pending = list(self.chain[-1].messages)
+
+            try:
+                for block in blocks:
+                    status, old, new = self.tree.add(block)
+                    removed.extend(old)
+                    added.extend(new)
+            finally:
+                # Blocks before an invalid one are already in the chain.
+                self._switch(removed, added, pending)
+
+        return len(added)
+
     def connected(self, addr: str) -> None:
         self.client.connected(addr)
 
@@ -32,32 +367,168 @@ class ChainManager:
         self.client.disconnect_all()
 
     def add_block(self, block: core.Block, origin: str = None) -> bool:
-        if block in self.chain:
-            return False
+        """ Add block from other peer, and send it to other peers.
+
+        Returns False if the block is already known.
+        """
+
+        with self.lock.write():
+            pending = list(self.chain[-1].messages)
+
+            try:
+                status, removed, added = self.tree.add(block)
+            except core.InvalidChainError:
+                blocks_received.inc(result='invalid')
+                raise
+
+            blocks_received.inc(result=status)
+
+            if status == 'known':
+                return False
+
+            self._switch(removed, added, pending)
 
-        self.chain.join(block)
-        self.client.put_block(self.chain[-2], origin)
+        # Blocks of other branches are sent too, so that peers can switch to
+        # the branch when it got longer.
+        if status != 'orphan':
+            self.client.put_block(block, origin)
 
         return True
 
+    def _switch(self,
+                removed: typing.List[core.Block],
+                added: typing.List[core.Block],
+                pending: typing.List[core.Message]) -> None:
+
+        """ Update the store, the mempool and the leaf after blocks are
+        removed from and added to the chain. The caller must hold the lock.
+        """
+
+        if len(removed) == 0 and len(added) == 0:
+            return
+
+        if self.store is not None and len(removed) > 0:
+            self.store.truncate(min(len(self.store), removed[0].index))
+
+        returned = [m for block in removed for m in block.messages]
+
+        self._update_pending(added, pending + returned)
+        self._persist()
+
     def close_block(self,
                     closer: core.User,
                     timestamp: int,
                     key: bytes,
                     signature: bytes,
-                    host: str = None) -> bool:
+                    host: str = None,
+                    template: str = None) -> bool:
+
+        """ Close the leaf with the key, and send it to other peers.
 
-        try:
-            next_ = self.chain[-1].close(closer, key, timestamp, signature)
-        except Exception as e:
-            print(e)
-            return False
+        The closed block is added into `tree` same as blocks from other
+        peers. Returns False if failed to close.
 
-        self.add_block(next_, host)
+        If `template` is given, raises `peer.work.StaleTemplateError` if it
+        is not the template of the leaf. It is checked while holding the
+        lock, so the leaf can not be replaced after checked.
+        """
+
+        with self.lock.write():
+            leaf = self.chain[-1]
+
+            if (template is not None
+                    and template != WorkAllocator.template_id(
+                        leaf.hash_prefix())):
+
+                raise StaleTemplateError()
+
+            pending = list(leaf.messages)
+
+            # Close a copy, so the leaf is not changed if failed.
+            closed = core.Block(leaf.parent)
+            closed.messages = list(leaf.messages)
+
+            try:
+                closed.close(closer, key, timestamp, signature)
+                status, removed, added = self.tree.add(closed)
+            except Exception as e:
+                logger.info('failed to close block: %s', e)
+                return False
+
+            self._switch(removed, added, pending)
+
+        self.client.put_block(closed, host)
 
         return True
 
-    def add_message(self, message: core.Message) -> None:
+    def _update_pending(self,
+                        blocks: typing.Iterable[core.Block],
+                        pending: typing.List[core.Message]) -> None:
+
+        """ Update the mempool and the leaf after joined blocks.
+
+        Messages in the blocks are removed from the mempool, and messages in
+        the previous leaf that not included in the blocks are carried over.
+        """
+
+        confirmed = set()
+        for block in blocks:
+            self.mempool.remove(block.messages)
+            confirmed.update(m.signature for m in block.messages)
+
+        self.mempool.reinsert(m for m in pending
+                              if m.signature not in confirmed)
+
+        leaf = self.chain[-1]
+        leaf.messages = []
+
+        for message in self.mempool.template(self.TEMPLATE_SIZE):
+            try:
+                self._check_message(message)
+            except TypeError:
+                self.mempool.remove([message])
+                continue
+
+            leaf.pool(message, verify=False)
+
+        self.events.publish('leaf', self.leaf_event())
+
+    def leaf_event(self) -> dict:
+        """ Make data of event about the leaf. The caller must hold lock. """
+
+        leaf = self.chain[-1]
+
+        return {
+            'index': leaf.index,
+            'parent': leaf.parent.signature.hex(),
+            'messages': len(leaf.messages),
+        }
+
+    def add_message(self, message: core.Message) -> bool:
+        """ Verify and add message into the mempool.
+
+        Returns False if the message is already pooled or included in chain.
+        """
+
+        with self.lock.write():
+            self._check_message(message)
+
+            if self.chain.find_message(message.signature) is not None:
+                return False
+
+            if not self.mempool.add(message):
+                return False
+
+            messages_pooled.inc()
+
+            leaf = self.chain[-1]
+            if len(leaf.messages) < self.TEMPLATE_SIZE:
+                leaf.pool(message, verify=False)
+                self.events.publish('template', self.leaf_event())
+
+            return True
+
+    def _check_message(self, message: core.Message) -> None:
         if message.namespace == 'macracoin.mining':
             if message.payload['from'] != self.chain[-2].signature.hex():
                 raise TypeError('invalid from')
@@ -68,8 +539,6 @@ class ChainManager:
                 if m.namespace == 'macracoin.mining':
                     raise TypeError('duplicated mining')
         elif (message.namespace == 'macracoin'
-             or message.namespace.starts_with('macracoin.')):
+             or message.namespace.startswith('macracoin.')):
 
             raise TypeError('invalid namespace')
-
-        self.chain[-1].pool(message)
@@ -1,27 +1,181 @@
 import base64
 import json
+import logging
+import threading
+import time
 import typing
 import urllib.parse
 
 import requests
 
 import core
+from core import codec
+from peer import events
+from peer.gossip import Gossip
+
+
+logger = logging.getLogger(__name__)
+
+JSON = 'application/json'
+ACCEPT = '{}, {};q=0.5'.format(codec.CONTENT_TYPE, JSON)
 
 
 class Client:
-    def __init__(self, addr: str = None) -> None:
+    PAGE_SIZE = 100
+    CHUNK_SIZE = 1 << 16
+    EVENTS_TIMEOUT = 60.0
+
+    def __init__(self, addr: str = None, binary: bool = True) -> None:
         self.addr = addr
         self.hosts: typing.Set[str] = set()
+        self._hosts_lock = threading.Lock()
+
+        # Use binary encoding if true, and fallback to JSON for hosts that
+        # not accept it.
+        self.binary = binary
+        self.json_hosts: typing.Set[str] = set()
+
+        self.gossip = Gossip(on_drop=self._drop)
+
+    def _get(self,
+             addr: str,
+             url: str,
+             params: typing.Dict[str, int] = None,
+             stream: bool = False) -> requests.Response:
+
+        headers = {}
+        if self.binary:
+            headers['Accept'] = ACCEPT
+
+        resp = self.gossip.session(addr).get(url,
+                                             params=params,
+                                             headers=headers,
+                                             stream=stream,
+                                             timeout=self.gossip.timeout)
+        resp.raise_for_status()
+
+        return resp
+
+    def _send(self,
+              method: str,
+              addr: str,
+              url: str,
+              binary: typing.Callable[[], bytes],
+              json_: typing.Callable[[], bytes],
+              params: typing.Dict[str, str] = None) -> None:
+
+        """ Send binary body, or JSON body if the host can not decode it.
+
+        Host responds 415 for unsupported content type and 400 for a body
+        that it can not decode, then the body is sent again as JSON and the
+        host is remembered as JSON only. Other errors are raised.
+
+
+        >>> import threading
+        >>> from wsgiref import simple_server
+
+        >>> received = []
+        >>> def json_only(environ, start_response):
+        ...     if environ.get('CONTENT_TYPE') != JSON:
+        ...         start_response('415 Unsupported Media Type', [])
+        ...         return [b'']
+        ...     body = environ['wsgi.input'].read(
+        ...         int(environ['CONTENT_LENGTH']))
+        ...     received.append(json.loads(body.decode('utf-8')))
+        ...     start_response('201 Created', [])
+        ...     return [b'']
+
+        >>> class Handler(simple_server.WSGIRequestHandler):
+        ...     def log_message(self, *args):
+        ...         pass
+
+        >>> server = simple_server.make_server('localhost', 0, json_only,
+        ...                                    handler_class=Handler)
+        >>> thread = threading.Thread(target=server.serve_forever)
+        >>> thread.start()
+        >>> addr = 'http://localhost:{}/'.format(server.server_port)
+
+        >>> client = Client()
+        >>> client._send('POST',
+        ...              addr,
+        ...              addr + 'message',
+        ...              lambda: b'binary',
+        ...              lambda: b'{"hello": "world"}')
+        >>> received
+        [{'hello': 'world'}]
+        >>> addr in client.json_hosts
+        True
+
+        >>> server.shutdown()
+        >>> thread.join()
+        >>> server.server_close()
+        >>> client.gossip.close()
+        """
+
+        session = self.gossip.session(addr)
+
+        if self.binary and addr not in self.json_hosts:
+            headers = {'Content-Type': codec.CONTENT_TYPE}
+            resp = session.request(method,
+                                   url,
+                                   data=binary(),
+                                   params=params,
+                                   headers=headers,
+                                   timeout=self.gossip.timeout)
+            if resp.ok:
+                return
+
+            # Only errors about the encoding are retried as JSON.
+            if resp.status_code not in (400, 415):
+                resp.raise_for_status()
+
+        session.request(method,
+                        url,
+                        data=json_(),
+                        headers={'Content-Type': JSON},
+                        timeout=self.gossip.timeout).raise_for_status()
+
+        if self.binary and addr not in self.json_hosts:
+            logger.info('fallback to json peer=%s', addr)
+            self.json_hosts.add(addr)
+
+    @staticmethod
+    def _is_binary(resp: requests.Response) -> bool:
+        return resp.headers.get('Content-Type', '').startswith(
+            codec.CONTENT_TYPE,
+        )
+
+    def _decode_block(self, resp: requests.Response) -> core.Block:
+        if self._is_binary(resp):
+            return codec.decode_block(resp.content)
+        else:
+            return core.Block.from_json(resp.text)
+
+    def peers(self) -> typing.Tuple[str, ...]:
+        """ Get snapshot of connected hosts. """
+
+        with self._hosts_lock:
+            return tuple(self.hosts)
 
     def connected(self, addr: str) -> None:
-        print('connect with {}'.format(addr))
+        logger.info('connected peer=%s', addr)
 
-        self.hosts.add(addr)
+        with self._hosts_lock:
+            self.hosts.add(addr)
 
     def disconnected(self, addr: str) -> None:
-        print('disconnect with {}'.format(addr))
+        logger.info('disconnected peer=%s', addr)
+
+        with self._hosts_lock:
+            self.hosts.discard(addr)
+        self.gossip.forget(addr)
+
+    def _drop(self, addr: str) -> None:
+        """ Forget unhealthy host. """
 
-        self.hosts.remove(addr)
+        with self._hosts_lock:
+            self.hosts.discard(addr)
+            self.json_hosts.discard(addr)
 
     def connect_request(self, addr: str) -> typing.Tuple[str]:
         if self.addr is None:
@@ -30,9 +184,12 @@ class Client:
         data = json.dumps({'addr': self.addr}).encode('ascii')
         headers = {'Content-Type': 'application/json'}
 
-        resp = requests.put(urllib.parse.urljoin(addr, 'connection'),
-                            data=data,
-                            headers=headers)
+        resp = self.gossip.session(addr).put(
+            urllib.parse.urljoin(addr, 'connection'),
+            data=data,
+            headers=headers,
+            timeout=self.gossip.timeout,
+        )
         resp.raise_for_status()
 
         self.connected(addr)
@@ -43,47 +200,83 @@ class Client:
         if self.addr is None:
             raise TypeError('address is not set')
 
-        for addr in self.hosts:
-            print('disconnect with {}'.format(addr))
+        data = json.dumps({'addr': self.addr}).encode('ascii')
+
+        def send(session: requests.Session, addr: str) -> None:
+            logger.info('disconnecting peer=%s', addr)
 
-            url = urllib.parse.urljoin(addr, 'connection')
-            requests.delete(
-                url,
-                data=json.dumps({'addr': self.addr}).encode('ascii'),
+            session.delete(
+                urllib.parse.urljoin(addr, 'connection'),
+                data=data,
                 headers={'Content-Type': 'application/json'},
+                timeout=self.gossip.timeout,
             ).raise_for_status()
 
-        self.hosts = set()
+        hosts = self.peers()
+        self.gossip.broadcast(hosts, send)
+
+        for addr in hosts:
+            self.gossip.forget(addr)
+        with self._hosts_lock:
+            self.hosts = set()
+
+    def put_block(self,
+                  block: core.Block,
+                  origin: str = None) -> typing.Dict[str, bool]:
+
+        """ Send block to all hosts except origin concurrently.
+
+        Failed sends are retried, and a host that failed too many times is
+        dropped. Returns whether succeeded or not for each host.
+        """
 
-    def put_block(self, block: core.Block, origin: str = None) -> None:
         if not block.verify():
             raise TypeError('invalid block')
 
+        binary = codec.encode_block(block)
         data = json.dumps({
             'host': self.addr,
             'block': block.as_dict(),
         }).encode('ascii')
-        headers = {'Content-Type': 'application/json'}
+        params = None
+        if self.addr is not None:
+            params = {'host': self.addr}
+
+        def send(session: requests.Session, addr: str) -> None:
+            logger.debug('send block peer=%s index=%d', addr, block.index)
+            self._send('PUT',
+                       addr,
+                       urllib.parse.urljoin(addr, 'block'),
+                       lambda: binary,
+                       lambda: data,
+                       params)
 
-        for addr in self.hosts:
-            if addr != origin:
-                print('notify to {}'.format(addr))
-                url = urllib.parse.urljoin(addr, 'block')
-                requests.put(url,
-                             data=data,
-                             headers=headers).raise_for_status()
+        return self.gossip.broadcast(
+            [addr for addr in self.peers() if addr != origin],
+            send,
+        )
 
     def get_block(self, addr: str, index: int) -> core.Block:
         url = urllib.parse.urljoin(addr, '/block/{}'.format(index))
-        resp = requests.get(url)
-        resp.raise_for_status()
-
-        block = core.Block.from_json(resp.text)
+        block = self._decode_block(self._get(addr, url))
         if block.is_closed() and not block.verify():
             raise TypeError('invalid block')
 
         return block
 
+    def get_block_by_signature(self, addr: str, signature: bytes) \
+            -> core.Block:
+
+        url = urllib.parse.urljoin(
+            addr,
+            '/block/by-signature/{}'.format(signature.hex()),
+        )
+        block = self._decode_block(self._get(addr, url))
+        if not block.verify() or block.signature != signature:
+            raise TypeError('invalid block')
+
+        return block
+
     def post_close_block(self, addr: str, block: core.Block) -> None:
         if not block.verify():
             raise TypeError('invalid block')
@@ -97,20 +290,327 @@ class Client:
         header = {'Content-Type': 'application/json'}
 
         url = urllib.parse.urljoin(addr, '/block')
-        requests.post(url, data=data, headers=header).raise_for_status()
+        self.gossip.session(addr).post(
+            url,
+            data=data,
+            headers=header,
+            timeout=self.gossip.timeout,
+        ).raise_for_status()
 
     def get_chain(self, addr: str) -> core.Chain:
         url = urllib.parse.urljoin(addr, 'block')
-        resp = requests.get(url)
+        resp = self._get(addr, url, stream=True)
+
+        with resp:
+            chunks = resp.iter_content(self.CHUNK_SIZE)
+
+            if self._is_binary(resp):
+                return core.Chain.from_blocks(codec.iter_decode_chain(chunks))
+            else:
+                return core.Chain.from_json_stream(chunks)
+
+    def get_blocks(self,
+                   addr: str,
+                   start: int,
+                   stop: int = None,
+                   limit: int = None,
+                   verify: bool = True) -> typing.List[core.Block]:
+
+        """ Get blocks from start to before stop.
+
+        Server may return less blocks than requested. Blocks are not verified,
+        and signatures of messages are verified unless verify is False.
+        """
+
+        params = {'from': start}
+        if stop is not None:
+            params['to'] = stop
+        if limit is not None:
+            params['limit'] = limit
+
+        resp = self._get(addr, urllib.parse.urljoin(addr, 'block'), params)
+
+        if self._is_binary(resp):
+            return codec.decode_blocks(resp.content, verify=verify)
+        else:
+            return [core.Block.from_dict(b, verify=verify)
+                    for b in resp.json()]
+
+    def iter_pages(self,
+                   addr: str,
+                   start: int,
+                   page_size: int = PAGE_SIZE,
+                   verify: bool = True,
+                   stop: int = None) \
+            -> typing.Iterator[typing.List[core.Block]]:
+
+        """ Get pages of blocks after start, until the leaf or stop. """
+
+        while stop is None or start < stop:
+            blocks = self.get_blocks(addr,
+                                     start,
+                                     stop,
+                                     limit=page_size,
+                                     verify=verify)
+
+            if len(blocks) > 0:
+                yield blocks
+
+            if len(blocks) == 0 or not blocks[-1].is_closed():
+                return
+
+            start += len(blocks)
+
+    def iter_blocks(self,
+                    addr: str,
+                    start: int,
+                    page_size: int = PAGE_SIZE) -> typing.Iterator[core.Block]:
+
+        """ Get blocks after start page by page, until the leaf. """
+
+        for page in self.iter_pages(addr, start, page_size):
+            yield from page
+
+    def get_headers(self,
+                    addr: str,
+                    start: int,
+                    stop: int = None,
+                    limit: int = None,
+                    magicnumber: str = None) -> typing.List[core.Block]:
+
+        """ Get headers of closed blocks from start to before stop.
+
+        Server may return less headers than requested. Headers are not
+        verified; use `core.headers.verify_headers`.
+        """
+
+        params = {'from': start}
+        if stop is not None:
+            params['to'] = stop
+        if limit is not None:
+            params['limit'] = limit
+
+        resp = self._get(addr, urllib.parse.urljoin(addr, 'header'), params)
+
+        if self._is_binary(resp):
+            return codec.decode_headers(resp.content, magicnumber)
+        else:
+            return [core.Block.header_from_dict(h, magicnumber)
+                    for h in resp.json()]
+
+    def iter_headers(self,
+                     addr: str,
+                     start: int,
+                     magicnumber: str = None) \
+            -> typing.Iterator[typing.List[core.Block]]:
+
+        """ Get pages of headers after start, until the newest closed
+        block.
+        """
+
+        while True:
+            headers = self.get_headers(addr, start, magicnumber=magicnumber)
+            if len(headers) == 0:
+                return
+
+            yield headers
+
+            start += len(headers)
+
+    def get_message(self,
+                    addr: str,
+                    signature: bytes) -> typing.Tuple[int, core.Message]:
+
+        url = urllib.parse.urljoin(addr,
+                                   '/message/{}'.format(signature.hex()))
+        resp = self.gossip.session(addr).get(url, timeout=self.gossip.timeout)
+        resp.raise_for_status()
+
+        data = resp.json()
+        return data['block'], core.Message.from_dict(data['message'])
+
+    def get_work(self, addr: str, size: int = None) -> dict:
+        """ Get the hash prefix of leaf and a range of nonce to search.
+
+        Returns dictionary that has "template", "prefix" as bytes,
+        "magicnumber", "start", "stop", and "leaf" that is the same as data
+        of leaf event.
+        """
+
+        params = None
+        if size is not None:
+            params = {'size': size}
+
+        resp = self.gossip.session(addr).get(
+            urllib.parse.urljoin(addr, 'work'),
+            params=params,
+            timeout=self.gossip.timeout,
+        )
+        resp.raise_for_status()
+
+        work = resp.json()
+        work['prefix'] = bytes.fromhex(work['prefix'])
+
+        return work
+
+    def submit_work(self,
+                    addr: str,
+                    work: dict,
+                    user: core.User,
+                    key: bytes) -> bytes:
+
+        """ Close the leaf of the work with the key.
+
+        Returns signature of the closed block. Raises HTTPError with 409 if
+        the work is stale.
+        """
+
+        timestamp = int(time.time() * 1000)
+        signature = user.sign_raw(timestamp.to_bytes(8, 'big') + key)
+
+        data = json.dumps({
+            'template': work['template'],
+            'user': user.public_pem,
+            'key': base64.b64encode(key).decode('ascii'),
+            'timestamp': timestamp,
+            'signature': base64.b64encode(signature).decode('ascii'),
+        }).encode('ascii')
+
+        self.gossip.session(addr).post(
+            urllib.parse.urljoin(addr, 'work'),
+            data=data,
+            headers={'Content-Type': JSON},
+            timeout=self.gossip.timeout,
+        ).raise_for_status()
+
+        return signature
+
+    def subscribe(self, addr: str) \
+            -> typing.Iterator[typing.Tuple[str, dict]]:
+
+        """ Receive events about the leaf of the peer.
+
+        Yields pairs of event name and data, "leaf" when the leaf replaced
+        and "template" when messages pooled. The first event is the current
+        leaf.
+        """
+
+        resp = self.gossip.session(addr).get(
+            urllib.parse.urljoin(addr, 'events'),
+            stream=True,
+            timeout=(self.gossip.timeout, self.EVENTS_TIMEOUT),
+        )
+        resp.raise_for_status()
+
+        with resp:
+            # Read line by line, because events are not filling any chunk.
+            lines = resp.iter_lines(chunk_size=1, decode_unicode=True)
+
+            yield from events.parse_events(lines)
+
+    def get_message_proof(self,
+                          addr: str,
+                          signature: bytes,
+                          magicnumber: str = None) -> core.Block:
+
+        """ Check the message is in a closed block without getting bodies.
+
+        Returns header of the block that has the message. The header is
+        verified with the magic number, and the proof is checked with the
+        Merkle root of it.
+        """
+
+        url = urllib.parse.urljoin(
+            addr,
+            '/message/{}/proof'.format(signature.hex()),
+        )
+        resp = self.gossip.session(addr).get(url, timeout=self.gossip.timeout)
+        resp.raise_for_status()
+
+        data = resp.json()
+        header = core.Block.header_from_dict(data['header'], magicnumber)
+        proof = core.merkle.proof_from_list(data['proof'])
+
+        if (header.version == 1
+                or not header.verify()
+                or not core.merkle.verify_proof(signature,
+                                                proof,
+                                                header.merkle_root())):
+
+            raise TypeError('invalid proof')
+
+        return header
+
+    def query_messages(self,
+                       addr: str,
+                       namespace: str = None,
+                       sender: bytes = None,
+                       since: int = 0,
+                       position: int = 0,
+                       limit: int = None) \
+            -> typing.Tuple[typing.List[typing.Tuple[int, int, core.Message]],
+                            typing.Optional[typing.Tuple[int, int]]]:
+
+        """ Find messages in closed blocks by namespace and sender.
+
+        Returns list of block index, position in block, and message, and
+        the position of the next page or None if no more messages.
+        """
+
+        params: typing.Dict[str, typing.Union[str, int]] = {
+            'since': since,
+            'position': position,
+        }
+        if namespace is not None:
+            params['namespace'] = namespace
+        if sender is not None:
+            params['sender'] = sender.hex()
+        if limit is not None:
+            params['limit'] = limit
+
+        resp = self.gossip.session(addr).get(
+            urllib.parse.urljoin(addr, 'message'),
+            params=params,
+            timeout=self.gossip.timeout,
+        )
         resp.raise_for_status()
 
-        return core.Chain.from_json(resp.text)
+        data = resp.json()
+
+        messages = [(m['block'],
+                     m['position'],
+                     core.Message.from_dict(m['message']))
+                    for m in data['messages']]
+
+        next_ = None
+        if data['next'] is not None:
+            next_ = (data['next']['since'], data['next']['position'])
+
+        return messages, next_
+
+    def iter_messages(self,
+                      addr: str,
+                      namespace: str = None,
+                      sender: bytes = None,
+                      since: int = 0) \
+            -> typing.Iterator[typing.Tuple[int, int, core.Message]]:
+
+        """ Find all messages after since block page by page. """
+
+        position: typing.Optional[typing.Tuple[int, int]] = (since, 0)
+
+        while position is not None:
+            messages, position = self.query_messages(addr,
+                                                     namespace,
+                                                     sender,
+                                                     *position)
+            yield from messages
 
     def post_message(self, addr: str, message: core.Message) -> None:
         url = urllib.parse.urljoin(addr, 'message')
 
-        requests.post(
-            url,
-            data=message.as_json().encode('ascii'),
-            headers={'Content-Type': 'application/json'},
-        ).raise_for_status()
+        self._send('POST',
+                   addr,
+                   url,
+                   lambda: codec.encode_message(message),
+                   lambda: message.as_json().encode('ascii'))
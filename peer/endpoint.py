@@ -1,65 +1,241 @@
 import base64
 import json
+import logging
+import typing
 import urllib.parse
 
 import falcon
 
 import core
+from core import codec, metrics
+from peer import events
 from peer.chainmanager import ChainManager
+from peer.work import StaleTemplateError, WorkAllocator
+
+
+logger = logging.getLogger(__name__)
+
+chain_height = metrics.gauge('chain_height', 'Index of the leaf block.')
+mempool_messages = metrics.gauge('mempool_messages',
+                                 'Messages in the mempool.')
+mempool_bytes = metrics.gauge('mempool_bytes', 'Size of the mempool.')
+peers = metrics.gauge('peers', 'Connected peers.')
+subscribers = metrics.gauge('event_subscribers', 'Subscribers of events.')
+orphans = metrics.gauge('orphan_blocks', 'Blocks waiting for their parent.')
+verification_cache_entries = metrics.gauge(
+    'verification_cache_entries',
+    'Signatures remembered in the verification cache.',
+)
+
+
+def wants_binary(req: falcon.Request) -> bool:
+    """ Check the client prefers binary encoding than JSON. """
+
+    return req.client_prefers((codec.CONTENT_TYPE, falcon.MEDIA_JSON)) \
+        == codec.CONTENT_TYPE
+
+
+def is_binary(req: falcon.Request) -> bool:
+    """ Check the request body is binary encoding. """
+
+    return (req.content_type or '').startswith(codec.CONTENT_TYPE)
+
+
+def is_json(req: falcon.Request) -> bool:
+    """ Check the request body is JSON, or has no content type. """
+
+    return (req.content_type or falcon.MEDIA_JSON).startswith(
+        falcon.MEDIA_JSON,
+    )
+
+
+def iter_chunks(data: memoryview,
+                size: int = 1 << 16) -> typing.Iterator[bytes]:
+
+    """ Slice data into chunks, so that mapped data is never copied at once.
+    WSGI servers accept only bytes.
+
+
+    >>> list(iter_chunks(memoryview(b'hello world'), 4))
+    [b'hell', b'o wo', b'rld']
+    """
+
+    for offset in range(0, len(data), size):
+        yield bytes(data[offset:offset + size])
+
+
+def load_user(message: core.Message) -> core.Message:
+    """ Load the key of the sender, that is loaded lazily, so that a broken
+    key is found while decoding the request.
+    """
+
+    message.user
+
+    return message
 
 
 class BaseResource:
     def __init__(self, manager: ChainManager) -> None:
         self.manager = manager
 
+    def send_block(self,
+                   req: falcon.Request,
+                   resp: falcon.Response,
+                   block: core.Block) -> None:
+
+        """ Send block. The caller must hold the read lock. """
+
+        if wants_binary(req):
+            resp.content_type = codec.CONTENT_TYPE
+            resp.data = codec.encode_block(block)
+        else:
+            resp.body = block.as_json()
+
+    def decode_body(self,
+                    req: falcon.Request,
+                    binary: typing.Optional[typing.Callable[[bytes],
+                                                            typing.Any]],
+                    json_: typing.Callable[[typing.Any], typing.Any]) \
+            -> typing.Any:
+
+        """ Decode the request body by binary or json_ decoder.
+
+        The json_ decoder takes the parsed JSON. Binary is None if the
+        resource accepts only JSON. Responds 415 if the content type is not
+        supported, and 400 if the body can not be decoded, so clients can
+        tell it from other errors and fall back to JSON.
+        """
+
+        binary_body = binary is not None and is_binary(req)
+        if not binary_body and not is_json(req):
+            raise falcon.HTTPUnsupportedMediaType(
+                'unsupported content type: {}'.format(req.content_type),
+            )
+
+        data = req.bounded_stream.read()
+
+        try:
+            if binary_body:
+                return binary(data)
+            else:
+                return json_(json.loads(data))
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise falcon.HTTPBadRequest('invalid body', str(e))
+
+    def locked(self, chunks: typing.Iterator[bytes]) \
+            -> typing.Iterator[bytes]:
+
+        """ Take chunks one by one with holding the read lock.
+
+        The lock is released while sending each chunk, so a slow client
+        does not block writers.
+        """
+
+        while True:
+            with self.manager.lock.read():
+                chunk = next(chunks, None)
+
+            if chunk is None:
+                return
+
+            yield chunk
+
 
 class ConnectResource(BaseResource):
     def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
-        resp.body = json.dumps(tuple(self.manager.client.hosts))
+        resp.body = json.dumps(self.manager.client.peers())
 
     def on_put(self, req: falcon.Request, resp: falcon.Response) -> None:
-        msg = json.loads(req.stream.read())
-
-        print('connected {}'.format(msg['addr']))
+        msg = json.loads(req.bounded_stream.read())
 
-        resp.body = json.dumps(tuple(self.manager.client.hosts))
+        resp.body = json.dumps(self.manager.client.peers())
         self.manager.connected(msg['addr'])
 
     def on_delete(self, req: falcon.Request, resp: falcon.Response) -> None:
-        msg = json.loads(req.stream.read())
-
-        print('disconnected {}'.format(msg['addr']))
+        msg = json.loads(req.bounded_stream.read())
 
         self.manager.disconnected(msg['addr'])
         resp.status = falcon.HTTP_201
 
 
 class BlockResource(BaseResource):
+    PAGE_SIZE = 100
+
     def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
-        resp.body = self.manager.chain.as_json()
+        start = req.get_param_as_int('from', False, 0)
+        stop = req.get_param_as_int('to', False, 0)
+
+        if start is not None or stop is not None:
+            self.on_get_range(req, resp, start or 0, stop)
+        elif wants_binary(req):
+            with self.manager.lock.read():
+                chunks = codec.iter_encode_chain(self.manager.chain)
+
+            resp.content_type = codec.CONTENT_TYPE
+            resp.stream = self.locked(chunks)
+        else:
+            with self.manager.lock.read():
+                chunks = self.manager.chain.iter_json()
+
+            resp.stream = self.locked(chunk.encode('ascii')
+                                      for chunk in chunks)
+
+    def on_get_range(self,
+                     req: falcon.Request,
+                     resp: falcon.Response,
+                     start: int,
+                     stop: typing.Optional[int]) -> None:
+
+        """ Send blocks from start to before stop, at most limit blocks. """
+
+        limit = req.get_param_as_int('limit', False, 1) or self.PAGE_SIZE
+        limit = min(limit, self.PAGE_SIZE)
+
+        if stop is None or stop > start + limit:
+            stop = start + limit
+
+        with self.manager.lock.read():
+            blocks = self.manager.chain[start:stop]
+
+            if wants_binary(req):
+                resp.content_type = codec.CONTENT_TYPE
+                resp.data = codec.encode_blocks(blocks)
+            else:
+                resp.body = json.dumps([block.as_dict() for block in blocks])
 
     def on_put(self, req: falcon.Request, resp: falcon.Response) -> None:
-        msg = json.loads(req.stream.read())
+        block, host = self.decode_body(
+            req,
+            lambda data: (codec.decode_block(data), req.get_param('host')),
+            lambda msg: (core.Block.from_dict(msg['block']), msg.get('host')),
+        )
 
-        print('receive block {}'.format(msg['block']['signature']))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('received block index=%d signature=%s',
+                         block.index,
+                         block.signature.hex())
 
-        self.manager.add_block(core.Block.from_dict(msg['block']),
-                               msg.get('host'))
+        try:
+            self.manager.add_block(block, host)
+        except (core.InvalidChainError, core.InvalidSignatureError) as e:
+            logger.info('rejected block index=%d error=%r', block.index, e)
+            resp.status = falcon.HTTP_400
+            return
 
         resp.status = falcon.HTTP_201
 
     def on_post(self, req: falcon.Request, resp: falcon.Response) -> None:
-        msg = json.loads(req.stream.read())
-
-        print('close block with {}'.format(msg['key']))
-
-        ok = self.manager.close_block(
+        args = self.decode_body(req, None, lambda msg: (
             core.User.from_pem(msg['user']),
             msg['timestamp'],
             base64.b64decode(msg['key']),
             base64.b64decode(msg['signature']),
             msg.get('host'),
-        )
+        ))
+
+        logger.info('close block key=%s', args[2].hex())
+
+        ok = self.manager.close_block(*args)
 
         if ok:
             resp.status = falcon.HTTP_201
@@ -67,24 +243,336 @@ class BlockResource(BaseResource):
             resp.status = falcon.HTTP_400
 
 
+class HeaderResource(BaseResource):
+    """ Send headers of closed blocks from `from` to before `to`, at most
+    `limit` headers.
+
+    Headers are far smaller than blocks, so a page has more of them, and
+    clients can verify the chain before getting messages.
+    """
+
+    PAGE_SIZE = 2000
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        start = req.get_param_as_int('from', False, 0) or 0
+        stop = req.get_param_as_int('to', False, 0)
+        limit = req.get_param_as_int('limit', False, 1) or self.PAGE_SIZE
+        limit = min(limit, self.PAGE_SIZE)
+
+        if stop is None or stop > start + limit:
+            stop = start + limit
+
+        with self.manager.lock.read():
+            headers = [block for block in self.manager.chain[start:stop]
+                       if block.is_closed()]
+
+            if wants_binary(req):
+                resp.content_type = codec.CONTENT_TYPE
+                resp.data = codec.encode_headers(headers)
+            else:
+                resp.body = json.dumps([block.as_header()
+                                        for block in headers])
+
+
 class SingleBlockResource(BaseResource):
     def on_get(self,
                req: falcon.Request,
                resp: falcon.Response,
                index: int) -> None:
 
+        with self.manager.lock.read():
+            store = self.manager.store
+            if (store is not None
+                    and 0 <= index < len(store)
+                    and not wants_binary(req)):
+
+                # Segments are append-only, so the data is not changed
+                # after released the lock.
+                data = store.read_raw(index)
+                resp.content_length = len(data)
+                resp.stream = iter_chunks(data)
+                return
+
+            try:
+                block = self.manager.chain[index]
+            except IndexError:
+                resp.status = falcon.HTTP_404
+                return
+
+            self.send_block(req, resp, block)
+
+
+class BlockBySignatureResource(BaseResource):
+    def on_get(self,
+               req: falcon.Request,
+               resp: falcon.Response,
+               signature: str) -> None:
+
         try:
-            resp.body = self.manager.chain[index].as_json()
-        except IndexError:
-            resp.status = falcon.HTTP_404
+            signature_ = bytes.fromhex(signature)
+        except ValueError:
+            resp.status = falcon.HTTP_400
+            return
+
+        with self.manager.lock.read():
+            block = self.manager.chain.find_block(signature_)
+
+            if block is None:
+                resp.status = falcon.HTTP_404
+            else:
+                self.send_block(req, resp, block)
 
 
 class MessageResource(BaseResource):
+    PAGE_SIZE = 100
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        """ Send messages in closed blocks by namespace and sender.
+
+        Messages are sent from the position of `since` block and `position`
+        in the block. If there are more messages, `next` has the position of
+        the next page.
+        """
+
+        namespace = req.get_param('namespace')
+        sender = req.get_param('sender')
+        since = req.get_param_as_int('since', False, 0) or 0
+        position = req.get_param_as_int('position', False, 0) or 0
+        limit = req.get_param_as_int('limit', False, 1) or self.PAGE_SIZE
+        limit = min(limit, self.PAGE_SIZE)
+
+        try:
+            if sender is not None:
+                sender = bytes.fromhex(sender)
+
+            with self.manager.lock.read():
+                found = self.manager.chain.query(namespace,
+                                                 sender,
+                                                 (since, position),
+                                                 limit)
+        except ValueError:
+            resp.status = falcon.HTTP_400
+            return
+
+        next_ = None
+        if len(found) == limit:
+            last = found[-1][0]
+            next_ = {'since': last[0], 'position': last[1] + 1}
+
+        resp.body = json.dumps({
+            'messages': [{
+                'block': block,
+                'position': i,
+                'message': message.as_dict(),
+            } for (block, i), message in found],
+            'next': next_,
+        })
+
     def on_post(self, req: falcon.Request, resp: falcon.Response) -> None:
-        msg = json.loads(req.stream.read())
+        # Signature is verified by the mempool on admission.
+        message = self.decode_body(
+            req,
+            lambda data: load_user(codec.decode_message(data, False)),
+            lambda msg: load_user(core.Message.from_dict(msg, verify=False)),
+        )
 
-        print('send message of {}'.format(msg['namespace']))
+        logger.debug('received message namespace=%s', message.namespace)
 
-        message = core.Message.from_dict(msg)
-        self.manager.add_message(message)
-        resp.status = falcon.HTTP_201
+        if self.manager.add_message(message):
+            resp.status = falcon.HTTP_201
+        else:
+            resp.status = falcon.HTTP_200
+
+
+class SingleMessageResource(BaseResource):
+    def on_get(self,
+               req: falcon.Request,
+               resp: falcon.Response,
+               signature: str) -> None:
+
+        try:
+            signature_ = bytes.fromhex(signature)
+        except ValueError:
+            resp.status = falcon.HTTP_400
+            return
+
+        with self.manager.lock.read():
+            found = self.manager.chain.find_message(signature_)
+
+        if found is None:
+            resp.status = falcon.HTTP_404
+            return
+
+        block, message = found
+        resp.body = json.dumps({
+            'block': block.index,
+            'message': message.as_dict(),
+        })
+
+
+class MessageProofResource(BaseResource):
+    def on_get(self,
+               req: falcon.Request,
+               resp: falcon.Response,
+               signature: str) -> None:
+
+        """ Send header of the block that has the message, and the Merkle
+        proof of the message in the block.
+        """
+
+        try:
+            signature_ = bytes.fromhex(signature)
+        except ValueError:
+            resp.status = falcon.HTTP_400
+            return
+
+        with self.manager.lock.read():
+            found = self.manager.chain.locate_message(signature_)
+
+            if found is None:
+                resp.status = falcon.HTTP_404
+                return
+
+            block = self.manager.chain[found[0]]
+            if block.version == 1:
+                resp.status = falcon.HTTP_404
+                return
+
+            proof = block.merkle_proof(found[1])
+
+            resp.body = json.dumps({
+                'header': block.as_header(),
+                'position': found[1],
+                'proof': core.merkle.proof_as_list(proof),
+            })
+
+
+class EventsResource(BaseResource):
+    HEARTBEAT = 15.0
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        """ Send changes of the leaf as server-sent events.
+
+        The first event is the current leaf. A subscriber holds a worker of
+        the server while connected, so subscribers are limited by
+        `max_subscribers` of the event bus. Responds 503 if there are too
+        many subscribers, and clients should poll instead.
+        """
+
+        subscription = self.manager.events.subscribe()
+        if subscription is None:
+            raise falcon.HTTPServiceUnavailable(
+                'too many subscribers',
+                'poll the leaf instead',
+                retry_after=int(self.HEARTBEAT),
+            )
+
+        resp.content_type = 'text/event-stream; charset=utf-8'
+        resp.cache_control = ('no-cache',)
+        resp.stream = self._stream(subscription)
+
+    def _stream(self, subscription: events.Subscription) \
+            -> typing.Iterator[bytes]:
+
+        try:
+            with self.manager.lock.read():
+                current = self.manager.leaf_event()
+
+            yield events.format_event('leaf', current)
+
+            while True:
+                event = subscription.get(self.HEARTBEAT)
+
+                if event is None:
+                    yield b': heartbeat\n\n'
+                else:
+                    yield events.format_event(*event)
+        finally:
+            subscription.close()
+
+
+class WorkResource(BaseResource):
+    MAX_SIZE = 1 << 24
+
+    def __init__(self, manager: ChainManager) -> None:
+        super().__init__(manager)
+
+        self.allocator = WorkAllocator()
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        """ Send the hash prefix of the leaf and a range of nonce to search.
+
+        Each request gets a range that not overlapped with others for the
+        same template.
+        """
+
+        size = req.get_param_as_int('size', False, 1) or self.allocator.size
+        size = min(size, self.MAX_SIZE)
+
+        with self.manager.lock.read():
+            leaf = self.manager.chain[-1]
+            prefix = leaf.hash_prefix()
+            magicnumber = leaf.magicnumber
+            current = self.manager.leaf_event()
+
+        try:
+            template, start, stop = self.allocator.allocate(prefix, size)
+        except ValueError:
+            resp.status = falcon.HTTP_503
+            return
+
+        resp.body = json.dumps({
+            'template': template,
+            'prefix': prefix.hex(),
+            'magicnumber': magicnumber,
+            'start': start,
+            'stop': stop,
+            'leaf': current,
+        })
+
+    def on_post(self, req: falcon.Request, resp: falcon.Response) -> None:
+        """ Close the leaf with found key.
+
+        Responses 409 if the template is already changed.
+        """
+
+        msg = json.loads(req.bounded_stream.read())
+
+        logger.info('close block with work key=%s', msg['key'])
+
+        try:
+            ok = self.manager.close_block(
+                core.User.from_pem(msg['user']),
+                msg['timestamp'],
+                base64.b64decode(msg['key']),
+                base64.b64decode(msg['signature']),
+                template=msg['template'],
+            )
+        except StaleTemplateError:
+            resp.status = falcon.HTTP_409
+            return
+
+        if ok:
+            resp.status = falcon.HTTP_201
+        else:
+            resp.status = falcon.HTTP_400
+
+
+class MetricsResource(BaseResource):
+    """ The metrics in the Prometheus text format. """
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        with self.manager.lock.read():
+            chain_height.set(self.manager.chain[-1].index)
+            mempool_messages.set(len(self.manager.mempool))
+            mempool_bytes.set(self.manager.mempool.bytes)
+            orphans.set(self.manager.tree.orphans())
+
+        peers.set(len(self.manager.client.peers()))
+        subscribers.set(len(self.manager.events))
+        verification_cache_entries.set(
+            core.user.verification_cache.stats()['size'],
+        )
+
+        resp.content_type = metrics.CONTENT_TYPE
+        resp.body = metrics.render()
@@ -0,0 +1,149 @@
+import json
+import queue
+import threading
+import typing
+
+
+Event = typing.Tuple[str, dict]
+
+
+class Subscription:
+    """ The queue of events for a subscriber.
+
+    The queue is bounded, and the oldest event is dropped if the subscriber
+    is too slow.
+    """
+
+    def __init__(self, bus: 'EventBus', maxsize: int) -> None:
+        self._bus = bus
+        self._queue: 'queue.Queue[Event]' = queue.Queue(maxsize)
+
+    def put(self, event: Event) -> None:
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float = None) -> typing.Optional[Event]:
+        """ Wait for next event. Returns None if timed out. """
+
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        """ Stop receiving events. """
+
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """ The publisher of events to subscribers.
+
+    Publishing never blocks, so it is safe while holding locks. At most
+    `max_subscribers` subscribers are accepted if it is not None.
+
+
+    >>> bus = EventBus()
+    >>> subscription = bus.subscribe()
+    >>> bus.publish('leaf', {'index': 1})
+    >>> subscription.get(0)
+    ('leaf', {'index': 1})
+    >>> subscription.get(0) is None
+    True
+
+    >>> subscription.close()
+    >>> bus.publish('leaf', {'index': 2})
+    >>> subscription.get(0) is None
+    True
+
+    >>> bus.max_subscribers = 1
+    >>> subscription = bus.subscribe()
+    >>> bus.subscribe() is None
+    True
+    """
+
+    def __init__(self,
+                 maxsize: int = 100,
+                 max_subscribers: int = None) -> None:
+
+        self.maxsize = maxsize
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscriptions: typing.Set[Subscription] = set()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+    def subscribe(self) -> typing.Optional[Subscription]:
+        """ Start receiving events. Returns None if too many subscribers.
+        """
+
+        subscription = Subscription(self, self.maxsize)
+
+        with self._lock:
+            if (self.max_subscribers is not None
+                    and len(self._subscriptions) >= self.max_subscribers):
+
+                return None
+
+            self._subscriptions.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event: str, data: dict) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            subscription.put((event, data))
+
+
+def format_event(event: str, data: dict) -> bytes:
+    """ Format event as server-sent event.
+
+
+    >>> format_event('leaf', {'index': 1})
+    b'event: leaf\\ndata: {"index": 1}\\n\\n'
+    """
+
+    return 'event: {}\ndata: {}\n\n'.format(event,
+                                           json.dumps(data)).encode('utf-8')
+
+
+def parse_events(lines: typing.Iterable[str]) -> typing.Iterator[Event]:
+    """ Parse lines of server-sent events.
+
+
+    >>> lines = format_event('leaf', {'index': 1}).decode('utf-8').split('\\n')
+    >>> list(parse_events([': heartbeat', ''] + lines))
+    [('leaf', {'index': 1})]
+    """
+
+    event = 'message'
+    data: typing.List[str] = []
+
+    for line in lines:
+        if line == '':
+            if len(data) > 0:
+                yield event, json.loads('\n'.join(data))
+
+            event = 'message'
+            data = []
+        elif line.startswith(':'):
+            continue
+        elif line.startswith('event:'):
+            event = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            data.append(line[len('data:'):].strip())
@@ -0,0 +1,207 @@
+import concurrent.futures
+import logging
+import threading
+import time
+import typing
+
+import requests
+import requests.adapters
+
+from core import metrics
+
+
+logger = logging.getLogger(__name__)
+
+send_seconds = metrics.histogram('gossip_send_seconds',
+                                 'Duration of sending to a peer.',
+                                 ['peer'])
+send_failures = metrics.counter('gossip_send_failures_total',
+                                'Failed sends to a peer, including retries.',
+                                ['peer'])
+
+Sender = typing.Callable[[requests.Session, str], None]
+
+
+class Gossip:
+    """ Sender of requests to many peers concurrently.
+
+    Each peer has own session for reusing connections. Failed sends are
+    retried with exponential backoff. A peer that failed is demoted; it is
+    skipped until the cooldown is over and is not retried on the next send,
+    and it is dropped after failed `drop_after` times in a row. A client
+    error response is not retried, and does not demote the peer.
+
+
+    >>> gossip = Gossip(retries=0)
+    >>> def send(session, addr):
+    ...     if addr == 'http://bad':
+    ...         raise requests.ConnectionError('refused')
+
+    >>> sorted(gossip.broadcast(['http://good', 'http://bad'], send).items())
+    [('http://bad', False), ('http://good', True)]
+    >>> gossip.is_healthy('http://good'), gossip.is_healthy('http://bad')
+    (True, False)
+    >>> send_failures.get(peer='http://bad')
+    1
+
+    Demoted peer is skipped while cooling down.
+
+    >>> gossip.broadcast(['http://bad'], send)
+    {}
+
+    A peer that rejected the request is not demoted.
+
+    >>> def reject(session, addr):
+    ...     response = requests.Response()
+    ...     response.status_code = 400
+    ...     raise requests.HTTPError(response=response)
+
+    >>> gossip.broadcast(['http://good'], reject)
+    {'http://good': False}
+    >>> gossip.is_healthy('http://good')
+    True
+
+    >>> gossip.close()
+    """
+
+    def __init__(self,
+                 workers: int = 8,
+                 timeout: float = 5.0,
+                 retries: int = 2,
+                 backoff: float = 0.1,
+                 cooldown: float = 1.0,
+                 drop_after: int = 5,
+                 on_drop: typing.Callable[[str], None] = None) -> None:
+
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.drop_after = drop_after
+        self.on_drop = on_drop
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._lock = threading.Lock()
+        self._sessions: typing.Dict[str, requests.Session] = {}
+
+        # Number of failures in a row, and time to try again of demoted peers.
+        self._failures: typing.Dict[str, int] = {}
+        self._retry_at: typing.Dict[str, float] = {}
+
+    def session(self, addr: str) -> requests.Session:
+        """ Get session for the peer. """
+
+        with self._lock:
+            session = self._sessions.get(addr)
+
+            if session is None:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_maxsize=self.workers,
+                )
+
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[addr] = session
+
+            return session
+
+    def forget(self, addr: str) -> None:
+        """ Close session and forget health of the peer. """
+
+        with self._lock:
+            session = self._sessions.pop(addr, None)
+            self._failures.pop(addr, None)
+            self._retry_at.pop(addr, None)
+
+        if session is not None:
+            session.close()
+
+    def is_healthy(self, addr: str) -> bool:
+        """ Check the last send to the peer has not failed. """
+
+        with self._lock:
+            return addr not in self._failures
+
+    def _is_available(self, addr: str) -> bool:
+        with self._lock:
+            return self._retry_at.get(addr, 0.0) <= time.monotonic()
+
+    def _succeeded(self, addr: str) -> None:
+        with self._lock:
+            self._failures.pop(addr, None)
+            self._retry_at.pop(addr, None)
+
+    def _failed(self, addr: str) -> None:
+        with self._lock:
+            failures = self._failures.get(addr, 0) + 1
+            self._failures[addr] = failures
+            self._retry_at[addr] = (time.monotonic()
+                                    + self.cooldown * 2 ** (failures - 1))
+
+        if failures >= self.drop_after:
+            logger.warning('drop peer=%s failures=%d', addr, failures)
+
+            self.forget(addr)
+            if self.on_drop is not None:
+                self.on_drop(addr)
+
+    def _deliver(self, addr: str, send: Sender) -> bool:
+        retries = self.retries if self.is_healthy(addr) else 0
+
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            start = time.perf_counter()
+            try:
+                send(self.session(addr), addr)
+            except requests.HTTPError as e:
+                send_failures.inc(peer=addr)
+                logger.info('send failed peer=%s error=%s', addr, e)
+
+                # Client errors will not be fixed by retrying, and the peer
+                # is healthy because it responded.
+                if e.response is not None and e.response.status_code < 500:
+                    self._succeeded(addr)
+                    return False
+            except requests.RequestException as e:
+                send_failures.inc(peer=addr)
+                logger.info('send failed peer=%s error=%s', addr, e)
+            else:
+                send_seconds.observe(time.perf_counter() - start, peer=addr)
+                self._succeeded(addr)
+                return True
+
+        self._failed(addr)
+        return False
+
+    def broadcast(self,
+                  hosts: typing.Iterable[str],
+                  send: Sender) -> typing.Dict[str, bool]:
+
+        """ Call send for each available peer concurrently, and wait for all.
+
+        Returns whether succeeded or not for each peer that tried.
+        """
+
+        futures = {
+            addr: self._executor.submit(self._deliver, addr, send)
+            for addr in hosts
+            if self._is_available(addr)
+        }
+
+        return {addr: future.result() for addr, future in futures.items()}
+
+    def close(self) -> None:
+        """ Stop workers and close all sessions. """
+
+        self._executor.shutdown()
+
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+
+        for session in sessions:
+            session.close()
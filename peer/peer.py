@@ -1,16 +1,21 @@
-from wsgiref import simple_server
+import logging
+import typing
 
 import falcon
 
 import core
 from peer.chainmanager import ChainManager
-from peer import endpoint
+from peer import endpoint, wsgi
+
+
+logger = logging.getLogger(__name__)
 
 
 class Peer:
     def __init__(self, manager: ChainManager) -> None:
-        print('length={}, root={}'.format(len(manager.chain),
-                                          manager.chain[0].signature.hex()))
+        logger.info('loaded chain length=%d root=%s',
+                    len(manager.chain),
+                    manager.chain[0].signature.hex())
 
         self.manager = manager
         self.app = falcon.API()
@@ -18,17 +23,47 @@ class Peer:
         self.app.add_route('/connection', endpoint.ConnectResource(manager))
         self.app.add_route('/block', endpoint.BlockResource(manager))
         self.app.add_route('/block/{index:int}', endpoint.SingleBlockResource(manager))
+        self.app.add_route('/block/by-signature/{signature}',
+                           endpoint.BlockBySignatureResource(manager))
+        self.app.add_route('/header', endpoint.HeaderResource(manager))
         self.app.add_route('/message', endpoint.MessageResource(manager))
+        self.app.add_route('/message/{signature}',
+                           endpoint.SingleMessageResource(manager))
+        self.app.add_route('/message/{signature}/proof',
+                           endpoint.MessageProofResource(manager))
+        self.app.add_route('/events', endpoint.EventsResource(manager))
+        self.app.add_route('/work', endpoint.WorkResource(manager))
+        self.app.add_route('/metrics', endpoint.MetricsResource(manager))
 
     @classmethod
     def generate(cls, addr: str, rootuser: core.User) -> 'Peer':
-        print('made origin server')
+        logger.info('made origin server')
         return cls(ChainManager.generate(addr, rootuser))
 
     @classmethod
-    def clone(cls, addr: str, remote: str) -> 'Peer':
-        print('clone by {}'.format(remote))
-        return cls(ChainManager.clone(addr, remote))
+    def clone(cls,
+              addr: str,
+              remote: str,
+              checkpoints: typing.Iterable[core.chain.Checkpoint] = ()) \
+            -> 'Peer':
+
+        logger.info('clone remote=%s', remote)
+        return cls(ChainManager.clone(addr, remote, checkpoints))
+
+    @classmethod
+    def open(cls,
+             addr: str,
+             directory: str,
+             remote: str = None,
+             checkpoints: typing.Iterable[core.chain.Checkpoint] = (),
+             key: str = 'default') -> 'Peer':
+
+        logger.info('open directory=%s', directory)
+        return cls(ChainManager.open(addr,
+                                     directory,
+                                     remote,
+                                     checkpoints,
+                                     key))
 
     def __call__(self, environment, start_response):
         return self.app(environment, start_response)
@@ -37,12 +72,31 @@ class Peer:
         self.manager.connect(addr)
 
     def destroy(self) -> None:
-        self.manager.disconnect_all()
+        """ Disconnect from all peers and stop the verifying pool. """
+
+        try:
+            self.manager.disconnect_all()
+        finally:
+            core.batch.shutdown_pool()
+
+    def run(self, addr='localhost', port=50000, workers=16) -> None:
+        """ Serve until interrupted.
+
+        Requests are handled by `workers` threads at once, or one by one if
+        workers is 0. Subscribers of events hold a worker while connected,
+        so at most half of workers are given to them, and none if workers is
+        0.
+        """
+
+        self.manager.events.max_subscribers = workers // 2
 
-    def run(self, addr='localhost', port=50000) -> None:
-        server = simple_server.make_server(addr, port, self)
+        server = wsgi.make_server(addr, port, self, workers)
 
-        print('listening on http://{}:{}...'.format(addr, port))
+        logger.info('listening on http://%s:%d workers=%d subscribers=%d',
+                    addr,
+                    port,
+                    workers,
+                    self.manager.events.max_subscribers)
 
         try:
             server.serve_forever()
@@ -0,0 +1,86 @@
+import contextlib
+import threading
+import typing
+
+
+class RWLock:
+    """ The readers-writer lock.
+
+    Many readers can hold the lock at once, but a writer holds it alone.
+    Waiting writers block new readers, so writers are not starved by readers.
+    The lock is not reentrant.
+
+
+    >>> lock = RWLock()
+    >>> with lock.read():
+    ...     lock.acquire_write(blocking=False)
+    False
+    >>> with lock.write():
+    ...     lock.acquire_read(blocking=False)
+    False
+    >>> lock.acquire_write(blocking=False)
+    True
+    >>> lock.release_write()
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    def acquire_read(self, blocking: bool = True) -> bool:
+        with self._condition:
+            while self._writing or self._waiting_writers > 0:
+                if not blocking:
+                    return False
+                self._condition.wait()
+
+            self._readers += 1
+            return True
+
+    def release_read(self) -> None:
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self, blocking: bool = True) -> bool:
+        with self._condition:
+            if not blocking and (self._writing or self._readers > 0):
+                return False
+
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers > 0:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+
+            self._writing = True
+            return True
+
+    def release_write(self) -> None:
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read(self) -> typing.Iterator[None]:
+        """ Hold the lock as a reader in with statement. """
+
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write(self) -> typing.Iterator[None]:
+        """ Hold the lock as a writer in with statement. """
+
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -0,0 +1,74 @@
+import hashlib
+import threading
+import typing
+
+from core import miner
+
+
+class StaleTemplateError(Exception):
+    """ The template of work is not the leaf anymore. """
+
+
+class WorkAllocator:
+    """ The allocator of disjoint ranges of nonce for miners.
+
+    Ranges are allocated from the start of nonce space for each template,
+    that is the hash prefix of the leaf. The allocation is restarted when
+    the template is changed.
+
+
+    >>> allocator = WorkAllocator(size=100)
+    >>> template, start, stop = allocator.allocate(b'hello')
+    >>> start, stop
+    (0, 100)
+    >>> allocator.allocate(b'hello')[1:]
+    (100, 200)
+    >>> allocator.allocate(b'hello', size=10)[1:]
+    (200, 210)
+
+    >>> allocator.allocate(b'world')[1:]
+    (0, 100)
+    >>> template == WorkAllocator.template_id(b'hello')
+    True
+    """
+
+    def __init__(self, size: int = 1 << 20) -> None:
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._template: typing.Optional[str] = None
+        self._next = 0
+
+    @staticmethod
+    def template_id(prefix: bytes) -> str:
+        """ Get identifier of template. """
+
+        return hashlib.sha256(prefix).hexdigest()[:32]
+
+    def allocate(self,
+                 prefix: bytes,
+                 size: int = None) -> typing.Tuple[str, int, int]:
+
+        """ Allocate range of nonce for the template.
+
+        Returns identifier of the template, and start and stop of range.
+        Raises ValueError if the nonce space is exhausted.
+        """
+
+        if size is None:
+            size = self.size
+
+        template = self.template_id(prefix)
+
+        with self._lock:
+            if template != self._template:
+                self._template = template
+                self._next = 0
+
+            if self._next >= miner.NONCE_SPACE:
+                raise ValueError('nonce space is exhausted')
+
+            start = self._next
+            self._next = min(start + size, miner.NONCE_SPACE)
+
+            return template, start, self._next
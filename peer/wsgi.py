@@ -0,0 +1,85 @@
+import queue
+import socket
+import threading
+import typing
+from wsgiref import simple_server
+
+
+class ThreadPoolWSGIServer(simple_server.WSGIServer):
+    """ The WSGI server that handles requests on a pool of threads.
+
+    Requests are accepted in the thread of `serve_forever`, and handled by
+    at most `workers` threads at once. Workers are daemon threads, so long
+    lived responses like event streams do not block exiting.
+    """
+
+    def __init__(self,
+                 server_address: typing.Tuple[str, int],
+                 handler: typing.Type[simple_server.WSGIRequestHandler],
+                 workers: int = 16) -> None:
+
+        self._requests: 'queue.Queue[typing.Optional[tuple]]' = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+
+        super().__init__(server_address, handler)
+
+        for worker in self._workers:
+            worker.start()
+
+    def process_request(self,
+                        request: socket.socket,
+                        client_address: typing.Tuple[str, int]) -> None:
+
+        self._requests.put((request, client_address))
+
+    def _work(self) -> None:
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+
+        for _ in self._workers:
+            self._requests.put(None)
+
+
+def make_server(host: str,
+                port: int,
+                app: typing.Callable,
+                workers: int = 16) -> simple_server.WSGIServer:
+
+    """ Make WSGI server.
+
+    If workers is 0, make the server that handles one request at a time.
+
+
+    >>> server = make_server('localhost', 0, None, workers=4)
+    >>> isinstance(server, ThreadPoolWSGIServer)
+    True
+    >>> server.server_close()
+
+    >>> server = make_server('localhost', 0, None, workers=0)
+    >>> isinstance(server, ThreadPoolWSGIServer)
+    False
+    >>> server.server_close()
+    """
+
+    if workers == 0:
+        return simple_server.make_server(host, port, app)
+
+    server = ThreadPoolWSGIServer((host, port),
+                                  simple_server.WSGIRequestHandler,
+                                  workers)
+    server.set_app(app)
+    return server
@@ -1,21 +1,27 @@
-import sys
+import argparse
 
 import core
 import peer
 
 
 if __name__ == '__main__':
-    if len(sys.argv) <= 2:
-        print('./sendmessage.py [server address] [message]', file=sys.stderr)
-        sys.exit(1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('server', help='address of peer')
+    parser.add_argument('message', help='message to send')
+    parser.add_argument('--key',
+                        default='default',
+                        help='name of saved key to use, or generate if not'
+                             ' saved yet')
+    args = parser.parse_args()
 
-    user = core.User.generate()
-    print('user generated')
-    print(user.public_pem)
+    user, generated = core.KeyStore().load_or_generate(args.key)
+    if generated:
+        print('user generated')
+        print(user.public_pem)
 
-    message = core.Message(user, 'messaging', sys.argv[2])
+    message = core.Message(user, 'messaging', args.message)
 
-    peer.Client().post_message(sys.argv[1], message)
+    peer.Client().post_message(args.server, message)
 
-    print('sent message to {}'.format(sys.argv[1]))
+    print('sent message to {}'.format(args.server))
     print(message.as_json())
@@ -1,25 +1,82 @@
-import sys
+import argparse
+import logging
 import random
 
 import core
 import peer
 
 
-port = random.randint(50000, 60000)
-addr = 'http://localhost:{}'.format(port)
+def checkpoint(text: str) -> core.chain.Checkpoint:
+    """ Parse checkpoint in form of "index:signature in hex". """
 
+    index, signature = text.split(':', 1)
+    return int(index), bytes.fromhex(signature)
 
-if len(sys.argv) > 1:
-    app = peer.Peer.clone(addr, sys.argv[1])
-    for remote in sys.argv[1:]:
-        app.connect(remote)
-else:
-    rootuser = core.User.generate()
-    print('user generated')
-    print(rootuser.public_pem)
-    print()
-    app = peer.Peer.generate(addr, rootuser)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('remote', nargs='*', help='address of peers to connect')
+parser.add_argument('--data-dir', help='directory for storing blocks')
+parser.add_argument('--workers',
+                    type=int,
+                    default=16,
+                    help='number of threads for handling requests, or 0 for'
+                         ' handling one by one')
+parser.add_argument('--checkpoint',
+                    type=checkpoint,
+                    action='append',
+                    default=[],
+                    metavar='INDEX:SIGNATURE',
+                    help='trusted block; blocks up to it are not verified'
+                         ' when cloning. can be given many times')
+parser.add_argument('--key',
+                    default='default',
+                    help='name of saved key to use as the root user of new'
+                         ' chain, or generate if not saved yet')
+parser.add_argument('--log-level',
+                    default='info',
+                    choices=['debug', 'info', 'warning', 'error'],
+                    help='lowest level of logs to show; debug shows every'
+                         ' block and message')
+def main() -> None:
+    """ Run the peer with the command line arguments.
+
+    Processes of the verifying pool import this module again, so nothing
+    runs on import.
+    """
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, args.log_level.upper()),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+    )
+
+    # Started before any thread, and stopped by `peer.Peer.destroy`.
+    core.batch.start_pool()
+
+    port = random.randint(50000, 60000)
+    addr = 'http://localhost:{}'.format(port)
+
+    if args.data_dir is not None:
+        app = peer.Peer.open(addr,
+                             args.data_dir,
+                             (args.remote or [None])[0],
+                             args.checkpoint,
+                             args.key)
+        for remote in args.remote[1:]:
+            app.connect(remote)
+    elif len(args.remote) > 0:
+        app = peer.Peer.clone(addr, args.remote[0], args.checkpoint)
+        for remote in args.remote:
+            app.connect(remote)
+    else:
+        rootuser, generated = core.KeyStore().load_or_generate(args.key)
+        if generated:
+            logging.info('user generated\n%s', rootuser.public_pem)
+        app = peer.Peer.generate(addr, rootuser)
+
+    app.run(port=port, workers=args.workers)
 
 
 if __name__ == '__main__':
-    app.run(port=port)
+    main()
@@ -1,34 +1,89 @@
 import doctest
 import unittest
 
+import core.batch
 import core.block
+import core.blocktree
 import core.chain
+import core.codec
 import core.errors
+import core.headers
+import core.keystore
+import core.mempool
+import core.merkle
+import core.metrics
 import core.message
+import core.miner
+import core.store
 import core.user
 import peer.chainmanager
 import peer.client
 import peer.endpoint
+import peer.events
+import peer.gossip
 import peer.peer
+import peer.rwlock
+import peer.work
+import peer.wsgi
 
 
 class DocTest(unittest.TestCase):
+    def test_doctest_core_batch(self):
+        failure, _ = doctest.testmod(core.batch)
+        self.assertEqual(failure, 0)
+
     def test_doctest_core_block(self):
         failure, _ = doctest.testmod(core.block)
         self.assertEqual(failure, 0)
 
+    def test_doctest_core_blocktree(self):
+        failure, _ = doctest.testmod(core.blocktree)
+        self.assertEqual(failure, 0)
+
     def test_doctest_core_chain(self):
         failure, _ = doctest.testmod(core.chain)
         self.assertEqual(failure, 0)
 
+    def test_doctest_core_codec(self):
+        failure, _ = doctest.testmod(core.codec)
+        self.assertEqual(failure, 0)
+
     def test_doctest_core_errors(self):
         failure, _ = doctest.testmod(core.errors)
         self.assertEqual(failure, 0)
 
+    def test_doctest_core_headers(self):
+        failure, _ = doctest.testmod(core.headers)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_core_keystore(self):
+        failure, _ = doctest.testmod(core.keystore)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_core_mempool(self):
+        failure, _ = doctest.testmod(core.mempool)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_core_merkle(self):
+        failure, _ = doctest.testmod(core.merkle)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_core_metrics(self):
+        failure, _ = doctest.testmod(core.metrics)
+        self.assertEqual(failure, 0)
+
     def test_doctest_core_message(self):
         failure, _ = doctest.testmod(core.message)
         self.assertEqual(failure, 0)
 
+    def test_doctest_core_miner(self):
+        failure, _ = doctest.testmod(core.miner)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_core_store(self):
+        failure, _ = doctest.testmod(core.store)
+        self.assertEqual(failure, 0)
+
     def test_doctest_core_user(self):
         failure, _ = doctest.testmod(core.user)
         self.assertEqual(failure, 0)
@@ -45,6 +100,26 @@ class DocTest(unittest.TestCase):
         failure, _ = doctest.testmod(peer.endpoint)
         self.assertEqual(failure, 0)
 
+    def test_doctest_peer_events(self):
+        failure, _ = doctest.testmod(peer.events)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_peer_gossip(self):
+        failure, _ = doctest.testmod(peer.gossip)
+        self.assertEqual(failure, 0)
+
     def test_doctest_peer_peer(self):
         failure, _ = doctest.testmod(peer.peer)
         self.assertEqual(failure, 0)
+
+    def test_doctest_peer_rwlock(self):
+        failure, _ = doctest.testmod(peer.rwlock)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_peer_wsgi(self):
+        failure, _ = doctest.testmod(peer.wsgi)
+        self.assertEqual(failure, 0)
+
+    def test_doctest_peer_work(self):
+        failure, _ = doctest.testmod(peer.work)
+        self.assertEqual(failure, 0)